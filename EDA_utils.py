@@ -2,7 +2,9 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
 import numpy as np
+import pyarrow.parquet as pq
 from datetime import datetime
+from pathlib import Path
 
 
 def analyze_value_lists(df_item_properties_all: pd.DataFrame):
@@ -82,28 +84,193 @@ def analyze_value_lists(df_item_properties_all: pd.DataFrame):
         print(f"   {stat}: {val}")
 
 
-def analyze_available_field(df_item_properties_all, figsize=(20, 12)):
-    print("ДЕТАЛЬНЫЙ АНАЛИЗ ПОЛЯ AVAILABLE")
+DAY_MS = 86_400_000
+ITEM_BITS = 32  # ключ товаро-дня: (день << ITEM_BITS) | itemid
+
+
+def _iter_field_chunks(source, field, batch_rows):
+    """
+    Куски (timestamp, itemid, field) из DataFrame, parquet-файла
+    или итератора DataFrame, не больше batch_rows строк в памяти
+    """
+    columns = ["timestamp", "itemid", field]
+    if isinstance(source, pd.DataFrame):
+        for start in range(0, len(source), batch_rows):
+            yield source.iloc[start : start + batch_rows][columns]
+    elif isinstance(source, (str, Path)):
+        parquet = pq.ParquetFile(source)
+        for batch in parquet.iter_batches(batch_size=batch_rows, columns=columns):
+            yield batch.to_pandas()
+    else:
+        for chunk in source:
+            yield chunk[columns]
+
+
+def _sample_items_mask(itemid, sample_frac):
+    """Детерминированная выборка товаров по хэшу itemid (одинакова во всех кусках)"""
+    hashed = (itemid.astype(np.uint64) * np.uint64(0x9E3779B1)) & np.uint64(0xFFFFFFFF)
+    return hashed < np.uint64(int(sample_frac * 2**32))
+
+
+def build_items_daily(source, field, sample_frac=1.0, batch_rows=2_000_000):
+    """
+    Первое непустое значение поля на товаро-день (как groupby(["date", "itemid"])
+    .agg("first")) в целочисленном виде. Вход читается кусками; между кусками
+    хранятся только ключи товаро-дней и их первые значения, поэтому память
+    ограничена числом товаро-дней, а не числом строк.
+
+    Returns:
+        {"day": дни от эпохи, "itemid", "value": float64, NaN — значения нет},
+        отсортировано по (day, itemid)
+    """
+    keys = np.empty(0, dtype=np.int64)
+    value_keys = np.empty(0, dtype=np.int64)
+    values = np.empty(0, dtype=np.float64)
+
+    for chunk in _iter_field_chunks(source, field, batch_rows):
+        itemid = pd.to_numeric(chunk["itemid"], errors="coerce").to_numpy()
+        keep = ~np.isnan(itemid)
+        itemid = itemid[keep].astype(np.int64)
+        ts = chunk["timestamp"].to_numpy()[keep].astype(np.int64)
+        chunk_values = (
+            pd.to_numeric(chunk[field], errors="coerce").to_numpy(np.float64)[keep]
+        )
+        if sample_frac < 1.0:
+            sampled = _sample_items_mask(itemid, sample_frac)
+            itemid, ts, chunk_values = itemid[sampled], ts[sampled], chunk_values[sampled]
 
-    df_temp = df_item_properties_all.copy()
-    df_temp["datetime"] = pd.to_datetime(df_temp["timestamp"], unit="ms")
-    df_temp["date"] = df_temp["datetime"].dt.date
+        chunk_keys = ((ts // DAY_MS) << ITEM_BITS) | itemid
+        keys = np.union1d(keys, chunk_keys)
 
-    df_items_daily = (
-        df_temp.groupby(["date", "itemid"]).agg({"available": "first"}).reset_index()
+        # Первое вхождение: накопленное стоит раньше куска, куски идут по порядку строк
+        has_value = ~np.isnan(chunk_values)
+        value_keys, first = np.unique(
+            np.concatenate([value_keys, chunk_keys[has_value]]), return_index=True
+        )
+        values = np.concatenate([values, chunk_values[has_value]])[first]
+
+    daily_values = np.full(len(keys), np.nan)
+    daily_values[np.searchsorted(keys, value_keys)] = values
+    return {
+        "day": keys >> ITEM_BITS,
+        "itemid": keys & ((1 << ITEM_BITS) - 1),
+        "value": daily_values,
+    }
+
+
+def _items_daily_frame(daily, field):
+    """Товаро-дни в виде DataFrame (date, itemid, field) как в исходном анализе"""
+    days, inverse = np.unique(daily["day"], return_inverse=True)
+    dates = pd.to_datetime(days, unit="D").date
+    return pd.DataFrame(
+        {"date": dates[inverse], "itemid": daily["itemid"], field: daily["value"]}
     )
 
+
+def _daily_value_counts(daily, field):
+    """Число товаров с каждым значением поля по дням (date x значение)"""
+    has_value = ~np.isnan(daily["value"])
+    counts = (
+        pd.DataFrame({"day": daily["day"][has_value], field: daily["value"][has_value]})
+        .groupby(["day", field])
+        .size()
+        .unstack(fill_value=0)
+    )
+    counts.index = pd.Index(
+        pd.to_datetime(counts.index.to_numpy(), unit="D").date, name="date"
+    )
+    return counts
+
+
+def _item_sequences(daily):
+    """
+    Непустые значения товаров в порядке (itemid, день) и номер товара
+    каждого значения.
+
+    Returns:
+        items (itemid по возрастанию), group непустых значений, values
+    """
+    # Товаро-дни уже отсортированы по дню: стабильная сортировка по товару
+    order = np.argsort(daily["itemid"], kind="stable")
+    itemid, values = daily["itemid"][order], daily["value"][order]
+    items, group = np.unique(itemid, return_inverse=True)
+    has_value = ~np.isnan(values)
+    return items, group[has_value], values[has_value]
+
+
+def _item_changes(items, group, values, field):
+    """
+    Последнее непустое значение и число разных значений на товар
+    (как sort_values("date").groupby("itemid").last() и .nunique())
+    """
+    last = np.full(len(items), np.nan)
+    is_last = np.append(group[1:] != group[:-1], True) if len(group) else group
+    last[group[is_last]] = values[is_last]
+
+    order = np.lexsort((values, group))
+    sorted_group, sorted_values = group[order], values[order]
+    is_new = np.ones(len(order), dtype=bool)
+    is_new[1:] = (sorted_group[1:] != sorted_group[:-1]) | (
+        sorted_values[1:] != sorted_values[:-1]
+    )
+    nunique = np.bincount(sorted_group[is_new], minlength=len(items))
+
+    index = pd.Index(items, name="itemid")
+    return (
+        pd.Series(last, index=index, name=field),
+        pd.Series(nunique, index=index, name=field),
+    )
+
+
+def _transition_counts(group, values, nunique, max_items):
+    """
+    Переходы между последовательными непустыми значениями товара для первых
+    max_items товаров с изменениями, по убыванию частоты
+    """
+    sampled = np.zeros(len(nunique), dtype=bool)
+    sampled[np.flatnonzero(nunique > 1)[:max_items]] = True
+    pair = (group[1:] == group[:-1]) & sampled[group[1:]]
+    if not pair.any():
+        return pd.Series(dtype=np.int64)
+    transitions, counts = np.unique(
+        np.stack([values[:-1][pair], values[1:][pair]], axis=1),
+        axis=0,
+        return_counts=True,
+    )
+    labels = [f"{int(curr)}→{int(nxt)}" for curr, nxt in transitions]
+    return pd.Series(counts, index=labels).sort_values(ascending=False, kind="stable")
+
+
+def analyze_available_field(
+    df_item_properties_all,
+    figsize=(20, 12),
+    sample_frac=1.0,
+    batch_rows=2_000_000,
+):
+    """
+    Args:
+        df_item_properties_all: DataFrame, путь к parquet или итератор кусков
+            с колонками timestamp, itemid, available
+        sample_frac: доля товаров в анализе (выборка по хэшу itemid)
+        batch_rows: размер куска при чтении
+    """
+    print("ДЕТАЛЬНЫЙ АНАЛИЗ ПОЛЯ AVAILABLE")
+
+    daily = build_items_daily(
+        df_item_properties_all, "available", sample_frac, batch_rows
+    )
+    df_items_daily = _items_daily_frame(daily, "available")
+
     total_item_days = len(df_items_daily)
-    unique_items = df_items_daily["itemid"].nunique()
     available_stats = df_items_daily["available"].value_counts(dropna=False)
     available_coverage = df_items_daily["available"].notna().mean() * 100
 
-    items_last_available = (
-        df_items_daily.sort_values("date").groupby("itemid")["available"].last()
+    items, group, values = _item_sequences(daily)
+    unique_items = len(items)
+    items_last_available, item_available_changes = _item_changes(
+        items, group, values, "available"
     )
     items_available_stats = items_last_available.value_counts(dropna=False)
-
-    item_available_changes = df_items_daily.groupby("itemid")["available"].nunique()
     items_with_changes = (item_available_changes > 1).sum()
 
     print(f"Базовая статистика:")
@@ -155,9 +322,7 @@ def analyze_available_field(df_item_properties_all, figsize=(20, 12)):
             fontweight="bold",
         )
 
-    daily_available = (
-        df_items_daily.groupby(["date", "available"]).size().unstack(fill_value=0)
-    )
+    daily_available = _daily_value_counts(daily, "available")
     daily_available.plot(
         kind="area",
         stacked=True,
@@ -204,30 +369,11 @@ def analyze_available_field(df_item_properties_all, figsize=(20, 12)):
             fontweight="bold",
         )
 
-    changing_items = item_available_changes[item_available_changes > 1].index
-    if len(changing_items) > 0:
-        sample_items = changing_items[: min(5000, len(changing_items))]
-        transitions = []
-        for item in sample_items:
-            item_data = df_items_daily[df_items_daily["itemid"] == item].sort_values(
-                "date"
-            )
-            available_sequence = item_data["available"].dropna().tolist()
-            for i in range(len(available_sequence) - 1):
-                curr_val = (
-                    int(available_sequence[i])
-                    if pd.notna(available_sequence[i])
-                    else "NaN"
-                )
-                next_val = (
-                    int(available_sequence[i + 1])
-                    if pd.notna(available_sequence[i + 1])
-                    else "NaN"
-                )
-                transitions.append(f"{curr_val}→{next_val}")
-
-        if transitions:
-            transition_counts = pd.Series(transitions).value_counts()
+    if items_with_changes > 0:
+        transition_counts = _transition_counts(
+            group, values, item_available_changes.to_numpy(), 5000
+        )
+        if len(transition_counts):
             axes[1, 2].bar(
                 range(len(transition_counts)),
                 transition_counts.values,
@@ -307,30 +453,35 @@ def analyze_available_field(df_item_properties_all, figsize=(20, 12)):
 
 
 def analyze_categoryid_field(
-    df_properties_final, df_category_tree=None, figsize=(20, 12)
+    df_properties_final,
+    df_category_tree=None,
+    figsize=(20, 12),
+    sample_frac=1.0,
+    batch_rows=2_000_000,
 ):
+    """
+    Args:
+        df_properties_final: DataFrame, путь к parquet или итератор кусков
+            с колонками timestamp, itemid, categoryid
+        sample_frac: доля товаров в анализе (выборка по хэшу itemid)
+        batch_rows: размер куска при чтении
+    """
     print("ДЕТАЛЬНЫЙ АНАЛИЗ ПОЛЯ CATEGORYID")
 
-    df_temp = df_properties_final.copy()
-    df_temp["datetime"] = pd.to_datetime(df_temp["timestamp"], unit="ms")
-    df_temp["date"] = df_temp["datetime"].dt.date
-
-    df_items_daily = (
-        df_temp.groupby(["date", "itemid"]).agg({"categoryid": "first"}).reset_index()
-    )
+    daily = build_items_daily(df_properties_final, "categoryid", sample_frac, batch_rows)
+    df_items_daily = _items_daily_frame(daily, "categoryid")
 
     total_item_days = len(df_items_daily)
-    unique_items = df_items_daily["itemid"].nunique()
     categoryid_stats = df_items_daily["categoryid"].value_counts(dropna=False)
     categoryid_coverage = df_items_daily["categoryid"].notna().mean() * 100
     unique_categories = df_items_daily["categoryid"].nunique()
 
-    items_last_category = (
-        df_items_daily.sort_values("date").groupby("itemid")["categoryid"].last()
+    items, group, values = _item_sequences(daily)
+    unique_items = len(items)
+    items_last_category, item_category_changes = _item_changes(
+        items, group, values, "categoryid"
     )
     items_category_stats = items_last_category.value_counts(dropna=False)
-
-    item_category_changes = df_items_daily.groupby("itemid")["categoryid"].nunique()
     items_with_changes = (item_category_changes > 1).sum()
 
     print(f"total_item_days: {total_item_days:,}")
@@ -406,9 +557,7 @@ def analyze_categoryid_field(
         autotext.set_color("white")
         autotext.set_fontweight("bold")
 
-    daily_categories = (
-        df_items_daily.groupby(["date", "categoryid"]).size().unstack(fill_value=0)
-    )
+    daily_categories = _daily_value_counts(daily, "categoryid")
     top_10_categories = categoryid_stats.head(10).index
     top_10_categories = [cat for cat in top_10_categories if pd.notna(cat)][:8]
 
@@ -481,31 +630,11 @@ def analyze_categoryid_field(
             fontweight="bold",
         )
 
-    changing_items = item_category_changes[item_category_changes > 1].index
-
-    if len(changing_items) > 0:
-        sample_items = changing_items[: min(3000, len(changing_items))]
-        transitions = []
-        for item in sample_items:
-            item_data = df_items_daily[df_items_daily["itemid"] == item].sort_values(
-                "date"
-            )
-            category_sequence = item_data["categoryid"].dropna().tolist()
-            for i in range(len(category_sequence) - 1):
-                curr_cat = (
-                    int(category_sequence[i])
-                    if pd.notna(category_sequence[i])
-                    else "NaN"
-                )
-                next_cat = (
-                    int(category_sequence[i + 1])
-                    if pd.notna(category_sequence[i + 1])
-                    else "NaN"
-                )
-                transitions.append(f"{curr_cat}→{next_cat}")
-
-        if transitions:
-            transition_counts = pd.Series(transitions).value_counts().head(10)
+    if items_with_changes > 0:
+        transition_counts = _transition_counts(
+            group, values, item_category_changes.to_numpy(), 3000
+        ).head(10)
+        if len(transition_counts):
             axes[1, 2].barh(
                 range(len(transition_counts)),
                 transition_counts.values,
@@ -0,0 +1,283 @@
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+# implicit рекомендует однопоточный BLAS: параллелизм даёт сам ALS (num_threads)
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+os.environ.setdefault("MKL_NUM_THREADS", "1")
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import scipy.sparse
+
+from service.id_space import (
+    ALS_ITEMS_FILE,
+    ALS_SCORES_FILE,
+    ALS_USERS_FILE,
+    BIN_DIR,
+    ITEM_IDS_FILE,
+    SIM_ITEMS_FILE,
+    SIM_ITEMS_KEYS_FILE,
+    SIM_SCORES_FILE,
+    USER_IDS_FILE,
+    load_train_id_maps,
+)
+
+
+def load_user_item_matrix(
+    ratings_path: Path, n_users: Optional[int] = None, n_items: Optional[int] = None
+) -> scipy.sparse.csr_matrix:
+    """Разреженная матрица user-item из агрегатов user_item_ratings_train"""
+    table = pq.read_table(ratings_path, columns=["visitoridx", "itemidx", "rating"])
+    users = table.column("visitoridx").to_numpy().astype(np.int32)
+    items = table.column("itemidx").to_numpy().astype(np.int32)
+    ratings = table.column("rating").to_numpy().astype(np.float32)
+    del table
+
+    n_users = n_users or int(users.max()) + 1
+    n_items = n_items or int(items.max()) + 1
+    return scipy.sparse.csr_matrix(
+        (ratings, (users, items)), shape=(n_users, n_items), dtype=np.float32
+    )
+
+
+def load_id_maps(
+    als_dir: Path, transformer_path: Optional[Path] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Соответствие внутренних индексов исходным id.
+    Берётся из категорий трансформера (как create_id_mapping в features_and_als.ipynb)
+    или из существующих hash_*idx_train.json.
+    """
+    if transformer_path is not None:
+        import joblib
+
+        cats = joblib.load(transformer_path).named_transformers_["cats"].categories_
+        return (
+            np.asarray(cats[0], dtype=np.float64).astype(np.int32),
+            np.asarray(cats[2], dtype=np.float64).astype(np.int32),
+        )
+
+    user_ids, item_ids = load_train_id_maps(als_dir)
+    return user_ids.astype(np.int32), item_ids.astype(np.int32)
+
+
+def train_als(
+    user_item_matrix: scipy.sparse.csr_matrix,
+    factors: int = 50,
+    iterations: int = 50,
+    regularization: float = 0.05,
+    num_threads: int = 0,
+    random_state: int = 42,
+):
+    from implicit.als import AlternatingLeastSquares
+
+    als_model = AlternatingLeastSquares(
+        factors=factors,
+        iterations=iterations,
+        regularization=regularization,
+        random_state=random_state,
+        num_threads=num_threads,
+    )
+    als_model.fit(user_item_matrix)
+    return als_model
+
+
+def export_recommendations(
+    als_model,
+    user_item_matrix: scipy.sparse.csr_matrix,
+    user_ids: np.ndarray,
+    item_ids: np.ndarray,
+    out_dir: Path,
+    n: int = 100,
+    chunk_users: int = 50_000,
+) -> int:
+    """
+    Top-N ALS по пользователям с взаимодействиями, частями по chunk_users.
+    Результат пишется сразу в mmap-файлы, в памяти только текущая часть.
+    """
+    users_idx = np.flatnonzero(np.diff(user_item_matrix.indptr) > 0)
+    users_idx = users_idx[users_idx < len(user_ids)]
+    users_idx = users_idx[user_ids[users_idx] >= 0]
+    # Строки по возрастанию visitorid — поиск в сервисе через searchsorted
+    users_idx = users_idx[np.argsort(user_ids[users_idx], kind="stable")]
+    n = min(n, user_item_matrix.shape[1])
+
+    np.save(out_dir / ALS_USERS_FILE, user_ids[users_idx])
+    items_out = np.lib.format.open_memmap(
+        out_dir / ALS_ITEMS_FILE, mode="w+", dtype=np.int32, shape=(len(users_idx), n)
+    )
+    scores_out = np.lib.format.open_memmap(
+        out_dir / ALS_SCORES_FILE, mode="w+", dtype=np.float32, shape=(len(users_idx), n)
+    )
+
+    for start in range(0, len(users_idx), chunk_users):
+        chunk = users_idx[start : start + chunk_users]
+        ids, scores = als_model.recommend(
+            chunk, user_item_matrix[chunk], N=n, filter_already_liked_items=False
+        )
+        items_out[start : start + len(chunk)] = _to_item_ids(ids, item_ids)
+        scores_out[start : start + len(chunk)] = scores
+        print(f"  als: {min(start + chunk_users, len(users_idx)):,}/{len(users_idx):,}")
+
+    items_out.flush()
+    scores_out.flush()
+    return len(users_idx)
+
+
+def export_similar_items(
+    als_model,
+    item_ids: np.ndarray,
+    out_dir: Path,
+    n: int = 10,
+    chunk_items: int = 50_000,
+) -> int:
+    """Похожие товары (без самого товара) частями по chunk_items"""
+    items_idx = np.flatnonzero(item_ids >= 0)
+    items_idx = items_idx[items_idx < als_model.item_factors.shape[0]]
+    items_idx = items_idx[np.argsort(item_ids[items_idx], kind="stable")]
+    n = min(n, als_model.item_factors.shape[0] - 1)
+
+    np.save(out_dir / SIM_ITEMS_KEYS_FILE, item_ids[items_idx])
+    items_out = np.lib.format.open_memmap(
+        out_dir / SIM_ITEMS_FILE, mode="w+", dtype=np.int32, shape=(len(items_idx), n)
+    )
+    scores_out = np.lib.format.open_memmap(
+        out_dir / SIM_SCORES_FILE, mode="w+", dtype=np.float32, shape=(len(items_idx), n)
+    )
+
+    for start in range(0, len(items_idx), chunk_items):
+        chunk = items_idx[start : start + chunk_items]
+        ids, scores = als_model.similar_items(chunk, N=n + 1)
+        # Сам товар уводим в конец строки и отрезаем
+        order = np.argsort(ids == chunk[:, None], axis=1, kind="stable")[:, :n]
+        ids = np.take_along_axis(ids, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        items_out[start : start + len(chunk)] = _to_item_ids(ids, item_ids)
+        scores_out[start : start + len(chunk)] = scores
+        print(f"  similar: {min(start + chunk_items, len(items_idx)):,}/{len(items_idx):,}")
+
+    items_out.flush()
+    scores_out.flush()
+    return len(items_idx)
+
+
+def _to_item_ids(idx: np.ndarray, item_ids: np.ndarray) -> np.ndarray:
+    idx = np.asarray(idx, dtype=np.int64)
+    valid = (idx >= 0) & (idx < len(item_ids))
+    return np.where(valid, item_ids[np.clip(idx, 0, len(item_ids) - 1)], -1).astype(
+        np.int32
+    )
+
+
+def export_legacy(bin_dir: Path, als_dir: Path, user_ids: np.ndarray, item_ids: np.ndarray):
+    """Артефакты в старом формате (parquet + json) для совместимости с ноутбуками"""
+    user_idx = {int(uid): idx for idx, uid in enumerate(user_ids) if uid >= 0}
+    item_idx = {int(iid): idx for idx, iid in enumerate(item_ids) if iid >= 0}
+    to_item_idx = np.vectorize(lambda x: item_idx.get(int(x), -1), otypes=[np.int64])
+
+    users = np.load(bin_dir / ALS_USERS_FILE)
+    items = np.load(bin_dir / ALS_ITEMS_FILE, mmap_mode="r")
+    scores = np.load(bin_dir / ALS_SCORES_FILE, mmap_mode="r")
+    pd.DataFrame(
+        {
+            "visitoridx": np.repeat([user_idx[int(u)] for u in users], items.shape[1]),
+            "itemidx": to_item_idx(np.asarray(items).ravel()),
+            "rating": np.asarray(scores).ravel(),
+        }
+    ).to_parquet(als_dir / "als_recommendations.parquet")
+
+    keys = np.load(bin_dir / SIM_ITEMS_KEYS_FILE)
+    sim = np.load(bin_dir / SIM_ITEMS_FILE, mmap_mode="r")
+    sim_scores = np.load(bin_dir / SIM_SCORES_FILE, mmap_mode="r")
+    pd.DataFrame(
+        {
+            "sim_item_id_idx": to_item_idx(np.asarray(sim).ravel()),
+            "score": np.asarray(sim_scores).ravel(),
+            "items_idx": np.repeat([item_idx[int(i)] for i in keys], sim.shape[1]),
+        }
+    ).to_parquet(als_dir / "similar_items_df.parquet")
+
+    with open(als_dir / "hash_itemidx_train.json", "w") as f:
+        json.dump({float(i): float(v) for i, v in enumerate(item_ids) if v >= 0}, f)
+    with open(als_dir / "hash_visitoridx_train.json", "w") as f:
+        json.dump({float(i): float(v) for i, v in enumerate(user_ids) if v >= 0}, f)
+
+
+def run_pipeline(
+    als_dir: Path = Path("ALS_assets"),
+    ratings_path: Optional[Path] = None,
+    transformer_path: Optional[Path] = None,
+    factors: int = 50,
+    iterations: int = 50,
+    regularization: float = 0.05,
+    num_threads: int = 0,
+    n_recs: int = 100,
+    n_similar: int = 10,
+    chunk_size: int = 50_000,
+    legacy: bool = False,
+) -> Path:
+    als_dir = Path(als_dir)
+    bin_dir = als_dir / BIN_DIR
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    ratings_path = ratings_path or als_dir / "user_item_ratings_train.parquet"
+
+    t0 = time.perf_counter()
+    user_ids, item_ids = load_id_maps(als_dir, transformer_path)
+    matrix = load_user_item_matrix(ratings_path, len(user_ids), len(item_ids))
+    np.save(bin_dir / USER_IDS_FILE, user_ids)
+    np.save(bin_dir / ITEM_IDS_FILE, item_ids)
+    print(f"Матрица {matrix.shape}, nnz={matrix.nnz:,}: {time.perf_counter() - t0:.1f}с")
+
+    t0 = time.perf_counter()
+    als_model = train_als(matrix, factors, iterations, regularization, num_threads)
+    als_model.save(als_dir / "als_model.npz")
+    print(f"Обучение ALS: {time.perf_counter() - t0:.1f}с")
+
+    t0 = time.perf_counter()
+    n_users = export_recommendations(
+        als_model, matrix, user_ids, item_ids, bin_dir, n_recs, chunk_size
+    )
+    n_items = export_similar_items(als_model, item_ids, bin_dir, n_similar, chunk_size)
+    print(
+        f"Рекомендации для {n_users:,} пользователей, похожие для {n_items:,} товаров: "
+        f"{time.perf_counter() - t0:.1f}с"
+    )
+
+    if legacy:
+        export_legacy(bin_dir, als_dir, user_ids, item_ids)
+    return bin_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Обучение ALS и выгрузка артефактов")
+    parser.add_argument("--als-dir", default=Path("ALS_assets"), type=Path)
+    parser.add_argument("--ratings", default=None, type=Path)
+    parser.add_argument("--transformer", default=None, type=Path)
+    parser.add_argument("--factors", default=50, type=int)
+    parser.add_argument("--iterations", default=50, type=int)
+    parser.add_argument("--regularization", default=0.05, type=float)
+    parser.add_argument("--threads", default=0, type=int)
+    parser.add_argument("--n-recs", default=100, type=int)
+    parser.add_argument("--n-similar", default=10, type=int)
+    parser.add_argument("--chunk-size", default=50_000, type=int)
+    parser.add_argument("--legacy", action="store_true")
+    args = parser.parse_args()
+
+    run_pipeline(
+        als_dir=args.als_dir,
+        ratings_path=args.ratings,
+        transformer_path=args.transformer,
+        factors=args.factors,
+        iterations=args.iterations,
+        regularization=args.regularization,
+        num_threads=args.threads,
+        n_recs=args.n_recs,
+        n_similar=args.n_similar,
+        chunk_size=args.chunk_size,
+        legacy=args.legacy,
+    )
@@ -0,0 +1,197 @@
+import argparse
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pcsv
+import pyarrow.parquet as pq
+
+
+RAW_COLUMNS = ["timestamp", "itemid", "property", "value"]
+STAT_COLUMNS = [
+    "value_count",
+    "value_first",
+    "value_last",
+    "value_min",
+    "value_max",
+    "value_mean",
+    "value_std",
+]
+# Число в токене значения (как в value_str_to_list из EDA.ipynb)
+NUMBER_PATTERN = r"^[+-]?\d+(?:\.\d+)?$"
+
+
+def parse_value_tokens(values: pa.Array) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Строки value -> числовые токены. Маркер "n" перед числом заменяется пробелом,
+    строка делится по пробелам, нечисловые токены отбрасываются.
+
+    Returns:
+        номер строки каждого токена (неубывающий), значения float64, число строк
+    """
+    values = pc.fill_null(pc.cast(values, pa.string()), "")
+    tokens = pc.utf8_split_whitespace(pc.replace_substring(values, "n", " "))
+    parents = pc.list_parent_indices(tokens)
+    flat = pc.list_flatten(tokens)
+    numeric = pc.match_substring_regex(flat, NUMBER_PATTERN)
+    numbers = pc.cast(pc.filter(flat, numeric), pa.float64()).to_numpy()
+    parents = pc.filter(parents, numeric).to_numpy()
+    return parents.astype(np.int64), numbers, len(values)
+
+
+def value_stats(values: pa.Array) -> Dict[str, np.ndarray]:
+    """
+    Агрегаты числовых токенов по строкам (как create_value_stats в EDA.ipynb):
+    count/first/last/min/max/mean/std; пустой список -> 0/-1/-1/-1/-1/-1.0/0.0.
+    """
+    parents, numbers, n = parse_value_tokens(values)
+    count = np.bincount(parents, minlength=n)
+    has = count > 0
+    ends = np.cumsum(count)
+    starts = ends - count
+
+    stats = {
+        "value_count": count.astype(np.int32),
+        "value_first": np.full(n, -1.0),
+        "value_last": np.full(n, -1.0),
+        "value_min": np.full(n, -1.0),
+        "value_max": np.full(n, -1.0),
+        "value_mean": np.full(n, -1.0),
+        "value_std": np.zeros(n),
+    }
+    if not len(numbers):
+        return stats
+
+    nonempty = starts[has]
+    stats["value_first"][has] = numbers[nonempty]
+    stats["value_last"][has] = numbers[ends[has] - 1]
+    stats["value_min"][has] = np.minimum.reduceat(numbers, nonempty)
+    stats["value_max"][has] = np.maximum.reduceat(numbers, nonempty)
+
+    mean = np.bincount(parents, weights=numbers, minlength=n)[has] / count[has]
+    stats["value_mean"][has] = mean
+    # Дисперсия в два прохода: устойчиво для больших хэшей значений
+    full_mean = np.zeros(n)
+    full_mean[has] = mean
+    sq = np.bincount(parents, weights=(numbers - full_mean[parents]) ** 2, minlength=n)
+    stats["value_std"][has] = np.sqrt(sq[has] / count[has])
+    return stats
+
+
+def parse_table(table: pa.Table) -> pd.DataFrame:
+    """Сырые строки (timestamp, itemid, property, value) -> типизированные агрегаты"""
+    stats = value_stats(table.column("value").combine_chunks())
+    frame = pd.DataFrame(
+        {
+            "timestamp": pc.cast(table.column("timestamp"), pa.int64()).to_numpy(),
+            "itemid": pc.cast(table.column("itemid"), pa.int64()).to_numpy(),
+            "property": table.column("property").to_pandas().astype(str),
+        }
+    )
+    for col in STAT_COLUMNS:
+        frame[col] = stats[col]
+    return frame
+
+
+def _parse_row_group(path: Path, row_group: int, out_path: Path) -> int:
+    """Один row group parquet -> один parquet с агрегатами (выполняется в воркере)"""
+    table = pq.ParquetFile(path).read_row_group(row_group, columns=RAW_COLUMNS)
+    frame = parse_table(table)
+    frame.to_parquet(out_path, index=False)
+    return len(frame)
+
+
+def _parse_batch(batch: pa.RecordBatch, out_path: Path) -> int:
+    frame = parse_table(pa.Table.from_batches([batch]))
+    frame.to_parquet(out_path, index=False)
+    return len(frame)
+
+
+def _merge_batches(batches: List[pa.RecordBatch]) -> pa.RecordBatch:
+    return pa.Table.from_batches(batches).combine_chunks().to_batches()[0]
+
+
+def parse_item_properties(
+    inputs: List[Path],
+    out_dir: Path,
+    n_workers: Optional[int] = None,
+    batch_rows: int = 1_000_000,
+) -> Path:
+    """
+    Потоковый разбор item_properties в пуле процессов. Parquet читается
+    по row group'ам в воркерах; CSV — потоковым ридером в родителе
+    блоками по batch_rows, в работе не больше 2 * n_workers блоков.
+    Каждая часть пишется отдельным parquet в out_dir.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    n_workers = n_workers or os.cpu_count() or 1
+
+    part_no, total = 0, 0
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        pending = set()
+
+        def submit(fn, *args):
+            nonlocal part_no, total
+            # Ограничение памяти: ждём, пока очередь не опустеет до лимита
+            while len(pending) >= 2 * n_workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    total += fut.result()
+                    pending.remove(fut)
+            out_path = out_dir / f"part-{part_no:05d}.parquet"
+            pending.add(pool.submit(fn, *args, out_path))
+            part_no += 1
+
+        for path in map(Path, inputs):
+            print(f"Разбор {path}...")
+            if path.suffix == ".parquet":
+                for rg in range(pq.ParquetFile(path).num_row_groups):
+                    submit(_parse_row_group, path, rg)
+            else:
+                reader = pcsv.open_csv(
+                    path,
+                    read_options=pcsv.ReadOptions(block_size=16 * 2**20),
+                    convert_options=pcsv.ConvertOptions(
+                        column_types={"value": pa.string(), "property": pa.string()},
+                        include_columns=RAW_COLUMNS,
+                    ),
+                )
+                buffer, buffered = [], 0
+                for batch in reader:
+                    buffer.append(batch)
+                    buffered += batch.num_rows
+                    if buffered >= batch_rows:
+                        submit(_parse_batch, _merge_batches(buffer))
+                        buffer, buffered = [], 0
+                if buffer:
+                    submit(_parse_batch, _merge_batches(buffer))
+
+        for fut in pending:
+            total += fut.result()
+
+    print(f"Строк: {total:,}, частей: {part_no}")
+    return out_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Разбор value из item_properties в агрегаты value_*"
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="+",
+        type=Path,
+        help="item_properties_part*.csv или parquet (timestamp, itemid, property, value)",
+    )
+    parser.add_argument("--out-dir", default=Path("data/item_properties_values"), type=Path)
+    parser.add_argument("--workers", default=None, type=int)
+    parser.add_argument("--batch-rows", default=1_000_000, type=int)
+    args = parser.parse_args()
+
+    parse_item_properties(args.inputs, args.out_dir, args.workers, args.batch_rows)
@@ -0,0 +1,305 @@
+from itertools import chain
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+from catboost import Pool
+
+from service.pre_ranker import PreRanker
+
+
+# Рекомендации в "длинном" виде: (пользователь, товар, позиция)
+RecArrays = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def build_group_sizes(df):
+    return df.groupby(["visitorid", "anchor_session_id"]).size().tolist()
+
+
+def _segment_starts(*keys: np.ndarray) -> np.ndarray:
+    """Начала сегментов в массивах, отсортированных по ключам"""
+    n = len(keys[0])
+    change = np.zeros(n, dtype=bool)
+    change[:1] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(change)
+
+
+def _discounts(n: int) -> np.ndarray:
+    return 1.0 / np.log2(np.arange(n, dtype=np.float64) + 2.0)
+
+
+def _tie_averaged_dcg(
+    group: np.ndarray, labels: np.ndarray, scores: np.ndarray, k: int, n_groups: int
+) -> np.ndarray:
+    """
+    DCG@k по группам за один проход; как в sklearn.ndcg_score, для товаров
+    с одинаковым скором усредняются выигрыши (ignore_ties=False).
+    """
+    o = np.lexsort((-scores, group))
+    g, y, p = group[o], labels[o], scores[o]
+
+    starts = _segment_starts(g)
+    sizes = np.diff(np.append(starts, len(g)))
+    rank = np.arange(len(g)) - np.repeat(starts, sizes)
+    disc = np.where(rank < k, _discounts(len(g))[rank], 0.0)
+
+    tie_starts = _segment_starts(g, p)
+    tie_sizes = np.diff(np.append(tie_starts, len(g)))
+    tie_gain = np.add.reduceat(y, tie_starts) / tie_sizes
+    tie_disc = np.add.reduceat(disc, tie_starts)
+    return np.bincount(g[tie_starts], weights=tie_gain * tie_disc, minlength=n_groups)
+
+
+def ndcg_grouped(
+    group: np.ndarray, labels: np.ndarray, scores: np.ndarray, ks=(5, 10, 20)
+) -> Dict[str, float]:
+    """
+    NDCG@k, усреднённый по группам (группы из <2 элементов пропускаются).
+    group — целочисленные коды групп, порядок строк произвольный.
+    """
+    group = np.asarray(group)
+    labels = np.asarray(labels, dtype=np.float64)
+    scores = np.asarray(scores, dtype=np.float64)
+    if not len(group):
+        return {f"ndcg_{k}": np.nan for k in ks}
+    n_groups = int(group.max()) + 1
+    valid = np.bincount(group, minlength=n_groups) >= 2
+
+    metrics = {}
+    for k in ks:
+        dcg = _tie_averaged_dcg(group, labels, scores, k, n_groups)
+        idcg = _tie_averaged_dcg(group, labels, labels, k, n_groups)
+        ndcg = np.divide(dcg, idcg, out=np.zeros_like(dcg), where=idcg > 0)
+        metrics[f"ndcg_{k}"] = float(ndcg[valid].mean()) if valid.any() else np.nan
+    return metrics
+
+
+def eval_ndcg_per_group(df, preds, ks=(5, 10, 20)):
+    group, _ = pd.MultiIndex.from_arrays(
+        [df["visitorid"], df["anchor_session_id"]]
+    ).factorize()
+    return ndcg_grouped(group, df["gain"].to_numpy(), np.asarray(preds), ks)
+
+
+def recs_from_dict(recommendations: dict, k: int) -> RecArrays:
+    """{пользователь: [товары]} -> длинные массивы (пользователь, товар, позиция)"""
+    lists = [list(v)[:k] for v in recommendations.values()]
+    lens = np.fromiter(map(len, lists), dtype=np.int64, count=len(lists))
+    users = np.repeat(
+        np.asarray(list(recommendations.keys()), dtype=np.float64).astype(np.int64),
+        lens,
+    )
+    items = np.asarray(
+        list(chain.from_iterable(lists)), dtype=np.float64
+    ).astype(np.int64)
+    ranks = np.arange(len(items)) - np.repeat(np.cumsum(lens) - lens, lens)
+    return users, items, ranks
+
+
+def top_k_per_group(
+    groups: np.ndarray, users: np.ndarray, items: np.ndarray, scores: np.ndarray, k: int
+) -> RecArrays:
+    """Top-k товаров по скору в каждой группе (сессии) — без цикла по группам"""
+    o = np.lexsort((-np.asarray(scores), groups))
+    g = np.asarray(groups)[o]
+    starts = _segment_starts(g)
+    sizes = np.diff(np.append(starts, len(g)))
+    rank = np.arange(len(g)) - np.repeat(starts, sizes)
+    keep = rank < k
+    return (
+        np.asarray(users, dtype=np.int64)[o][keep],
+        np.asarray(items, dtype=np.int64)[o][keep],
+        rank[keep],
+    )
+
+
+def _cut_recs(users, items, ranks, k: int) -> RecArrays:
+    """Первые k позиций каждого пользователя"""
+    o = np.lexsort((ranks, users))
+    u, i = users[o], items[o]
+    starts = _segment_starts(u)
+    sizes = np.diff(np.append(starts, len(u)))
+    rank = np.arange(len(u)) - np.repeat(starts, sizes)
+    keep = rank < k
+    return u[keep], i[keep], rank[keep]
+
+
+def _dedupe_recs(users, items, ranks) -> RecArrays:
+    """Убирает повторы (пользователь, товар), оставляя первую позицию"""
+    o = np.lexsort((ranks, items, users))
+    u, i, r = users[o], items[o], ranks[o]
+    first = np.ones(len(u), dtype=bool)
+    first[1:] = (u[1:] != u[:-1]) | (i[1:] != i[:-1])
+    return u[first], i[first], r[first]
+
+
+def evaluate_models(
+    models: Dict[str, RecArrays],
+    test_df: pd.DataFrame,
+    k: int = 10,
+    min_gain: float = None,
+) -> pd.DataFrame:
+    """
+    Precision/Recall/F1/NDCG/MAP@k, coverage и novelty для всех моделей
+    одним векторным проходом по массивам, отсортированным по (модель, пользователь).
+
+    Истинные взаимодействия — пары (visitorid, itemid) из test_df
+    (при min_gain — только строки с gain >= min_gain).
+    """
+    truth = test_df
+    if min_gain is not None:
+        truth = truth[truth["gain"] >= min_gain]
+    t_users = truth["visitorid"].to_numpy(dtype=np.int64)
+    t_items = truth["itemid"].to_numpy(dtype=np.int64)
+
+    all_items = test_df["itemid"].to_numpy(dtype=np.int64)
+    pop_items, pop_counts = np.unique(all_items, return_counts=True)
+    pop_share = pop_counts / max(1, len(all_items))
+
+    names = list(models)
+    cut = [_cut_recs(*models[name], k) for name in names]
+    parts = [_dedupe_recs(*p) for p in cut]
+    model = np.repeat(np.arange(len(names)), [len(p[0]) for p in parts])
+    users = np.concatenate([p[0] for p in parts]) if parts else np.empty(0, np.int64)
+    items = np.concatenate([p[1] for p in parts]) if parts else np.empty(0, np.int64)
+    ranks = np.concatenate([p[2] for p in parts]) if parts else np.empty(0, np.int64)
+
+    base = int(max(items.max(initial=0), t_items.max(initial=0))) + 1
+    truth_keys = np.unique(t_users * base + t_items)
+    truth_user, truth_cnt = np.unique(truth_keys // base, return_counts=True)
+    hits = np.isin(users * base + items, truth_keys).astype(np.float64)
+
+    # Покрытие и новизна — по всем рекомендациям модели (как в ноутбуке)
+    coverage = np.zeros(len(names))
+    novelty = np.zeros(len(names))
+    n_recs = np.array([len(p[0]) for p in cut], dtype=np.int64)
+    for m in range(len(names)):
+        m_items = cut[m][1]
+        coverage[m] = len(np.unique(m_items)) / max(1, len(pop_items))
+        pos = np.clip(np.searchsorted(pop_items, m_items), 0, len(pop_items) - 1)
+        found = pop_items[pos] == m_items if len(pop_items) else np.zeros(0, bool)
+        novelty[m] = -np.log(pop_share[pos[found]]).mean() if found.any() else 0.0
+
+    # Только пользователи, присутствующие в тесте
+    evaluated = np.isin(users, truth_user)
+    model, users, ranks, hits = (
+        model[evaluated],
+        users[evaluated],
+        ranks[evaluated],
+        hits[evaluated],
+    )
+    o = np.lexsort((ranks, users, model))
+    model, users, ranks, hits = model[o], users[o], ranks[o], hits[o]
+
+    starts = _segment_starts(model, users)
+    seg_model = model[starts]
+    n_segs = len(starts)
+    if n_segs:
+        sizes = np.diff(np.append(starts, len(users)))
+        seg_hits = np.add.reduceat(hits, starts)
+        n_true = truth_cnt[np.searchsorted(truth_user, users[starts])]
+
+        precision = seg_hits / sizes
+        recall = seg_hits / n_true
+        f1 = np.divide(
+            2 * precision * recall,
+            precision + recall,
+            out=np.zeros(n_segs),
+            where=(precision + recall) > 0,
+        )
+
+        disc = _discounts(k)
+        ideal = np.cumsum(disc)[np.minimum(n_true, k) - 1]
+        ndcg = np.add.reduceat(hits * disc[ranks], starts) / ideal
+
+        cum_hits = np.cumsum(hits)
+        seg_offset = np.repeat(cum_hits[starts] - hits[starts], sizes)
+        prec_at_rank = (cum_hits - seg_offset) / (ranks + 1)
+        ap = np.add.reduceat(hits * prec_at_rank, starts) / np.minimum(n_true, k)
+    else:
+        precision = recall = f1 = ndcg = ap = np.zeros(0)
+
+    n_users = np.bincount(seg_model, minlength=len(names))
+
+    def _mean(values):
+        sums = np.bincount(seg_model, weights=values, minlength=len(names))
+        return np.divide(sums, n_users, out=np.zeros(len(names)), where=n_users > 0)
+
+    return pd.DataFrame(
+        {
+            "model_name": names,
+            "k": k,
+            "precision_at_k": _mean(precision),
+            "recall_at_k": _mean(recall),
+            "f1_at_k": _mean(f1),
+            "ndcg_at_k": _mean(ndcg),
+            "map_at_k": _mean(ap),
+            "coverage": coverage,
+            "novelty": novelty,
+            "num_users_evaluated": n_users,
+            "num_recommendations": n_recs,
+        }
+    )
+
+
+def calculate_recommendation_metrics(
+    recommendations: dict,
+    test_range_model: pd.DataFrame,
+    k: int = 15,
+    model_name: str = "model",
+) -> dict:
+    """Совместимая обёртка над evaluate_models для одной модели"""
+    result = evaluate_models(
+        {model_name: recs_from_dict(recommendations, k)}, test_range_model, k
+    )
+    return result.iloc[0].to_dict()
+
+
+def evaluate_cascade(
+    df: pd.DataFrame,
+    model,
+    pre_ranker: PreRanker,
+    features: list,
+    cat_features: list,
+    top_ms=(20, 50, 100),
+    ks=(5, 10, 20),
+) -> pd.DataFrame:
+    """
+    Офлайн-оценка каскада: NDCG полного CatBoost против пре-ранкер + CatBoost на top M.
+    df должен быть отсортирован по group_id (как test в range_model.ipynb).
+    Кандидаты, отсечённые пре-ранкером, ставятся в конец выдачи группы.
+    """
+    pool = Pool(df[features], group_id=df["group_id"], cat_features=cat_features)
+    preds = model.predict(pool)
+
+    pre_scores = pd.Series(pre_ranker.score(df), index=df.index)
+    pre_rank = pre_scores.groupby(df["group_id"].values).rank(
+        method="first", ascending=False
+    )
+    n_pos = int((df["gain"] > 0).sum())
+
+    rows = [{"top_m": "full", **eval_ndcg_per_group(df, preds, ks), "pos_recall": 1.0}]
+    floor = preds.min() - 1.0
+    for m in top_ms:
+        keep = (pre_rank <= m).to_numpy()
+        cascade_preds = np.where(keep, preds, floor)
+        pos_kept = int(((df["gain"] > 0).to_numpy() & keep).sum())
+        rows.append(
+            {
+                "top_m": m,
+                **eval_ndcg_per_group(df, cascade_preds, ks),
+                "pos_recall": pos_kept / n_pos if n_pos else np.nan,
+                "share_ranked": float(keep.mean()),
+            }
+        )
+
+    # Пре-ранкер сам по себе (без CatBoost)
+    rows.append(
+        {
+            "top_m": "pre_ranker_only",
+            **eval_ndcg_per_group(df, pre_scores.to_numpy(), ks),
+        }
+    )
+    return pd.DataFrame(rows)
@@ -0,0 +1,398 @@
+import argparse
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from service.feature_generator import generate_candidate_ids, sim_max_scores
+from service.id_space import (
+    CSRLists,
+    IdMap,
+    build_als_index,
+    load_als_pairs,
+    lookup_scores,
+    save_item_popularity,
+)
+from service.item_timeline import ItemPropertyTimeline
+from service.recommender_repository import ITEM_CAT_PROPS
+
+
+EVENT_WEIGHTS = {"transaction": 5, "addtocart": 3, "view": 1}
+
+SESSION_COLS_MAP = {
+    "session_id": "anchor_session_id",
+    "n_events": "sess_n_events",
+    "n_items": "sess_n_items",
+    "duration_sec": "sess_duration",
+    "cnt_event_view": "sess_cnt_view",
+    "cnt_event_addtocart": "sess_cnt_addtocart",
+    "cnt_event_transaction": "sess_cnt_transaction",
+}
+
+# Контекст воркера: справочники загружаются один раз на процесс
+_CTX: Dict = {}
+
+
+def load_lookups(als_dir: Path) -> Tuple[IdMap, IdMap, CSRLists, CSRLists]:
+    """ALS-рекомендации и похожие товары в том же виде, что в RecommenderRepository"""
+    return build_als_index(load_als_pairs(als_dir))
+
+
+def build_item_popularity(events_path: Path, batch_rows: int = 1_000_000) -> pd.Series:
+    """Популярность товаров по весам событий — потоковая агрегация по батчам parquet"""
+    pop = None
+    pf = pq.ParquetFile(events_path)
+    for batch in pf.iter_batches(batch_size=batch_rows, columns=["itemid", "event"]):
+        df = batch.to_pandas()
+        weights = df["event"].map(EVENT_WEIGHTS).fillna(0).astype(np.float32)
+        part = weights.groupby(df["itemid"].values).sum()
+        pop = part if pop is None else pop.add(part, fill_value=0.0)
+    if pop is None:
+        return pd.Series(dtype="float32")
+    pop.index = pop.index.astype("int64")
+    return pop.sort_values(ascending=False).astype("float32")
+
+
+def export_item_popularity(
+    events_path: Path, als_dir: Path = Path("ALS_assets"), batch_rows: int = 1_000_000
+) -> pd.Series:
+    """
+    Популярность товаров для сервиса (индекс категорий, пре-ранкер) рядом
+    с bin-артефактами ALS. Отдельный шаг: считается только по событиям
+    обучения, сборка датасетов артефакты сервиса не меняет.
+    """
+    item_pop = build_item_popularity(Path(events_path), batch_rows)
+    save_item_popularity(Path(als_dir), item_pop.index.to_numpy(), item_pop.to_numpy())
+    print(f"Популярность {len(item_pop):,} товаров по {events_path} сохранена в {als_dir}")
+    return item_pop
+
+
+def visitor_ranges(targets_path: Path, chunk_anchors: int) -> List[Tuple[int, int]]:
+    """Диапазоны visitorid, в каждом около chunk_anchors якорных сессий"""
+    anchors = pq.read_table(
+        targets_path, columns=["visitorid", "anchor_session_id"]
+    ).to_pandas()
+    per_user = (
+        anchors.drop_duplicates()
+        .groupby("visitorid")
+        .size()
+        .sort_index()
+    )
+    del anchors
+
+    users = per_user.index.to_numpy()
+    chunk_no = (per_user.cumsum().to_numpy() - 1) // max(1, chunk_anchors)
+    bounds = np.flatnonzero(np.diff(chunk_no)) + 1
+    starts = np.concatenate([[0], bounds])
+    ends = np.concatenate([bounds, [len(users)]]) - 1
+    return [(int(users[s]), int(users[e])) for s, e in zip(starts, ends)]
+
+
+def _read_range(path: Path, lo: int, hi: int, columns=None) -> pd.DataFrame:
+    """Чтение строк с visitorid в [lo, hi] (row group'ы отсекаются по статистике)"""
+    return pq.read_table(
+        path,
+        columns=columns,
+        filters=[("visitorid", ">=", lo), ("visitorid", "<=", hi)],
+    ).to_pandas()
+
+
+def build_chunk(
+    events: pd.DataFrame,
+    sessions: pd.DataFrame,
+    targets: pd.DataFrame,
+    props: Optional[pd.DataFrame],
+    als_index: Tuple[IdMap, IdMap, CSRLists, CSRLists],
+    item_pop: pd.Series,
+    last_k: int = 5,
+    n_als: int = 100,
+    n_sim: int = 50,
+    n_pop: int = 50,
+    props_timeline: Optional[ItemPropertyTimeline] = None,
+) -> pd.DataFrame:
+    """
+    Датасет для ранжирования по части якорных сессий.
+    С props_timeline свойства товаров берутся на момент якоря (as-of),
+    а не последние известные.
+    """
+    users, items, als, sim = als_index
+    anchors = targets[["visitorid", "anchor_session_id"]].drop_duplicates()
+    if anchors.empty:
+        return pd.DataFrame()
+
+    ev = events[events["session_id"].isin(anchors["anchor_session_id"])]
+    anchor_ts = ev.groupby("session_id")["ts_event"].min()
+
+    # Последние K товаров сессии — от новых к старым, как в EventStore
+    ev = ev.sort_values(["session_id", "ts_event"], ascending=[True, False])
+    recent = (
+        ev.groupby("session_id", sort=False)
+        .head(last_k)
+        .assign(itemid=lambda d: d["itemid"].astype("int64"))
+        .groupby("session_id", sort=False)["itemid"]
+        .agg(list)
+    )
+    positives = (
+        targets.assign(itemid=targets["itemid"].astype("int64"))
+        .groupby("anchor_session_id")["itemid"]
+        .agg(list)
+    )
+    pop_items = item_pop.index[:n_pop].tolist()
+
+    visitor_col, session_col, item_col, als_col, sim_col = [], [], [], [], []
+    for visitorid, session_id in anchors.itertuples(index=False):
+        recent_idx = items.to_idx(recent.get(session_id, []))
+        als_items, als_scores = als.row(users.get(visitorid))
+
+        # Тот же генератор кандидатов, что и в онлайне + популярные + позитивы
+        cand_idx = generate_candidate_ids(
+            recent_idx, als_items, sim, n_als, n_sim, last_k
+        )
+        candidates = items.to_external(cand_idx).tolist()
+        seen = set(candidates)
+        for iid in pop_items + positives.get(session_id, []):
+            if iid not in seen:
+                candidates.append(iid)
+                seen.add(iid)
+        cand_idx = np.concatenate(
+            [cand_idx, items.to_idx(candidates[len(cand_idx) :])]
+        )
+
+        visitor_col.append(np.full(len(candidates), visitorid, dtype=np.int64))
+        session_col.extend([session_id] * len(candidates))
+        item_col.append(np.asarray(candidates, dtype=np.int64))
+        als_col.append(lookup_scores(als_items, als_scores, cand_idx))
+        sim_col.append(sim_max_scores(cand_idx, recent_idx, sim, last_k))
+
+    X = pd.DataFrame(
+        {
+            "visitorid": np.concatenate(visitor_col),
+            "anchor_session_id": session_col,
+            "itemid": np.concatenate(item_col),
+            "als_score": np.concatenate(als_col).astype(np.float32),
+            "sim_max": np.concatenate(sim_col).astype(np.float32),
+        }
+    )
+    X["item_pop_w"] = X["itemid"].map(item_pop).fillna(0.0).astype("float32")
+
+    # Сессионные признаки
+    sess_cols = [c for c in SESSION_COLS_MAP if c in sessions.columns]
+    sess_feats = sessions[sess_cols].rename(columns=SESSION_COLS_MAP)
+    X = X.merge(sess_feats, on="anchor_session_id", how="left")
+    for c in SESSION_COLS_MAP.values():
+        if c in X.columns and c != "anchor_session_id":
+            X[c] = X[c].fillna(0).astype("float32")
+
+    # Gain из таргетов следующей сессии
+    gains = targets[["anchor_session_id", "itemid", "gain"]].copy()
+    gains["itemid"] = gains["itemid"].astype("int64")
+    X = X.merge(gains, on=["anchor_session_id", "itemid"], how="left")
+    X["gain"] = X["gain"].fillna(0.0).astype("float32")
+
+    X["anchor_ts"] = X["anchor_session_id"].map(anchor_ts)
+
+    # Свойства товаров
+    if props_timeline is not None:
+        asof = props_timeline.asof(X["itemid"].to_numpy(), X["anchor_ts"])
+        for col in asof.columns:
+            # Нет версии на момент якоря — как неизвестный товар в онлайне
+            X[col] = (
+                asof[col].fillna(-1).astype("int64")
+                if col in ITEM_CAT_PROPS
+                else asof[col].to_numpy()
+            )
+    elif props is not None and not props.empty:
+        X = X.merge(props, on="itemid", how="left")
+
+    for col in ["visitorid", "itemid"]:
+        X[col] = X[col].astype("int64")
+    return X
+
+
+def _init_worker(ctx: Dict) -> None:
+    _CTX.update(ctx)
+
+
+def _build_part(part_no: int, lo: int, hi: int) -> Tuple[int, int, int]:
+    """Сборка и запись одной партиции (выполняется в воркере)"""
+    c = _CTX
+    targets = _read_range(c["targets_path"], lo, hi)
+    sessions = _read_range(c["sessions_path"], lo, hi)
+    events = _read_range(
+        c["events_path"], lo, hi, ["visitorid", "session_id", "ts_event", "itemid"]
+    )
+    X = build_chunk(
+        events,
+        sessions,
+        targets,
+        c["props"],
+        c["als_index"],
+        c["item_pop"],
+        c["last_k"],
+        c["n_als"],
+        c["n_sim"],
+        c["n_pop"],
+        c["props_timeline"],
+    )
+    if X.empty:
+        return part_no, 0, 0
+    X.to_parquet(c["out_dir"] / f"part-{part_no:05d}.parquet", index=False)
+    return part_no, len(X), int((X["gain"] > 0).sum())
+
+
+def build_dataset_for_range_model_streaming(
+    events_path: Path,
+    sessions_path: Path,
+    targets_path: Path,
+    out_dir: Path,
+    tag: str,
+    als_dir: Path = Path("ALS_assets"),
+    props_path: Optional[Path] = Path("range_features/item_props_last.parquet"),
+    props_timeline_path: Optional[Path] = None,
+    popularity_events_path: Optional[Path] = None,
+    last_k: int = 5,
+    n_als: int = 100,
+    n_sim: int = 50,
+    n_pop: int = 50,
+    chunk_anchors: int = 50_000,
+    n_workers: Optional[int] = None,
+) -> Path:
+    """
+    Потоковая сборка датасета для ранжирования: якоря обрабатываются частями
+    по диапазонам visitorid в пуле процессов, каждая часть пишется отдельным
+    parquet-файлом в out_dir/tag.
+
+    Входные parquet должны быть отсортированы по visitorid
+    (как результат make_sessions / split_sessions_by_date).
+
+    props_timeline_path — все версии свойств (item_properties_cats_tree.parquet)
+    или сохранённый ItemPropertyTimeline: свойства джойнятся на момент якоря
+    вместо последних (props_path тогда не используется).
+    """
+    out_dir = Path(out_dir) / tag
+    out_dir.mkdir(parents=True, exist_ok=True)
+    n_workers = n_workers or os.cpu_count() or 1
+
+    print(f"Начинаем потоковую сборку {tag} датасета...")
+    als_index = load_lookups(Path(als_dir))
+    item_pop = build_item_popularity(Path(popularity_events_path or events_path))
+    props, props_timeline = None, None
+    if props_timeline_path is not None:
+        props_timeline_path = Path(props_timeline_path)
+        props_timeline = (
+            ItemPropertyTimeline.load(props_timeline_path)
+            if props_timeline_path.is_dir()
+            else ItemPropertyTimeline.from_parquet(props_timeline_path)
+        )
+        print(
+            f"  Версий свойств: {props_timeline.n_versions:,} "
+            f"по {len(props_timeline):,} товарам"
+        )
+    elif props_path is not None and Path(props_path).exists():
+        props = pd.read_parquet(props_path)
+        props["itemid"] = pd.to_numeric(props["itemid"], errors="coerce")
+        props = props.dropna(subset=["itemid"]).astype({"itemid": "int64"})
+        props = props.drop(columns=["timestamp", "ts_prop"], errors="ignore")
+
+    ranges = visitor_ranges(Path(targets_path), chunk_anchors)
+    print(f"  Частей: {len(ranges)}, воркеров: {n_workers}")
+
+    ctx = {
+        "events_path": Path(events_path),
+        "sessions_path": Path(sessions_path),
+        "targets_path": Path(targets_path),
+        "out_dir": out_dir,
+        "props": props,
+        "props_timeline": props_timeline,
+        "als_index": als_index,
+        "item_pop": item_pop,
+        "last_k": last_k,
+        "n_als": n_als,
+        "n_sim": n_sim,
+        "n_pop": n_pop,
+    }
+
+    # fork — справочники разделяются с воркерами без копирования
+    methods = mp.get_all_start_methods()
+    mp_context = mp.get_context("fork" if "fork" in methods else None)
+
+    total_rows, total_pos = 0, 0
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=mp_context,
+        initializer=_init_worker,
+        initargs=(ctx,),
+    ) as pool:
+        futures = [
+            pool.submit(_build_part, i, lo, hi) for i, (lo, hi) in enumerate(ranges)
+        ]
+        for fut in as_completed(futures):
+            part_no, rows, pos = fut.result()
+            total_rows += rows
+            total_pos += pos
+            print(f"  part {part_no}: {rows:,} строк, позитивных {pos:,}")
+
+    print(f"Статистика {tag}:")
+    print(f"Строк: {total_rows:,}")
+    print(f"Позитивных: {total_pos:,}")
+    return out_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Потоковая сборка датасета ранжирования")
+    parser.add_argument("--events", required=True, type=Path)
+    parser.add_argument("--sessions", type=Path)
+    parser.add_argument("--targets", type=Path)
+    parser.add_argument("--tag")
+    parser.add_argument(
+        "--export-popularity",
+        action="store_true",
+        help="только сохранить популярность товаров по --events (события обучения) в --als-dir",
+    )
+    parser.add_argument("--out-dir", default=Path("range_features"), type=Path)
+    parser.add_argument("--als-dir", default=Path("ALS_assets"), type=Path)
+    parser.add_argument(
+        "--props", default=Path("range_features/item_props_last.parquet"), type=Path
+    )
+    parser.add_argument(
+        "--props-timeline",
+        default=None,
+        type=Path,
+        help="все версии свойств товаров: свойства на момент якоря вместо последних",
+    )
+    parser.add_argument("--popularity-events", default=None, type=Path)
+    parser.add_argument("--last-k", default=5, type=int)
+    parser.add_argument("--n-als", default=100, type=int)
+    parser.add_argument("--n-sim", default=50, type=int)
+    parser.add_argument("--n-pop", default=50, type=int)
+    parser.add_argument("--chunk-anchors", default=50_000, type=int)
+    parser.add_argument("--workers", default=None, type=int)
+    args = parser.parse_args()
+
+    if args.export_popularity:
+        export_item_popularity(args.events, args.als_dir)
+    else:
+        if args.sessions is None or args.targets is None or args.tag is None:
+            parser.error("--sessions, --targets and --tag are required to build a dataset")
+        build_dataset_for_range_model_streaming(
+            args.events,
+            args.sessions,
+            args.targets,
+            args.out_dir,
+            args.tag,
+            als_dir=args.als_dir,
+            props_path=args.props,
+            props_timeline_path=args.props_timeline,
+            popularity_events_path=args.popularity_events,
+            last_k=args.last_k,
+            n_als=args.n_als,
+            n_sim=args.n_sim,
+            n_pop=args.n_pop,
+            chunk_anchors=args.chunk_anchors,
+            n_workers=args.workers,
+        )
@@ -0,0 +1,277 @@
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from mlflow.entities import Metric, Param, RunTag
+
+from ranker_training import (
+    META_FILE,
+    build_pools,
+    evaluate_ranker,
+    load_pools,
+    train_ranker,
+)
+from utils_mlflow import setup_local_mlflow_client
+
+
+EXPERIMENT_NAME = "online_recommendations_pr_final"
+# Лимит MLflow на число метрик в одном log_batch
+MLFLOW_BATCH_METRICS = 1000
+
+# Контекст воркера: пулы загружаются один раз на процесс
+_CTX: Dict = {}
+# Воркеры не форкаются от родителя: OpenMP-пул потоков CatBoost после fork
+# может остаться в заблокированном состоянии
+START_METHODS = ("forkserver", "spawn")
+
+
+def parse_space(value: str) -> Dict[str, List]:
+    """Пространство параметров: JSON-строка или путь к JSON, скаляр — один вариант"""
+    text = Path(value).read_text() if os.path.exists(value) else value
+    return {
+        name: options if isinstance(options, list) else [options]
+        for name, options in json.loads(text).items()
+    }
+
+
+def grid_configs(space: Dict[str, List]) -> List[Dict]:
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*space.values())]
+
+
+def random_configs(space: Dict[str, List], n: int, seed: int = 42) -> List[Dict]:
+    """n различных конфигураций, выбранных случайно из сетки"""
+    grid = grid_configs(space)
+    rng = np.random.default_rng(seed)
+    picked = rng.choice(len(grid), size=min(n, len(grid)), replace=False)
+    return [grid[i] for i in picked]
+
+
+def _init_worker(ctx: Dict) -> None:
+    _CTX.update(ctx)
+    _CTX["train_pool"], _CTX["valid_pool"], _ = load_pools(_CTX["cache_dir"])
+
+
+def worker_context() -> mp.context.BaseContext:
+    """Контекст запуска воркеров без fork родителя (forkserver, иначе spawn)"""
+    methods = mp.get_all_start_methods()
+    return mp.get_context(next(m for m in START_METHODS if m in methods))
+
+
+def _run_trial(trial_no: int, params: Dict) -> Dict:
+    t0 = time.perf_counter()
+    model = train_ranker(
+        _CTX["train_pool"],
+        _CTX["valid_pool"],
+        {**_CTX["base_params"], **params},
+        thread_count=_CTX["threads_per_trial"],
+        used_ram_limit=_CTX["used_ram_limit"],
+        verbose=0,
+    )
+    train_sec = time.perf_counter() - t0
+    metrics = evaluate_ranker(
+        model, _CTX["cache_dir"], thread_count=_CTX["threads_per_trial"]
+    )
+
+    model_path = Path(_CTX["out_dir"]) / f"trial-{trial_no:03d}.cbm"
+    model.save_model(str(model_path))
+    # Кривая обучения: метрика на eval_set по итерациям
+    curves = model.get_evals_result().get("validation", {})
+    return {
+        "trial": trial_no,
+        "params": params,
+        "metrics": {
+            **{f"valid_{name}": value for name, value in metrics.items()},
+            "best_iteration": model.get_best_iteration() or 0,
+            "tree_count": model.tree_count_,
+            "train_sec": train_sec,
+        },
+        "curves": curves,
+        "model_path": str(model_path),
+    }
+
+
+def log_trial(
+    client, experiment_id: str, sweep_id: str, result: Dict, run_params: Dict
+) -> str:
+    """
+    Один прогон MLflow на конфигурацию: параметры, метрики и теги одним
+    log_batch, кривые обучения — пачками до MLFLOW_BATCH_METRICS.
+    """
+    run = client.create_run(
+        experiment_id,
+        run_name=f"{sweep_id}-{result['trial']:03d}",
+        tags={"sweep_id": sweep_id},
+    )
+    run_id = run.info.run_id
+    now = int(time.time() * 1000)
+
+    client.log_batch(
+        run_id,
+        metrics=[
+            Metric(name, float(value), now, 0)
+            for name, value in result["metrics"].items()
+        ],
+        params=[
+            Param(name, str(value))
+            for name, value in {**run_params, **result["params"]}.items()
+        ],
+        tags=[RunTag("model_path", result["model_path"])],
+    )
+
+    curve = [
+        Metric("eval_" + re.sub(r"[^\w./ -]", "_", name), float(value), now, step)
+        for name, values in result["curves"].items()
+        for step, value in enumerate(values)
+    ]
+    for start in range(0, len(curve), MLFLOW_BATCH_METRICS):
+        client.log_batch(run_id, metrics=curve[start : start + MLFLOW_BATCH_METRICS])
+
+    client.set_terminated(run_id)
+    return run_id
+
+
+def run_sweep(
+    cache_dir: Path,
+    configs: List[Dict],
+    out_dir: Path,
+    base_params: Optional[Dict] = None,
+    cpus: Optional[int] = None,
+    threads_per_trial: int = 1,
+    used_ram_limit: Optional[str] = None,
+    mlflow_dir: Path = Path("mlruns"),
+    experiment_name: str = EXPERIMENT_NAME,
+) -> pd.DataFrame:
+    """
+    Параллельное обучение конфигураций на кэшированных пулах (ranker_training.py).
+    Одновременно идёт cpus // threads_per_trial обучений по threads_per_trial
+    потоков; результаты пишутся в локальное файловое хранилище MLflow по мере
+    готовности (запись только из родителя) и в out_dir/<sweep_id>/results.csv.
+    Родитель читает только описание пулов; сами пулы загружает каждый
+    воркер (forkserver/spawn) в _init_worker.
+
+    Returns:
+        таблица конфигураций и метрик по убыванию valid NDCG@10
+    """
+    sweep_id = time.strftime("sweep-%Y%m%d-%H%M%S")
+    cache_dir, out_dir = Path(cache_dir), Path(out_dir) / sweep_id
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cpus = cpus or os.cpu_count() or 1
+    n_workers = max(1, min(len(configs), cpus // threads_per_trial))
+
+    meta = json.loads((cache_dir / META_FILE).read_text())
+    ctx = {
+        "cache_dir": cache_dir,
+        "out_dir": out_dir,
+        "base_params": base_params or {},
+        "threads_per_trial": threads_per_trial,
+        "used_ram_limit": used_ram_limit,
+    }
+
+    client = setup_local_mlflow_client(mlflow_dir)
+    experiment = client.get_experiment_by_name(experiment_name)
+    experiment_id = (
+        experiment.experiment_id
+        if experiment is not None
+        else client.create_experiment(experiment_name)
+    )
+    run_params = {
+        **(base_params or {}),
+        "threads_per_trial": threads_per_trial,
+        "n_features": len(meta["features"]),
+        "n_cat_features": len(meta["cat_features"]),
+        "train_size": meta["train_size"],
+        "valid_size": meta["valid_size"],
+        "neg_ratio": meta["build_params"]["neg_ratio"],
+    }
+    print(
+        f"Свип {sweep_id}: {len(configs)} конфигураций, "
+        f"{n_workers} параллельно по {threads_per_trial} потоков"
+    )
+
+    rows = []
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=worker_context(),
+        initializer=_init_worker,
+        initargs=(ctx,),
+    ) as pool:
+        futures = [pool.submit(_run_trial, i, params) for i, params in enumerate(configs)]
+        for fut in as_completed(futures):
+            result = fut.result()
+            run_id = log_trial(client, experiment_id, sweep_id, result, run_params)
+            metrics = result["metrics"]
+            print(
+                f"  trial {result['trial']}: ndcg_10={metrics['valid_ndcg_10']:.4f}, "
+                f"{metrics['train_sec']:.0f} с, {result['params']}"
+            )
+            rows.append(
+                {
+                    "trial": result["trial"],
+                    **result["params"],
+                    **metrics,
+                    "run_id": run_id,
+                    "model_path": result["model_path"],
+                }
+            )
+
+    results = pd.DataFrame(rows).sort_values("valid_ndcg_10", ascending=False)
+    results.to_csv(out_dir / "results.csv", index=False)
+    elapsed = time.perf_counter() - t0
+    print(
+        f"Свип завершён за {elapsed:.0f} с "
+        f"({len(configs) / elapsed * 3600:.0f} конфигураций/час)"
+    )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Параллельный перебор параметров CatBoostRanker с логированием в MLflow"
+    )
+    parser.add_argument(
+        "--space",
+        required=True,
+        help='сетка параметров JSON или путь к JSON: {"depth": [6, 8], "learning_rate": [0.05, 0.1]}',
+    )
+    parser.add_argument("--random", default=0, type=int, help="N случайных конфигураций из сетки (0 — вся сетка)")
+    parser.add_argument("--seed", default=42, type=int)
+    parser.add_argument("--base-params", default="{}", help="общие параметры JSON, например '{\"iterations\": 500}'")
+    parser.add_argument("--cache-dir", default=Path("range_features/pools"), type=Path)
+    parser.add_argument("--data", default=None, type=Path, help="собрать пулы из датасета, если кэша нет")
+    parser.add_argument("--out-dir", default=Path("models/sweep"), type=Path)
+    parser.add_argument("--cpus", default=None, type=int, help="бюджет ядер на весь свип")
+    parser.add_argument("--threads-per-trial", default=1, type=int)
+    parser.add_argument("--used-ram-limit", default=None, help='лимит памяти на обучение, например "4gb"')
+    parser.add_argument("--mlflow-dir", default=Path("mlruns"), type=Path)
+    parser.add_argument("--experiment", default=EXPERIMENT_NAME)
+    args = parser.parse_args()
+
+    if args.data is not None:
+        build_pools(args.data, args.cache_dir, thread_count=args.cpus or -1)
+    space = parse_space(args.space)
+    configs = (
+        random_configs(space, args.random, args.seed) if args.random else grid_configs(space)
+    )
+    results = run_sweep(
+        args.cache_dir,
+        configs,
+        args.out_dir,
+        base_params=json.loads(args.base_params),
+        cpus=args.cpus,
+        threads_per_trial=args.threads_per_trial,
+        used_ram_limit=args.used_ram_limit,
+        mlflow_dir=args.mlflow_dir,
+        experiment_name=args.experiment,
+    )
+    print(results.head(10).to_string(index=False))
@@ -0,0 +1,314 @@
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from catboost import CatBoostRanker, Pool
+
+from metrics_utils import ndcg_grouped
+from service.recommender_repository import ITEM_CAT_PROPS, ITEM_NUM_PROPS
+
+
+BASE_FEATURES = [
+    "als_score",
+    "sim_max",
+    "item_pop_w",
+    "sess_n_events",
+    "sess_n_items",
+    "sess_duration",
+    "sess_cnt_view",
+    "sess_cnt_addtocart",
+    "sess_cnt_transaction",
+    *ITEM_CAT_PROPS,
+    *ITEM_NUM_PROPS,
+]
+KEY_COLUMNS = ["visitorid", "anchor_session_id", "anchor_ts", "gain"]
+
+# Параметры модели из range_model.ipynb
+DEFAULT_PARAMS = {
+    "iterations": 1500,
+    "learning_rate": 0.05,
+    "depth": 8,
+    "l2_leaf_reg": 3.0,
+    "loss_function": "YetiRank",
+    "eval_metric": "NDCG:top=10",
+    "random_seed": 42,
+    "od_type": "Iter",
+    "od_wait": 50,
+    "use_best_model": True,
+}
+
+# Файлы кэша пулов
+TRAIN_POOL_FILE = "train.quantized"
+VALID_POOL_FILE = "valid.quantized"
+BORDERS_FILE = "borders.tsv"  # границы квантования train, общие с valid
+# Признаки valid до квантования: CatBoost не считает предсказания
+# по квантованному пулу с категориальными признаками
+VALID_FRAME_FILE = "valid.parquet"
+META_FILE = "meta.json"
+CACHE_FILES = [TRAIN_POOL_FILE, VALID_POOL_FILE, VALID_FRAME_FILE, META_FILE]
+
+
+def group_codes(visitorid, anchor_session_id) -> np.ndarray:
+    """Целочисленный код группы (visitorid, anchor_session_id) вместо строкового group_id"""
+    codes, _ = pd.MultiIndex.from_arrays([visitorid, anchor_session_id]).factorize()
+    return codes.astype(np.int64)
+
+
+def sample_negatives(
+    group: np.ndarray, gain: np.ndarray, neg_ratio: float, seed: int = 42
+) -> np.ndarray:
+    """
+    Маска строк после сэмплирования негативов внутри групп: на группу остаются
+    все позитивные и не больше neg_ratio негативов на каждый позитивный.
+    Группы без позитивных выпадают — для ранжирующего лосса они пустые.
+    """
+    rng = np.random.default_rng(seed)
+    pos = gain > 0
+    n_groups = int(group.max()) + 1 if len(group) else 0
+    quota = np.bincount(group[pos], minlength=n_groups) * neg_ratio
+
+    # Негативы в случайном порядке внутри группы: ранг < квоты — остаётся
+    neg = np.flatnonzero(~pos)
+    neg = neg[np.lexsort((rng.random(len(neg)), group[neg]))]
+    neg_group = group[neg]
+    _, starts, sizes = np.unique(neg_group, return_index=True, return_counts=True)
+    rank = np.arange(len(neg)) - np.repeat(starts, sizes)
+
+    keep = pos.copy()
+    keep[neg[rank < quota[neg_group]]] = True
+    return keep
+
+
+def split_by_time(anchor_ts: np.ndarray, valid_frac: float = 0.2) -> np.ndarray:
+    """Маска valid: последние valid_frac якорей по времени (как split_train_valid)"""
+    split_point = np.quantile(anchor_ts, 1.0 - valid_frac)
+    return anchor_ts >= split_point
+
+
+def encode_categorical(values: pd.Series) -> np.ndarray:
+    """astype(str) как в сервисе, но только по уникальным значениям колонки"""
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return pd.Series(uniques).astype(str).to_numpy()[codes]
+
+
+def _source_fingerprint(path: Path) -> Dict:
+    files = sorted(path.rglob("*.parquet")) if path.is_dir() else [path]
+    return {
+        "path": str(path),
+        "files": len(files),
+        "bytes": sum(f.stat().st_size for f in files),
+        "mtime": max((f.stat().st_mtime for f in files), default=0.0),
+    }
+
+
+def _make_pool(
+    frame: pd.DataFrame,
+    group: np.ndarray,
+    features: List[str],
+    cat_features: List[str],
+    thread_count: int,
+) -> Tuple[Pool, pd.DataFrame]:
+    """Pool и его данные: строки группы подряд, категориальные признаки строками"""
+    order = np.argsort(group, kind="stable")
+    data = frame[features].iloc[order].reset_index(drop=True)
+    for col in cat_features:
+        data[col] = encode_categorical(data[col])
+    data["group"] = group[order]
+    data["gain"] = frame["gain"].to_numpy()[order]
+    pool = Pool(
+        data[features],
+        label=data["gain"],
+        group_id=data["group"],
+        cat_features=cat_features,
+        thread_count=thread_count,
+    )
+    return pool, data
+
+
+def build_pools(
+    data_path: Path,
+    cache_dir: Path,
+    neg_ratio: Optional[float] = 8,
+    valid_frac: float = 0.2,
+    seed: int = 42,
+    border_count: int = 254,
+    thread_count: int = -1,
+    used_ram_limit: Optional[str] = None,
+    rebuild: bool = False,
+) -> Dict:
+    """
+    Квантованные train/valid пулы из датасета ранжирования (range_dataset.py)
+    с кэшем на диске. Пулы пересобираются только при изменении датасета или
+    параметров сборки; иначе возвращается описание готового кэша.
+
+    Args:
+        data_path: parquet-файл или каталог частей (train_X.parquet, range_features/<tag>)
+        cache_dir: каталог кэша пулов
+        neg_ratio: негативов на позитивный внутри группы (None — без сэмплирования)
+        valid_frac: доля последних по времени якорей в valid
+        border_count: число границ квантования числовых признаков
+    """
+    data_path, cache_dir = Path(data_path), Path(cache_dir)
+    build_params = {
+        "source": _source_fingerprint(data_path),
+        "neg_ratio": neg_ratio,
+        "valid_frac": valid_frac,
+        "seed": seed,
+        "border_count": border_count,
+    }
+    meta_path = cache_dir / META_FILE
+    if not rebuild and all((cache_dir / f).exists() for f in CACHE_FILES):
+        meta = json.loads(meta_path.read_text())
+        if meta["build_params"] == build_params:
+            print(f"Пулы из кэша {cache_dir}")
+            return meta
+
+    t0 = time.perf_counter()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    schema = pq.read_schema(
+        next(iter(sorted(data_path.rglob("*.parquet")))) if data_path.is_dir() else data_path
+    )
+    features = [c for c in BASE_FEATURES if c in schema.names]
+    cat_features = [c for c in ITEM_CAT_PROPS if c in features]
+    frame = pd.read_parquet(data_path, columns=KEY_COLUMNS + features)
+    print(f"Строк: {len(frame):,}, признаков: {len(features)}")
+
+    group = group_codes(frame["visitorid"], frame["anchor_session_id"])
+    if neg_ratio:
+        keep = sample_negatives(group, frame["gain"].to_numpy(), neg_ratio, seed)
+        frame, group = frame[keep].reset_index(drop=True), group[keep]
+        print(f"После сэмплирования негативов 1:{neg_ratio}: {len(frame):,}")
+
+    is_valid = split_by_time(frame["anchor_ts"].to_numpy(), valid_frac)
+    train_pool, _ = _make_pool(
+        frame[~is_valid], group[~is_valid], features, cat_features, thread_count
+    )
+    train_pool.quantize(border_count=border_count, used_ram_limit=used_ram_limit)
+    train_pool.save_quantization_borders(str(cache_dir / BORDERS_FILE))
+    train_pool.save(str(cache_dir / TRAIN_POOL_FILE))
+
+    valid_pool, valid_frame = _make_pool(
+        frame[is_valid], group[is_valid], features, cat_features, thread_count
+    )
+    valid_pool.quantize(
+        input_borders=str(cache_dir / BORDERS_FILE), used_ram_limit=used_ram_limit
+    )
+    valid_pool.save(str(cache_dir / VALID_POOL_FILE))
+    valid_frame.to_parquet(cache_dir / VALID_FRAME_FILE, index=False)
+
+    meta = {
+        "build_params": build_params,
+        "features": features,
+        "cat_features": cat_features,
+        "train_size": int((~is_valid).sum()),
+        "valid_size": int(is_valid.sum()),
+        "build_sec": time.perf_counter() - t0,
+    }
+    meta_path.write_text(json.dumps(meta, ensure_ascii=False, indent=2))
+    print(
+        f"Пулы сохранены в {cache_dir}: train {meta['train_size']:,}, "
+        f"valid {meta['valid_size']:,} за {meta['build_sec']:.1f} с"
+    )
+    return meta
+
+
+def load_pools(cache_dir: Path) -> Tuple[Pool, Pool, Dict]:
+    """Квантованные train/valid пулы из кэша и их описание"""
+    cache_dir = Path(cache_dir)
+    meta = json.loads((cache_dir / META_FILE).read_text())
+    train_pool = Pool(f"quantized://{cache_dir / TRAIN_POOL_FILE}")
+    valid_pool = Pool(f"quantized://{cache_dir / VALID_POOL_FILE}")
+    return train_pool, valid_pool, meta
+
+
+def train_ranker(
+    train_pool: Pool,
+    valid_pool: Pool,
+    params: Optional[Dict] = None,
+    thread_count: int = -1,
+    used_ram_limit: Optional[str] = None,
+    verbose: int = 100,
+) -> CatBoostRanker:
+    """
+    Обучение CatBoostRanker на готовых пулах.
+
+    Args:
+        params: параметры модели поверх DEFAULT_PARAMS
+        thread_count: число потоков обучения (-1 — все ядра)
+        used_ram_limit: лимит памяти CatBoost, например "8gb"
+    """
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    model = CatBoostRanker(
+        **params, thread_count=thread_count, used_ram_limit=used_ram_limit
+    )
+    model.fit(train_pool, eval_set=valid_pool, verbose=verbose)
+    return model
+
+
+def evaluate_ranker(
+    model: CatBoostRanker, cache_dir: Path, ks=(5, 10, 20), thread_count: int = -1
+) -> Dict[str, float]:
+    """NDCG@k на valid из кэша пулов"""
+    cache_dir = Path(cache_dir)
+    meta = json.loads((cache_dir / META_FILE).read_text())
+    valid = pd.read_parquet(cache_dir / VALID_FRAME_FILE)
+    pool = Pool(
+        valid[meta["features"]],
+        group_id=valid["group"],
+        cat_features=meta["cat_features"],
+    )
+    group = np.unique(valid["group"].to_numpy(), return_inverse=True)[1]
+    preds = model.predict(pool, thread_count=thread_count)
+    return ndcg_grouped(group, valid["gain"].to_numpy(), preds, ks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Обучение ранжирующей модели на кэшированных квантованных пулах"
+    )
+    parser.add_argument("--data", default=Path("range_features/train_X.parquet"), type=Path)
+    parser.add_argument("--cache-dir", default=Path("range_features/pools"), type=Path)
+    parser.add_argument("--model-out", default=None, type=Path)
+    parser.add_argument("--neg-ratio", default=8, type=float, help="0 — без сэмплирования")
+    parser.add_argument("--valid-frac", default=0.2, type=float)
+    parser.add_argument("--border-count", default=254, type=int)
+    parser.add_argument("--seed", default=42, type=int)
+    parser.add_argument("--rebuild", action="store_true", help="пересобрать пулы")
+    parser.add_argument("--threads", default=-1, type=int)
+    parser.add_argument("--used-ram-limit", default=None, help='например "8gb"')
+    parser.add_argument(
+        "--params", default="{}", help='параметры модели JSON, например \'{"depth": 6}\''
+    )
+    args = parser.parse_args()
+
+    build_pools(
+        args.data,
+        args.cache_dir,
+        neg_ratio=args.neg_ratio,
+        valid_frac=args.valid_frac,
+        seed=args.seed,
+        border_count=args.border_count,
+        thread_count=args.threads,
+        used_ram_limit=args.used_ram_limit,
+        rebuild=args.rebuild,
+    )
+    if args.model_out is not None:
+        t0 = time.perf_counter()
+        train_pool, valid_pool, meta = load_pools(args.cache_dir)
+        print(f"Пулы загружены за {time.perf_counter() - t0:.1f} с")
+        model = train_ranker(
+            train_pool,
+            valid_pool,
+            json.loads(args.params),
+            thread_count=args.threads,
+            used_ram_limit=args.used_ram_limit,
+        )
+        print("Valid metrics:", evaluate_ranker(model, args.cache_dir, thread_count=args.threads))
+        args.model_out.parent.mkdir(parents=True, exist_ok=True)
+        model.save_model(str(args.model_out))
+        print(f"Модель сохранена в {args.model_out}")
@@ -0,0 +1,308 @@
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from sessions_utils import MINUTE_MS
+from service.events_store import EventStore
+from service.recommendations_service import RecommendationService
+
+
+FEATURES_TO_COMPARE = [
+    "als_score",
+    "sim_max",
+    "item_pop_w",
+    "sess_n_events",
+    "sess_n_items",
+    "sess_duration",
+    "sess_cnt_view",
+    "sess_cnt_addtocart",
+    "sess_cnt_transaction",
+    "available",
+    "categoryid",
+    "root_category",
+    "value_count",
+    "value_mean",
+    "value_std",
+    "value_min",
+    "value_max",
+]
+
+
+EVENT_COLUMNS = ["timestamp", "visitorid", "event", "itemid"]
+
+
+def _is_sorted(ts: np.ndarray) -> bool:
+    return bool(np.all(ts[1:] >= ts[:-1]))
+
+
+def read_events_sorted(path: Path, chunksize: int = 500_000) -> pa.Table:
+    """Все события файла одной таблицей, отсортированной по времени (стабильно)"""
+    if Path(path).suffix == ".csv":
+        table = pa.concat_tables(
+            pa.Table.from_pandas(chunk, preserve_index=False)
+            for chunk in pd.read_csv(path, usecols=EVENT_COLUMNS, chunksize=chunksize)
+        )
+    else:
+        table = pq.read_table(path, columns=EVENT_COLUMNS)
+    return table.take(np.argsort(table.column("timestamp").to_numpy(), kind="stable"))
+
+
+def sort_events(path: Path, out_path: Path, chunksize: int = 500_000) -> Path:
+    """Сохранение событий в parquet по возрастанию времени — для потоковых прогонов"""
+    pq.write_table(read_events_sorted(path, chunksize), out_path, row_group_size=chunksize)
+    return Path(out_path)
+
+
+def iter_events(path: Path, chunksize: int = 500_000) -> Iterator[pd.DataFrame]:
+    """
+    События в глобальном порядке по времени. Parquet, уже отсортированный по
+    timestamp (sort_events), читается батчами; csv и неотсортированный parquet
+    сортируются целиком в памяти.
+    """
+    if Path(path).suffix != ".csv":
+        pf = pq.ParquetFile(path)
+        if _is_sorted(pf.read(columns=["timestamp"]).column(0).to_numpy()):
+            for batch in pf.iter_batches(batch_size=chunksize, columns=EVENT_COLUMNS):
+                yield batch.to_pandas()
+            return
+        print(f"{path} не отсортирован по timestamp: сортировка в памяти")
+
+    table = read_events_sorted(path, chunksize)
+    for start in range(0, table.num_rows, chunksize):
+        yield table.slice(start, chunksize).to_pandas()
+
+
+class OfflineIndex:
+    """Офлайн-датасет (train_X/test_X) с индексом строк по якорной сессии"""
+
+    def __init__(self, path: Path):
+        self.df = pd.read_parquet(path)
+        self.df["itemid"] = self.df["itemid"].astype("int64")
+        self.groups = self.df.groupby("anchor_session_id").indices
+
+    def get(self, session_id: str) -> Optional[pd.DataFrame]:
+        rows = self.groups.get(session_id)
+        return None if rows is None else self.df.iloc[rows]
+
+
+class ReplayHarness:
+    """
+    Прогон исторических событий через онлайн-пайплайн сервиса.
+    На конце каждой сессии (пауза > inactivity или дата сплита) строятся
+    онлайн-кандидаты и признаки и сравниваются с офлайн-датасетом.
+    """
+
+    def __init__(
+        self,
+        service: RecommendationService,
+        offline: Optional[OfflineIndex] = None,
+        inactivity_minutes: int = 30,
+        split_date_str: Optional[str] = None,
+        max_events_per_user: int = 10,
+        topn: int = 10,
+    ):
+        self.service = service
+        self.offline = offline
+        self.store = EventStore(max_events_per_user=max_events_per_user)
+        self.inactivity_ms = inactivity_minutes * MINUTE_MS
+        self.split_ts = (
+            int(pd.Timestamp(split_date_str, tz="UTC").value // 1_000_000)
+            if split_date_str
+            else None
+        )
+        self.topn = topn
+        self.items = service.recommender_repository.items
+
+        # Состояние пользователя: время последнего события и номер сессии
+        self.last_ts: Dict[int, int] = {}
+        self.session_order: Dict[int, int] = {}
+
+        self.n_events = 0
+        self.n_anchors = 0
+        self.recs_latency_ms: List[float] = []
+        self.parity: List[Dict] = []
+
+    def run(self, events_path: Path, max_events: Optional[int] = None) -> Dict:
+        started = time.perf_counter()
+        for chunk in iter_events(events_path):
+            for ts, visitor, event, item in chunk.itertuples(index=False):
+                self._on_event(int(ts), int(visitor), str(event), str(item))
+                if max_events is not None and self.n_events >= max_events:
+                    break
+            if max_events is not None and self.n_events >= max_events:
+                break
+
+        # Закрываем открытые сессии
+        for visitor in list(self.last_ts):
+            self._on_session_end(visitor)
+        return self.report(time.perf_counter() - started)
+
+    def _on_event(self, ts: int, visitor: int, event: str, item: str) -> None:
+        prev = self.last_ts.get(visitor)
+        if prev is None:
+            self.session_order[visitor] = 1
+        elif ts - prev > self.inactivity_ms or (
+            self.split_ts is not None and prev < self.split_ts <= ts
+        ):
+            self._on_session_end(visitor)
+            self.session_order[visitor] += 1
+
+        self.store.put(str(visitor), item, event)
+        self.service.on_event(str(visitor), item, event)
+        self.last_ts[visitor] = ts
+        self.n_events += 1
+
+    def _on_session_end(self, visitor: int) -> None:
+        session_id = f"{visitor}_{self.session_order[visitor]}"
+        offline_rows = self.offline.get(session_id) if self.offline else None
+        if self.offline is not None and offline_rows is None:
+            # Не якорная сессия — без рекомендаций, только поток событий
+            return
+
+        recent_items = self.store.get(str(visitor), k=10)
+        t0 = time.perf_counter()
+        user_idx, recent_idx = self.service.to_internal(str(visitor), recent_items)
+        X, candidate_ids = self.service.feature_generator.build_features(
+            user_idx, recent_idx, session_id=session_id
+        )
+        online_features = X.copy()
+        if len(candidate_ids):
+            online_features["itemid"] = self.items.to_external(candidate_ids)
+        top_idx, top_scores = self.service.recommender.recommend_with_scores(
+            (X, candidate_ids), topn=self.topn
+        )
+        ranked = list(zip(self.items.to_external(top_idx).tolist(), top_scores.tolist()))
+        self.recs_latency_ms.append((time.perf_counter() - t0) * 1000)
+        self.n_anchors += 1
+
+        if offline_rows is not None:
+            self.parity.append(
+                self._compare(online_features, ranked, offline_rows)
+            )
+
+    def _compare(
+        self, online: pd.DataFrame, ranked: list, offline: pd.DataFrame
+    ) -> Dict:
+        """Сравнение кандидатов, признаков и ранжирования с офлайн-строками якоря"""
+        online_items = (
+            online["itemid"].astype("int64")
+            if not online.empty
+            else pd.Series(dtype="int64")
+        )
+        offline_items = set(offline["itemid"].tolist())
+        positives = set(offline.loc[offline["gain"] > 0, "itemid"].tolist())
+        common = set(online_items.tolist()) & offline_items
+
+        result = {
+            "n_online": len(online_items),
+            "n_offline": len(offline_items),
+            "candidate_overlap": len(common) / len(online_items)
+            if len(online_items)
+            else np.nan,
+            "positives_recall": len(positives & set(online_items.tolist()))
+            / len(positives)
+            if positives
+            else np.nan,
+        }
+
+        # Признаки на общих кандидатах
+        if common:
+            on = online.assign(itemid=online_items.values)
+            on = on[on["itemid"].isin(common)].set_index("itemid")
+            off = offline[offline["itemid"].isin(common)].set_index("itemid")
+            off = off[~off.index.duplicated()]
+            for feature in FEATURES_TO_COMPARE:
+                if feature in on.columns and feature in off.columns:
+                    a = pd.to_numeric(on[feature], errors="coerce")
+                    b = pd.to_numeric(off.loc[on.index, feature], errors="coerce")
+                    result[f"match_{feature}"] = float(
+                        np.isclose(a.values, b.values, atol=1e-4, equal_nan=True).mean()
+                    )
+
+        # Качество онлайн-выдачи по офлайн-меткам
+        gains = dict(zip(offline["itemid"], offline["gain"]))
+        top = [int(iid) for iid, _ in ranked[: self.topn]]
+        rel = np.array([gains.get(iid, 0.0) for iid in top], dtype=np.float64)
+        ideal = np.sort(offline["gain"].to_numpy(dtype=np.float64))[::-1][: self.topn]
+        disc = 1.0 / np.log2(np.arange(self.topn) + 2.0)
+        idcg = float((ideal * disc[: len(ideal)]).sum())
+        result["online_ndcg"] = (
+            float((rel * disc[: len(rel)]).sum()) / idcg if idcg > 0 else np.nan
+        )
+        return result
+
+    def report(self, elapsed_sec: float) -> Dict:
+        latency = np.array(self.recs_latency_ms) if self.recs_latency_ms else np.zeros(1)
+        report = {
+            "events": self.n_events,
+            "anchors": self.n_anchors,
+            "elapsed_sec": elapsed_sec,
+            "events_per_sec": self.n_events / elapsed_sec if elapsed_sec > 0 else 0.0,
+            "recs_per_sec": self.n_anchors / elapsed_sec if elapsed_sec > 0 else 0.0,
+            "recs_latency_p50_ms": float(np.percentile(latency, 50)),
+            "recs_latency_p95_ms": float(np.percentile(latency, 95)),
+            "recs_latency_p99_ms": float(np.percentile(latency, 99)),
+        }
+        if self.parity:
+            parity = pd.DataFrame(self.parity)
+            report.update(
+                {f"parity_{c}": float(parity[c].mean()) for c in parity.columns}
+            )
+        return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay событий через онлайн-пайплайн")
+    parser.add_argument("--events", default=Path("data/events.csv"), type=Path)
+    parser.add_argument(
+        "--sorted-events",
+        default=None,
+        type=Path,
+        help="сохранить события по времени в этот parquet и читать его (или прочитать готовый)",
+    )
+    parser.add_argument("--offline", default=None, type=Path)
+    parser.add_argument("--split-date", default=None)
+    parser.add_argument("--max-events", default=None, type=int)
+    parser.add_argument("--model-path", default="models/catboost_ranker.cbm")
+    parser.add_argument("--props-path", default="range_features/item_props_last.parquet")
+    parser.add_argument("--als-assets-path", default="ALS_assets")
+    parser.add_argument("--top-rated-path", default="features_assets")
+    parser.add_argument("--last-k", default=5, type=int)
+    parser.add_argument("--n-als", default=20, type=int)
+    parser.add_argument("--n-sim", default=10, type=int)
+    parser.add_argument("--topn", default=10, type=int)
+    parser.add_argument("--report", default=None, type=Path)
+    args = parser.parse_args()
+
+    service = RecommendationService(
+        model_path=args.model_path,
+        props_path=args.props_path,
+        als_assets_path=args.als_assets_path,
+        top_rated_path=args.top_rated_path,
+        last_k=args.last_k,
+        n_als=args.n_als,
+        n_sim=args.n_sim,
+        topn=args.topn,
+    )
+    harness = ReplayHarness(
+        service,
+        offline=OfflineIndex(args.offline) if args.offline else None,
+        split_date_str=args.split_date,
+        topn=args.topn,
+    )
+    events_path = args.events
+    if args.sorted_events is not None:
+        if not args.sorted_events.exists():
+            sort_events(args.events, args.sorted_events)
+        events_path = args.sorted_events
+    report = harness.run(events_path, args.max_events)
+    print(json.dumps(report, indent=2, default=float))
+    if args.report:
+        args.report.write_text(json.dumps(report, indent=2, default=float))
@@ -0,0 +1,293 @@
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pyarrow.parquet as pq
+import scipy.sparse
+
+from .cold_start import EVENT_ALIASES
+from .id_space import load_train_id_maps, user_shards
+
+
+# Дельта: (visitorid, [n, K] itemid, [n, K] скор)
+ALSDelta = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+DELTA_PREFIX = "als_delta_"
+
+
+class ALSFoldInUpdater:
+    """
+    Инкрементальное обновление ALS: факторы затронутых пользователей
+    пересчитываются МНК (fold-in) при фиксированных факторах товаров,
+    для них заново считается top-K и публикуется дельта-артефакт.
+    Пересчёт идёт в фоновом потоке раз в update_sec (start/stop).
+    """
+
+    def __init__(
+        self,
+        item_factors: np.ndarray,
+        item_ids: np.ndarray,
+        user_ids: np.ndarray,
+        user_items: scipy.sparse.csr_matrix,
+        event_weights: Dict[str, float],
+        regularization: float = 0.05,
+        alpha: float = 1.0,
+        topk: int = 100,
+        update_sec: float = 60.0,
+        delta_dir: Optional[Path] = None,
+        delta_retention_sec: float = 3600.0,
+        max_live_users: int = 100_000,
+    ):
+        """
+        Args:
+            item_factors: факторы товаров [n_items, f] (als_model.npz)
+            item_ids: itemid по внутреннему индексу товара
+            user_ids: visitorid по внутреннему индексу пользователя
+            user_items: обучающая матрица рейтингов (строки — visitoridx)
+            event_weights: веса событий, добавляемые к рейтингу
+            regularization, alpha: параметры ALS, как при обучении
+            topk: длина пересчитанного списка рекомендаций
+            update_sec: период пересчёта затронутых пользователей
+            delta_dir: куда публиковать дельты (None — не публиковать)
+            delta_retention_sec: дельты старше удаляются при публикации (0 — хранить все)
+            max_live_users: лимит пользователей с живыми событиями (давно
+                не активные вытесняются, их fold-in — только по обучающим рейтингам)
+        """
+        self.item_factors = np.ascontiguousarray(item_factors, dtype=np.float32)
+        self.item_ids = np.asarray(item_ids, dtype=np.int64)
+        self.event_weights = event_weights
+        self.regularization = regularization
+        self.alpha = alpha
+        self.topk = min(topk, len(self.item_factors))
+        self.update_sec = update_sec
+        self.delta_dir = Path(delta_dir) if delta_dir else None
+        self.delta_retention_sec = delta_retention_sec
+        self.max_live_users = max_live_users
+
+        self._user_items = user_items
+        self._user_idx = {int(uid): idx for idx, uid in enumerate(user_ids) if uid >= 0}
+        self._item_idx = {int(iid): idx for idx, iid in enumerate(item_ids) if iid >= 0}
+
+        f = self.item_factors.shape[1]
+        self._yty = self.item_factors.T.astype(np.float64) @ self.item_factors
+        self._reg = regularization * np.eye(f)
+
+        # Накопленные живые взаимодействия: {visitorid: {itemidx: вес}}, порядок — LRU
+        self._live: "OrderedDict[int, Dict[int, float]]" = OrderedDict()
+        self._dirty: set = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.n_evicted = 0
+        self.n_updates = 0
+        self.n_users_updated = 0
+        self.last_update_ms = 0.0
+
+    @classmethod
+    def from_assets(
+        cls,
+        als_assets_path: Path,
+        event_weights: Dict[str, float],
+        shard: Optional[Tuple[int, int]] = None,
+        **kwargs,
+    ) -> "ALSFoldInUpdater":
+        """
+        Загрузка факторов товаров и обучающей матрицы из ALS-артефактов.
+
+        Args:
+            shard: (номер шарда, число шардов) — рейтинги только пользователей шарда
+        """
+        als_assets_path = Path(als_assets_path)
+        with np.load(als_assets_path / "als_model.npz") as data:
+            item_factors = data["item_factors"]
+
+        user_ids, train_item_ids = load_train_id_maps(als_assets_path)
+        item_ids = np.full(len(item_factors), -1, dtype=np.int64)
+        n = min(len(item_ids), len(train_item_ids))
+        item_ids[:n] = train_item_ids[:n]
+
+        ratings = pq.read_table(
+            als_assets_path / "user_item_ratings_train.parquet",
+            columns=["visitoridx", "itemidx", "rating"],
+        )
+        users = ratings.column("visitoridx").to_numpy().astype(np.int64)
+        items = ratings.column("itemidx").to_numpy().astype(np.int64)
+        values = ratings.column("rating").to_numpy().astype(np.float32)
+        n_users = max(len(user_ids), int(users.max()) + 1 if len(users) else 0)
+        del ratings
+        if shard is not None:
+            # Пользователи других шардов сюда не маршрутизируются
+            user_ids = np.where(user_shards(user_ids, shard[1]) == shard[0], user_ids, -1)
+            own = np.isin(users, np.flatnonzero(user_ids >= 0))
+            users, items, values = users[own], items[own], values[own]
+
+        user_items = scipy.sparse.csr_matrix(
+            (values, (users, items)), shape=(n_users, len(item_ids))
+        )
+        return cls(item_factors, item_ids, user_ids, user_items, event_weights, **kwargs)
+
+    def observe(self, user_id: str, item_id: str, event: str) -> None:
+        """Учитывает событие; пересчёт — в фоновом потоке (start)"""
+        weight = self.event_weights.get(EVENT_ALIASES.get(event, event))
+        try:
+            uid, iid = int(user_id), int(item_id)
+        except (ValueError, TypeError):
+            return
+        item_idx = self._item_idx.get(iid)
+        if weight is None or item_idx is None:
+            return
+
+        with self._lock:
+            live = self._live.get(uid)
+            if live is None:
+                live = self._live[uid] = defaultdict(float)
+            else:
+                self._live.move_to_end(uid)
+            live[item_idx] += weight
+            self._dirty.add(uid)
+            while len(self._live) > self.max_live_users:
+                evicted, _ = self._live.popitem(last=False)
+                self._dirty.discard(evicted)
+                self.n_evicted += 1
+
+    def start(self, on_delta: Callable[[ALSDelta], None]) -> None:
+        """Фоновый пересчёт раз в update_sec; on_delta — применение дельты в процессе"""
+        self._thread = threading.Thread(
+            target=self._run, args=(on_delta,), name="als-update", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, on_delta: Callable[[ALSDelta], None]) -> None:
+        while not self._stop.wait(self.update_sec):
+            try:
+                delta = self.update()
+                if delta is not None:
+                    on_delta(delta)
+            except Exception as e:
+                print(f"ALS update error: {e}")
+
+    def _history(self, uid: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Полная история пользователя: обучающие рейтинги + живые события"""
+        merged: Dict[int, float] = {}
+        row = self._user_idx.get(uid)
+        if row is not None and row < self._user_items.shape[0]:
+            start, end = self._user_items.indptr[row], self._user_items.indptr[row + 1]
+            merged = dict(
+                zip(
+                    self._user_items.indices[start:end].tolist(),
+                    self._user_items.data[start:end].tolist(),
+                )
+            )
+        for item_idx, weight in self._live.get(uid, {}).items():
+            merged[item_idx] = merged.get(item_idx, 0.0) + weight
+        idx = np.fromiter(merged.keys(), dtype=np.int64, count=len(merged))
+        conf = np.fromiter(merged.values(), dtype=np.float64, count=len(merged))
+        return idx, self.alpha * conf
+
+    def fold_in(self, histories: List[Tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+        """
+        x_u = (YtY + Yuᵀ(Cu - I)Yu + λI)⁻¹ Yuᵀ Cu — как шаг ALS для пользователя
+        """
+        f = self.item_factors.shape[1]
+        A = np.empty((len(histories), f, f))
+        b = np.empty((len(histories), f))
+        for u, (idx, conf) in enumerate(histories):
+            Y = self.item_factors[idx].astype(np.float64)
+            A[u] = self._yty + (Y.T * (conf - 1.0)) @ Y + self._reg
+            b[u] = Y.T @ conf
+        return np.linalg.solve(A, b[..., None])[..., 0].astype(np.float32)
+
+    def top_k(self, user_factors: np.ndarray, chunk: int = 256) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-K товаров по скору x_u·y_i частями по chunk пользователей"""
+        k = self.topk
+        items = np.empty((len(user_factors), k), dtype=np.int32)
+        scores = np.empty((len(user_factors), k), dtype=np.float32)
+        for start in range(0, len(user_factors), chunk):
+            s = user_factors[start : start + chunk] @ self.item_factors.T
+            top = np.argpartition(-s, k - 1, axis=1)[:, :k]
+            top_s = np.take_along_axis(s, top, axis=1)
+            order = np.argsort(-top_s, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            items[start : start + len(s)] = self.item_ids[top]
+            scores[start : start + len(s)] = np.take_along_axis(top_s, order, axis=1)
+        return items, scores
+
+    def update(self) -> Optional[ALSDelta]:
+        """Пересчёт всех затронутых с прошлого раза пользователей"""
+        t0 = time.perf_counter()
+        with self._lock:
+            users = sorted(self._dirty)
+            self._dirty = set()
+            histories = [self._history(uid) for uid in users]
+        try:
+            if not users:
+                return None
+            factors = self.fold_in(histories)
+            items, scores = self.top_k(factors)
+            delta = (np.asarray(users, dtype=np.int64), items, scores)
+            if self.delta_dir is not None:
+                self.publish(delta)
+            self.n_updates += 1
+            self.n_users_updated += len(users)
+            return delta
+        finally:
+            self.last_update_ms = (time.perf_counter() - t0) * 1000
+
+    def publish(self, delta: ALSDelta) -> Path:
+        """Атомарная запись дельты: tmp-файл + os.replace"""
+        self.delta_dir.mkdir(parents=True, exist_ok=True)
+        name = f"{DELTA_PREFIX}{time.time_ns()}_{os.getpid()}.npz"
+        tmp = self.delta_dir / f".{name}.tmp"
+        users, items, scores = delta
+        with open(tmp, "wb") as f:
+            np.savez(f, users=users, items=items, scores=scores)
+        path = self.delta_dir / name
+        os.replace(tmp, path)
+        if self.delta_retention_sec > 0:
+            prune_deltas(self.delta_dir, self.delta_retention_sec)
+        return path
+
+
+def load_als_delta(path: Path) -> ALSDelta:
+    with np.load(path) as data:
+        return data["users"], data["items"], data["scores"]
+
+
+def list_new_deltas(delta_dir: Path, after: str = "") -> List[Path]:
+    """Дельты, опубликованные после файла с именем after (имена упорядочены по времени)"""
+    delta_dir = Path(delta_dir)
+    if not delta_dir.is_dir():
+        return []
+    return sorted(
+        p
+        for p in delta_dir.glob(f"{DELTA_PREFIX}*.npz")
+        if p.name > after
+    )
+
+
+def prune_deltas(delta_dir: Path, max_age_sec: float) -> int:
+    """
+    Удаление дельт старше max_age_sec: процессы, опрашивающие каталог
+    (ALS_DELTA_POLL_SEC), должны успеть их подхватить раньше
+    """
+    cutoff = time.time() - max_age_sec
+    removed = 0
+    for path in Path(delta_dir).glob(f"{DELTA_PREFIX}*.npz"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            # Уже удалена другим процессом
+            pass
+    return removed
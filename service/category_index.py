@@ -0,0 +1,100 @@
+import numpy as np
+from typing import Dict, List
+
+from .id_space import CSRLists, IdMap, EMPTY_IDX
+
+
+CATEGORY_LEVELS = [
+    "categoryid",
+    "level_5",
+    "level_4",
+    "level_3",
+    "level_2",
+    "level_1",
+    "level_0",
+    "root_category",
+]
+
+
+def parse_quotas(value: str) -> Dict[str, int]:
+    """Разбор квот из строки вида "categoryid:5,level_2:3" (пусто — источник выключен)"""
+    quotas = {}
+    for part in value.split(","):
+        name, _, quota = part.partition(":")
+        if name.strip():
+            quotas[name.strip()] = int(quota or 1)
+    return quotas
+
+
+class CategoryIndex:
+    """
+    Инвертированный индекс категория -> товары по убыванию популярности,
+    по строке CSR на категорию каждого уровня иерархии. Top-k категории —
+    срез первых k элементов строки.
+    """
+
+    def __init__(self, item_cat: np.ndarray, props: List[str], popularity: np.ndarray):
+        """
+        Args:
+            item_cat: категориальные свойства товаров [n_items, len(props)], -1 — нет
+            props: имена колонок item_cat
+            popularity: популярность товаров по индексу товара
+        """
+        self.categories: Dict[str, IdMap] = {}
+        self.lists: Dict[str, CSRLists] = {}
+        self.item_cat: Dict[str, np.ndarray] = {}
+
+        items = np.arange(len(item_cat), dtype=np.int32)
+        for level in CATEGORY_LEVELS:
+            if level not in props:
+                continue
+            cats = item_cat[:, props.index(level)]
+            categories = IdMap(cats)
+            rows = categories.to_idx(cats)
+            self.categories[level] = categories
+            self.lists[level] = CSRLists.from_pairs(
+                rows, items, popularity, len(categories)
+            )
+            self.item_cat[level] = cats
+
+    def top_k(self, level: str, category: int, k: int) -> np.ndarray:
+        """k самых популярных товаров категории уровня level"""
+        lists = self.lists.get(level)
+        if lists is None:
+            return EMPTY_IDX
+        return lists.row(self.categories[level].get(category))[0][:k]
+
+    def candidates(
+        self, recent_items: np.ndarray, quotas: Dict[str, int], last_k: int
+    ) -> List[np.ndarray]:
+        """
+        Кандидаты из категорий последних товаров: на каждом уровне не больше
+        quota товаров, поровну между различными категориями последних товаров.
+        """
+        recent = np.asarray(recent_items[:last_k])
+        recent = recent[recent >= 0]
+        parts = []
+        if not len(recent):
+            return parts
+        for level, quota in quotas.items():
+            cats = self.item_cat.get(level)
+            if cats is None or quota <= 0:
+                continue
+            # Категории последних товаров от новых к старым, без повторов
+            level_cats = cats[recent]
+            _, first = np.unique(level_cats, return_index=True)
+            level_cats = level_cats[np.sort(first)]
+            level_cats = level_cats[level_cats >= 0]
+            if not len(level_cats):
+                continue
+            per_cat = max(1, quota // len(level_cats))
+            for cat in level_cats[:quota].tolist():
+                parts.append(self.top_k(level, cat, per_cat))
+        return parts
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            self.categories[level].nbytes + self.lists[level].nbytes
+            for level in self.lists
+        )
@@ -0,0 +1,265 @@
+import threading
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+
+# Веса смешивания топов по типам событий (как было 6/2/2 в старом сэмплировании)
+DEFAULT_BLEND_WEIGHTS = {"addtocart": 0.6, "transaction": 0.2, "view": 0.2}
+
+# Синонимы названий событий, приходящих в /events
+EVENT_ALIASES = {"add_to_cart": "addtocart"}
+
+EMPTY_RANKED = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+
+
+class ColdStartSnapshot(NamedTuple):
+    """Ранжированные массивы (itemid, вероятности) одного пересчёта; не изменяются"""
+
+    by_event: Dict[str, Tuple[np.ndarray, np.ndarray]]
+    by_category: Dict[int, Tuple[np.ndarray, np.ndarray]]
+    blend: Tuple[np.ndarray, np.ndarray]
+    blend_sorted: Tuple[np.ndarray, np.ndarray]
+
+
+class ColdStartEngine:
+    """
+    Рекомендации для холодного старта: взвешенная смесь топов с сэмплированием
+    на каждый запрос. Живые события копятся под блокировкой, пересчёт идёт в
+    фоновом потоке (start) и подменяет готовый снимок целиком.
+    """
+
+    def __init__(
+        self,
+        top_by_event: Dict[str, Tuple[np.ndarray, np.ndarray]],
+        item_ids: Optional[np.ndarray] = None,
+        item_root_category: Optional[np.ndarray] = None,
+        blend_weights: Optional[Dict[str, float]] = None,
+        n_top: int = 100,
+        live_share: float = 0.5,
+        live_decay: float = 0.5,
+        refresh_sec: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        """
+        Args:
+            top_by_event: {событие: (itemid, счётчики)} — предрасчитанные топы
+            item_ids: отсортированные itemid из свойств товаров
+            item_root_category: root_category для item_ids (та же длина)
+            blend_weights: веса смешивания типов событий
+            n_top: длина ранжированного массива на событие/категорию
+            live_share: доля живых счётчиков в итоговом скоре
+            live_decay: множитель затухания живых счётчиков после обновления
+            refresh_sec: период обновления по живым событиям (0 — не обновлять)
+        """
+        self.blend_weights = dict(blend_weights or DEFAULT_BLEND_WEIGHTS)
+        self.n_top = n_top
+        self.live_share = live_share
+        self.live_decay = live_decay
+        self.refresh_sec = refresh_sec
+
+        self._static = {
+            event: dict(zip(items.tolist(), counts.tolist()))
+            for event, (items, counts) in top_by_event.items()
+        }
+        self._live: Dict[str, Dict[int, float]] = defaultdict(lambda: defaultdict(float))
+        self._live_lock = threading.Lock()
+
+        self._item_ids = item_ids
+        self._item_root_category = item_root_category
+
+        self._rng = np.random.default_rng(seed)
+
+        # Текущий снимок ранжированных массивов; подменяется под блокировкой
+        self._snapshot = ColdStartSnapshot({}, {}, EMPTY_RANKED, EMPTY_RANKED)
+        self._snapshot_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.refresh()
+
+    @property
+    def snapshot(self) -> ColdStartSnapshot:
+        with self._snapshot_lock:
+            return self._snapshot
+
+    @property
+    def by_event(self) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        return self.snapshot.by_event
+
+    @property
+    def by_category(self) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        return self.snapshot.by_category
+
+    @property
+    def blend(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self.snapshot.blend
+
+    def observe(self, item_id: str, event: str) -> None:
+        """Учитывает живое событие в счётчиках трендов (пересчёт — в фоне)"""
+        event = EVENT_ALIASES.get(event, event)
+        if event not in self.blend_weights:
+            return
+        try:
+            iid = int(item_id)
+        except (ValueError, TypeError):
+            return
+        with self._live_lock:
+            self._live[event][iid] += 1.0
+
+    def start(self) -> None:
+        """Фоновый пересчёт раз в refresh_sec"""
+        if self.refresh_sec <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name="cold-start", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.refresh_sec):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Cold start refresh error: {e}")
+
+    def refresh(self) -> None:
+        """Пересчёт ранжированных массивов по статическим и живым счётчикам"""
+        # Копия живых счётчиков с затуханием; мелкие значения выбрасываем
+        with self._live_lock:
+            live = {event: dict(counts) for event, counts in self._live.items()}
+            for event, counts in live.items():
+                self._live[event] = defaultdict(
+                    float,
+                    {
+                        iid: c * self.live_decay
+                        for iid, c in counts.items()
+                        if c * self.live_decay >= 0.5
+                    },
+                )
+
+        by_event = {}
+        blend_scores: Dict[int, float] = defaultdict(float)
+        for event, weight in self.blend_weights.items():
+            items, probs = self._event_distribution(event, live.get(event, {}))
+            by_event[event] = (items, probs)
+            for iid, p in zip(items.tolist(), probs.tolist()):
+                blend_scores[iid] += weight * p
+
+        blend_items, blend_probs = self._ranked(blend_scores)
+        order = np.argsort(blend_items, kind="stable")
+        snapshot = ColdStartSnapshot(
+            by_event,
+            self._split_by_category(blend_items, blend_probs),
+            (blend_items, blend_probs),
+            (blend_items[order], blend_probs[order]),
+        )
+        # Читатели берут снимок один раз на запрос и видят согласованное состояние
+        with self._snapshot_lock:
+            self._snapshot = snapshot
+
+    def recommend(
+        self, k: int = 10, root_category: Optional[int] = None
+    ) -> List[int]:
+        """Сэмплирует k уникальных товаров из смеси (или из топа категории)"""
+        return self._recommend(self.snapshot, k, root_category)
+
+    def _recommend(
+        self, snapshot: ColdStartSnapshot, k: int, root_category: Optional[int]
+    ) -> List[int]:
+        chosen = []
+        if root_category is not None and root_category in snapshot.by_category:
+            items, probs = snapshot.by_category[root_category]
+            chosen = self._sample(items, probs, k)
+
+        if len(chosen) < k:
+            items, probs = snapshot.blend
+            if chosen:
+                mask = ~np.isin(items, chosen)
+                items, probs = items[mask], probs[mask]
+            chosen = chosen + self._sample(items, probs, k - len(chosen))
+
+        return chosen
+
+    def recommend_with_scores(
+        self, k: int = 10, root_category: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Сэмпл как в recommend и вероятность каждого товара в общей смеси"""
+        snapshot = self.snapshot
+        items = np.asarray(self._recommend(snapshot, k, root_category), dtype=np.int64)
+        sorted_items, sorted_probs = snapshot.blend_sorted
+        scores = np.zeros(len(items), dtype=np.float64)
+        if len(sorted_items) and len(items):
+            pos = np.minimum(np.searchsorted(sorted_items, items), len(sorted_items) - 1)
+            found = sorted_items[pos] == items
+            scores[found] = sorted_probs[pos[found]]
+        return items, scores
+
+    def _event_distribution(
+        self, event: str, live: Dict[int, float]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Нормированное распределение популярности для одного типа событий"""
+        static = self._static.get(event, {})
+        static_total = sum(static.values())
+        live_total = sum(live.values())
+
+        live_share = self.live_share if live_total > 0 else 0.0
+        if static_total <= 0:
+            live_share = 1.0 if live_total > 0 else 0.0
+
+        scores: Dict[int, float] = defaultdict(float)
+        if static_total > 0:
+            for iid, c in static.items():
+                scores[iid] += (1.0 - live_share) * c / static_total
+        if live_total > 0:
+            for iid, c in live.items():
+                scores[iid] += live_share * c / live_total
+
+        return self._ranked(scores)
+
+    def _ranked(self, scores: Dict[int, float]) -> Tuple[np.ndarray, np.ndarray]:
+        """Топ n_top по скору в виде массивов (itemid, вероятности)"""
+        if not scores:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        items = np.fromiter(scores.keys(), dtype=np.int64, count=len(scores))
+        values = np.fromiter(scores.values(), dtype=np.float64, count=len(scores))
+        if len(items) > self.n_top:
+            top = np.argpartition(-values, self.n_top - 1)[: self.n_top]
+            items, values = items[top], values[top]
+        order = np.argsort(-values, kind="stable")
+        items, values = items[order], values[order]
+        total = values.sum()
+        probs = values / total if total > 0 else np.full(len(values), 1.0 / len(values))
+        return items, probs
+
+    def _split_by_category(
+        self, items: np.ndarray, probs: np.ndarray
+    ) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        """Разбивка смеси по root_category через бинарный поиск по свойствам"""
+        if self._item_ids is None or self._item_root_category is None or not len(items):
+            return {}
+
+        pos = np.searchsorted(self._item_ids, items)
+        pos = np.clip(pos, 0, len(self._item_ids) - 1)
+        found = self._item_ids[pos] == items
+        cats = np.where(found, self._item_root_category[pos], -1)
+
+        result = {}
+        for cat in np.unique(cats[cats >= 0]).tolist():
+            mask = cats == cat
+            cat_probs = probs[mask]
+            result[int(cat)] = (items[mask], cat_probs / cat_probs.sum())
+        return result
+
+    def _sample(self, items: np.ndarray, probs: np.ndarray, k: int) -> List[int]:
+        """Сэмплирование без возвращения пропорционально вероятностям"""
+        if k <= 0 or not len(items):
+            return []
+        if len(items) <= k:
+            return items.tolist()
+        probs = probs / probs.sum()
+        return self._rng.choice(items, size=k, replace=False, p=probs).tolist()
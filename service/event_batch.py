@@ -0,0 +1,103 @@
+import json
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .cold_start import EVENT_ALIASES
+from .recommender_repository import EVENT_WEIGHTS
+
+try:
+    import orjson
+except ImportError:  # необязательная зависимость: без неё — стандартный json
+    orjson = None
+
+
+FIELDS = ("userid", "itemid", "event")
+ALLOWED_EVENTS = sorted(set(EVENT_WEIGHTS) | set(EVENT_ALIASES))
+MAX_ERRORS = 20
+
+
+def _loads(data: bytes):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def parse_events_payload(body: bytes, content_type: str = "") -> List:
+    """
+    Тело запроса -> список записей. JSON-массив объектов или NDJSON
+    (по content-type или если тело не начинается с '[').
+    """
+    body = body.strip()
+    if not body:
+        return []
+    if "ndjson" in content_type or "jsonl" in content_type or not body.startswith(b"["):
+        records = []
+        for line in body.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(_loads(line))
+            except ValueError:
+                records.append(None)
+        return records
+    records = _loads(body)
+    if not isinstance(records, list):
+        raise ValueError("Expected a JSON array of events")
+    return records
+
+
+def validate_events(
+    records: List,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, List[Dict]]:
+    """
+    Векторная проверка: колонки собираются одним проходом, проверки — на массивах.
+    Returns:
+        userid, itemid, event (str-массивы), маска валидных строк, первые ошибки
+    """
+    n = len(records)
+    columns = {f: np.empty(n, dtype=object) for f in FIELDS}
+    is_obj = np.zeros(n, dtype=bool)
+    for i, rec in enumerate(records):
+        if isinstance(rec, dict):
+            is_obj[i] = True
+            for f in FIELDS:
+                columns[f][i] = rec.get(f)
+
+    values = {}
+    missing = ~is_obj
+    for f in FIELDS:
+        col = columns[f]
+        absent = np.equal(col, None)
+        missing |= absent
+        values[f] = np.where(absent, "", col).astype(str)
+        missing |= np.char.str_len(values[f]) == 0
+
+    bad_event = ~missing & ~np.isin(values["event"], ALLOWED_EVENTS)
+    bad_item = ~missing & ~np.char.isdigit(values["itemid"])
+    valid = ~(missing | bad_event | bad_item)
+
+    errors = []
+    for reason, mask in (
+        ("missing field or not an object", missing),
+        ("unknown event", bad_event),
+        ("non-integer itemid", bad_item),
+    ):
+        for i in np.flatnonzero(mask)[: MAX_ERRORS - len(errors)]:
+            errors.append({"index": int(i), "error": reason})
+    errors.sort(key=lambda e: e["index"])
+
+    return values["userid"], values["itemid"], values["event"], valid, errors
+
+
+def group_by_user(
+    userids: np.ndarray, itemids: np.ndarray, events: np.ndarray
+) -> Dict[str, List[Tuple[str, str]]]:
+    """События по пользователям с сохранением порядка внутри пользователя"""
+    order = np.argsort(userids, kind="stable")
+    u, i, e = userids[order], itemids[order], events[order]
+    starts = np.flatnonzero(np.r_[True, u[1:] != u[:-1]]) if len(u) else []
+    ends = list(starts[1:]) + [len(u)] if len(u) else []
+    return {
+        str(u[s]): list(zip(i[s:t].tolist(), e[s:t].tolist()))
+        for s, t in zip(starts, ends)
+    }
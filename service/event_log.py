@@ -0,0 +1,212 @@
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .events_store import EventStore
+
+
+SEGMENT_PREFIX = "events-"
+SEGMENT_SUFFIX = ".log"
+
+
+def _clean(value) -> str:
+    # Разделители формата внутри значений недопустимы
+    return str(value).replace("\t", " ").replace("\n", " ")
+
+
+class EventLog:
+    """
+    Append-only журнал событий с отложенной записью (write-behind).
+    /events только кладёт событие в буфер; фоновый поток пишет буфер в текущий
+    сегмент, периодически делает fsync, ротирует сегменты и компактирует их
+    до последних событий каждого пользователя.
+
+    Формат строки сегмента: ts<TAB>userid<TAB>itemid<TAB>event
+    """
+
+    def __init__(
+        self,
+        log_dir: str,
+        fsync_sec: float = 1.0,
+        flush_sec: float = 0.1,
+        segment_max_bytes: int = 64 * 2**20,
+        max_segments: int = 8,
+        events_per_user: int = 11,
+    ):
+        """
+        Args:
+            log_dir: директория сегментов
+            fsync_sec: период fsync (граница потерь при падении машины)
+            flush_sec: период записи буфера в файл
+            segment_max_bytes: размер сегмента до ротации
+            max_segments: при превышении числа сегментов запускается компакция
+            events_per_user: сколько последних событий пользователя переживает компакцию
+        """
+        self.log_dir = Path(log_dir)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.fsync_sec = fsync_sec
+        self.flush_sec = flush_sec
+        self.segment_max_bytes = segment_max_bytes
+        self.max_segments = max_segments
+        self.events_per_user = events_per_user
+
+        self._buffer: List[str] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._file = None
+        self._seq = max((self._seq_of(p) for p in self.segments()), default=0)
+        self._last_fsync = time.monotonic()
+
+        self.n_written = 0
+        self.n_compactions = 0
+        self.last_compaction_ms = 0.0
+
+    # --- запись ---
+
+    def append(self, userid: str, itemid: str, event: str) -> None:
+        """Неблокирующее добавление события в буфер"""
+        line = f"{time.time_ns() // 1_000_000}\t{_clean(userid)}\t{_clean(itemid)}\t{_clean(event)}\n"
+        with self._lock:
+            self._buffer.append(line)
+
+    def append_many(self, userid: str, events: Iterable[Tuple[str, str]]) -> None:
+        ts = time.time_ns() // 1_000_000
+        uid = _clean(userid)
+        lines = [f"{ts}\t{uid}\t{_clean(i)}\t{_clean(e)}\n" for i, e in events]
+        with self._lock:
+            self._buffer.extend(lines)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Остановка фонового потока с финальной записью и fsync"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush(fsync=True)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_sec):
+            try:
+                now = time.monotonic()
+                self.flush(fsync=now - self._last_fsync >= self.fsync_sec)
+                if len(self.segments()) > self.max_segments:
+                    self.compact()
+            except Exception as e:
+                print(f"Event log error: {e}")
+
+    def flush(self, fsync: bool = False) -> int:
+        """Запись буфера в текущий сегмент (вызывается фоновым потоком)"""
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        if lines:
+            f = self._current_segment()
+            f.write("".join(lines))
+            f.flush()
+            self.n_written += len(lines)
+        if fsync and self._file is not None:
+            os.fsync(self._file.fileno())
+            self._last_fsync = time.monotonic()
+        return len(lines)
+
+    def _current_segment(self):
+        if self._file is not None and self._file.tell() >= self.segment_max_bytes:
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+        if self._file is None:
+            self._seq += 1
+            self._file = open(self._segment_path(self._seq), "a", encoding="utf-8")
+        return self._file
+
+    # --- сегменты ---
+
+    def _segment_path(self, seq: int) -> Path:
+        return self.log_dir / f"{SEGMENT_PREFIX}{seq:08d}{SEGMENT_SUFFIX}"
+
+    @staticmethod
+    def _seq_of(path: Path) -> int:
+        return int(path.name[len(SEGMENT_PREFIX) : -len(SEGMENT_SUFFIX)])
+
+    def segments(self) -> List[Path]:
+        return sorted(self.log_dir.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"))
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(p.stat().st_size for p in self.segments())
+
+    def _read_latest(self, paths: List[Path]) -> Dict[str, deque]:
+        """Последние events_per_user событий каждого пользователя из сегментов"""
+        latest: Dict[str, deque] = {}
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    # Оборванная при падении последняя строка пропускается
+                    if not line.endswith("\n"):
+                        continue
+                    parts = line[:-1].split("\t")
+                    if len(parts) != 4:
+                        continue
+                    ts, userid, itemid, event = parts
+                    user_events = latest.get(userid)
+                    if user_events is None:
+                        user_events = latest[userid] = deque(maxlen=self.events_per_user)
+                    user_events.append((ts, itemid, event))
+        return latest
+
+    def compact(self) -> Path:
+        """
+        Сжатие закрытых сегментов в один: остаются последние события пользователей.
+        Размер журнала и время восстановления ограничены числом пользователей.
+        """
+        t0 = time.perf_counter()
+        closed = [
+            p
+            for p in self.segments()
+            if self._file is None or self._seq_of(p) != self._seq
+        ]
+        if not closed:
+            return None
+        latest = self._read_latest(closed)
+
+        # Компакт занимает номер последнего закрытого сегмента: порядок сохраняется
+        target = closed[-1]
+        tmp = target.with_suffix(".compact.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for userid, user_events in latest.items():
+                f.writelines(f"{ts}\t{userid}\t{i}\t{e}\n" for ts, i, e in user_events)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, target)
+        for path in closed[:-1]:
+            path.unlink()
+
+        self.n_compactions += 1
+        self.last_compaction_ms = (time.perf_counter() - t0) * 1000
+        return target
+
+    def replay(self, store: EventStore) -> Dict[str, float]:
+        """Восстановление последних событий пользователей в EventStore при старте"""
+        t0 = time.perf_counter()
+        latest = self._read_latest(self.segments())
+        n_events = 0
+        for userid, user_events in latest.items():
+            store.put_many(userid, ((i, e) for _, i, e in user_events))
+            n_events += len(user_events)
+        return {
+            "users": len(latest),
+            "events": n_events,
+            "segments": len(self.segments()),
+            "size_bytes": self.size_bytes,
+            "replay_ms": (time.perf_counter() - t0) * 1000,
+        }
@@ -1,4 +1,5 @@
-from typing import List
+from collections import deque
+from typing import Collection, Iterable, List, Tuple
 
 
 class EventStore:
@@ -6,20 +7,37 @@ class EventStore:
         self.events = {}
         self.max_events_per_user = max_events_per_user
 
+    def _user_events(self, user_id: str) -> deque:
+        # Новые события слева; хранится max_events_per_user + 1 последних
+        user_events = self.events.get(user_id)
+        if user_events is None:
+            user_events = deque(maxlen=self.max_events_per_user + 1)
+            self.events[user_id] = user_events
+        return user_events
+
     def put(self, user_id: str, item_id: str, event: str) -> None:
         """
         Сохраняет событие
         """
-        user_events = self.events.get(user_id, [])
-        self.events[user_id] = [{item_id: event}] + user_events[
-            : self.max_events_per_user
-        ]
+        self._user_events(user_id).appendleft((item_id, event))
+
+    def put_many(self, user_id: str, events: Iterable[Tuple[str, str]]) -> None:
+        """
+        Сохраняет события пользователя (в хронологическом порядке) за один проход
+        """
+        self._user_events(user_id).extendleft(events)
 
     def get(self, user_id: str, k: int) -> List[str]:
         """
         Возвращает события для пользователя
         """
-        user_events = [list(item.keys())[0] for item in self.events.get(user_id, [])][
-            :k
-        ]
-        return user_events
+        # Снимок очереди: события могут дописываться из другого потока
+        user_events = list(self.events.get(user_id, ()))
+        return [item_id for item_id, _ in user_events][:k]
+
+    def get_items_by_event(self, user_id: str, events: Collection[str]) -> List[str]:
+        """
+        Товары из сохранённых событий пользователя заданных типов
+        """
+        user_events = list(self.events.get(user_id, ()))
+        return [item_id for item_id, event in user_events if event in events]
@@ -1,6 +1,80 @@
-from .recommender_repository import RecommenderRepository
+from .recommender_repository import (
+    RecommenderRepository,
+    ITEM_CAT_PROPS,
+    ITEM_NUM_PROPS,
+)
+from .id_space import CSRLists, ItemBitset, lookup_scores
+from .category_index import CategoryIndex
+import time
+import numpy as np
 import pandas as pd
-from typing import Optional, List, Dict, Tuple
+from typing import Optional, Dict, List, Tuple
+
+
+def generate_candidate_ids(
+    recent_items: np.ndarray,
+    als_items: np.ndarray,
+    sim: CSRLists,
+    n_als: int,
+    n_sim: int,
+    last_k: int,
+    extra_parts: Optional[List[np.ndarray]] = None,
+) -> np.ndarray:
+    """
+    Кандидаты: топ ALS пользователя + похожие на последние товары (общий код онлайн/офлайн).
+    Все id — индексы товаров int32; списки ALS и похожих уже отсортированы по скору.
+    extra_parts — кандидаты дополнительных источников, добавляются в конец пула.
+    """
+    parts = []
+
+    # ALS рекомендации
+    if len(als_items) and n_als > 0:
+        parts.append(als_items[:n_als])
+
+    # Похожие товары
+    if len(recent_items) and n_sim > 0:
+        per_item = max(1, n_sim // max(1, len(recent_items)))
+        for it in recent_items[:last_k]:
+            parts.append(sim.row(int(it))[0][:per_item])
+
+    if extra_parts:
+        parts.extend(extra_parts)
+
+    if not parts:
+        return np.empty(0, dtype=np.int32)
+
+    # Дедупликация с сохранением порядка
+    pool = np.concatenate(parts)
+    _, first = np.unique(pool, return_index=True)
+    return pool[np.sort(first)]
+
+
+def filter_candidates(
+    candidates: np.ndarray,
+    unavailable: Optional[ItemBitset] = None,
+    exclude_items: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Отсев недоступных и исключённых для пользователя товаров одной маской"""
+    keep = np.ones(len(candidates), dtype=bool)
+    if unavailable is not None:
+        keep &= ~unavailable.contains(candidates)
+    if exclude_items is not None and len(exclude_items):
+        keep &= ~np.isin(candidates, exclude_items)
+    return candidates if keep.all() else candidates[keep]
+
+
+def sim_max_scores(
+    candidates: np.ndarray, recent_items: np.ndarray, sim: CSRLists, last_k: int
+) -> np.ndarray:
+    """Максимальная похожесть каждого кандидата на последние товары пользователя"""
+    rows = [sim.row(int(it)) for it in recent_items[:last_k]]
+    if not rows:
+        return np.zeros(len(candidates), dtype=np.float32)
+    return lookup_scores(
+        np.concatenate([items for items, _ in rows]),
+        np.concatenate([scores for _, scores in rows]),
+        candidates,
+    )
 
 
 class FeatureGenerator:
@@ -12,169 +86,158 @@ class FeatureGenerator:
         last_k: int = 5,
         n_als: int = 100,
         n_sim: int = 50,
+        filter_unavailable: bool = False,
+        category_index: Optional[CategoryIndex] = None,
+        category_quotas: Optional[Dict[str, int]] = None,
     ):
         self.data_loader = data_loader
         self.last_k = last_k
         self.n_als = n_als
         self.n_sim = n_sim
+        self.filter_unavailable = filter_unavailable
+        # Дополнительный источник: популярные товары категорий последних товаров
+        self.category_index = category_index
+        self.category_quotas = category_quotas or {}
+
+        # Сколько кандидатов отсеяно до построения признаков
+        self.n_filtered = 0
 
         # Получаем признаки из модели
         self.all_features = data_loader.model.feature_names_
-        self.cat_features = [
-            c
-            for c in [
-                "available",
-                "categoryid",
-                "root_category",
-                "level_0",
-                "level_1",
-                "level_2",
-                "level_3",
-                "level_4",
-                "level_5",
-            ]
-            if c in self.all_features
-        ]
+        self.cat_features = [c for c in ITEM_CAT_PROPS if c in self.all_features]
 
         print(
             f"FeatureGenerator initialized with LAST_K={last_k}, N_ALS={n_als}, N_SIM={n_sim}"
         )
 
     def generate_candidates(
-        self, recent_items: List[str], als_map_user: Optional[Dict]
-    ) -> List[str]:
-        pool = []
-
-        # ALS рекомендации
-        if als_map_user:
-            als_sorted = sorted(als_map_user.items(), key=lambda x: -x[1])[: self.n_als]
-            pool.extend([iid for iid, _ in als_sorted])
-
-        # Похожие товары
-        if recent_items:
-            per_item = max(1, self.n_sim // max(1, len(recent_items)))
-            for it in recent_items[: self.last_k]:
-                sim_items_dict = self.data_loader.sim_index.get(str(it), {})
-                sorted_items = sorted(sim_items_dict.items(), key=lambda x: -x[1])[
-                    :per_item
-                ]
-                pool.extend([sid for sid, _ in sorted_items])
-
-        # Дедупликация
-        seen = set()
-        uniq = []
-        for x in pool:
-            if x not in seen:
-                uniq.append(x)
-                seen.add(x)
-
-        return uniq
-
-    def calculate_sim_max(self, item_id: str, recent_items: List[str]) -> float:
-        best = 0.0
-        for it in recent_items[: self.last_k]:
-            pairs = self.data_loader.sim_index.get(str(it), {})
-            for sid, sc in pairs.items():
-                if str(sid) == str(item_id):
-                    best = max(best, float(sc))
-                    break
-        return best
+        self,
+        recent_items: np.ndarray,
+        als_items: np.ndarray,
+        n_als: Optional[int] = None,
+        n_sim: Optional[int] = None,
+        last_k: Optional[int] = None,
+    ) -> np.ndarray:
+        last_k = self.last_k if last_k is None else last_k
+        extra_parts = None
+        if self.category_index is not None and self.category_quotas:
+            extra_parts = self.category_index.candidates(
+                recent_items, self.category_quotas, last_k
+            )
+        return generate_candidate_ids(
+            recent_items,
+            als_items,
+            self.data_loader.sim,
+            self.n_als if n_als is None else n_als,
+            self.n_sim if n_sim is None else n_sim,
+            last_k,
+            extra_parts,
+        )
+
+    def item_popularity(self, candidate_ids: np.ndarray) -> np.ndarray:
+        """Популярность кандидатов с весами событий — как item_pop_w в range_dataset.py"""
+        item_pop = self.data_loader.item_pop
+        if item_pop is None:
+            return np.zeros(len(candidate_ids), dtype=np.float32)
+        return item_pop[candidate_ids]
+
+    def calculate_sim_max(
+        self,
+        candidates: np.ndarray,
+        recent_items: np.ndarray,
+        last_k: Optional[int] = None,
+    ) -> np.ndarray:
+        return sim_max_scores(
+            candidates,
+            recent_items,
+            self.data_loader.sim,
+            self.last_k if last_k is None else last_k,
+        )
 
     def build_features(
-        self, user_id: str, recent_items: List[str], session_id: Optional[str] = None
-    ) -> Tuple[pd.DataFrame, List[str]]:
+        self,
+        user_idx: Optional[int],
+        recent_items: np.ndarray,
+        session_id: Optional[str] = None,
+        n_als: Optional[int] = None,
+        n_sim: Optional[int] = None,
+        last_k: Optional[int] = None,
+        timings: Optional[Dict[str, float]] = None,
+        exclude_items: Optional[np.ndarray] = None,
+    ) -> Tuple[pd.DataFrame, np.ndarray]:
+        """
+        Args:
+            user_idx: индекс пользователя (None — нет в ALS)
+            recent_items: индексы последних товаров, от новых к старым (-1 — неизвестный)
+            exclude_items: индексы товаров, которые пользователю не рекомендуются
+            n_als, n_sim, last_k: переопределение размера пула на запрос
+            timings: словарь для замеров стадий (мс)
+        """
+        t0 = time.perf_counter()
+
         # Получение ALS рекомендаций для пользователя
-        user_idx = self.data_loader.get_user_idx(user_id)
-        als_map_user = self.data_loader.get_als_for_user(user_idx)
+        als_items, als_scores = self.data_loader.get_als_for_user(user_idx)
 
         # Генерация кандидатов
-        candidate_ids = self.generate_candidates(recent_items, als_map_user)
+        candidate_ids = self.generate_candidates(
+            recent_items, als_items, n_als, n_sim, last_k
+        )
+
+        # Отсев неподходящих кандидатов до построения признаков
+        n_pool = len(candidate_ids)
+        candidate_ids = filter_candidates(
+            candidate_ids,
+            self.data_loader.unavailable if self.filter_unavailable else None,
+            exclude_items,
+        )
+        self.n_filtered += n_pool - len(candidate_ids)
 
-        if not candidate_ids:
-            return pd.DataFrame(), []
-        rows = []
+        t1 = time.perf_counter()
+        if timings is not None:
+            timings["candidates_ms"] = (t1 - t0) * 1000
 
+        if not len(candidate_ids):
+            return pd.DataFrame(), candidate_ids
+
+        n = len(candidate_ids)
         # Сессионные признаки
         sess_cnt_view = float(len(recent_items))
-        sess_cnt_add = 0.0
-        sess_cnt_trx = 0.0
-        sess_n_items = float(len(set(recent_items)))
-        sess_n_events = sess_cnt_view
-        sess_duration = 0.0
-
-        for iid in candidate_ids:
-            ip = self.data_loader.props.get(str(iid), {})
-
-            row = {
-                "als_score": float(als_map_user.get(str(iid), 0.0))
-                if als_map_user
-                else 0.0,
-                "sim_max": self.calculate_sim_max(str(iid), recent_items),
-                "item_pop_w": 0.0,
-                "sess_n_events": sess_n_events,
-                "sess_n_items": sess_n_items,
-                "sess_duration": sess_duration,
-                "sess_cnt_view": sess_cnt_view,
-                "sess_cnt_addtocart": sess_cnt_add,
-                "sess_cnt_transaction": sess_cnt_trx,
-            }
-
-            # Категориальные свойства товара
-            for prop in [
-                "available",
-                "categoryid",
-                "root_category",
-                "level_0",
-                "level_1",
-                "level_2",
-                "level_3",
-                "level_4",
-                "level_5",
-            ]:
-                try:
-                    row[prop] = int(ip.get(prop, -1)) if ip else -1
-                except (ValueError, TypeError):
-                    row[prop] = -1
-
-            # Числовые свойства товара
-            for prop in [
-                "value_count",
-                "value_mean",
-                "value_std",
-                "value_min",
-                "value_max",
-            ]:
-                try:
-                    row[prop] = float(ip.get(prop, 0.0)) if ip else 0.0
-                except (ValueError, TypeError):
-                    row[prop] = 0.0
-
-            rows.append(row)
-
-        X = pd.DataFrame(rows)
-
-        # Приведение типов
-        for c in self.all_features:
-            if c in X.columns:
-                if c in self.cat_features:
-                    X[c] = X[c].fillna(-1).astype("int32")
-                else:
-                    X[c] = (
-                        pd.to_numeric(X[c], errors="coerce")
-                        .fillna(0.0)
-                        .astype("float32")
-                    )
+        sess_n_items = float(len(np.unique(recent_items)))
+
+        columns = {
+            "als_score": lookup_scores(als_items, als_scores, candidate_ids),
+            "sim_max": self.calculate_sim_max(candidate_ids, recent_items, last_k),
+            "item_pop_w": self.item_popularity(candidate_ids),
+            "sess_n_events": np.full(n, sess_cnt_view, dtype=np.float32),
+            "sess_n_items": np.full(n, sess_n_items, dtype=np.float32),
+            "sess_duration": np.zeros(n, dtype=np.float32),
+            "sess_cnt_view": np.full(n, sess_cnt_view, dtype=np.float32),
+            "sess_cnt_addtocart": np.zeros(n, dtype=np.float32),
+            "sess_cnt_transaction": np.zeros(n, dtype=np.float32),
+        }
+
+        # Свойства товара
+        item_cat = self.data_loader.item_cat[candidate_ids]
+        for j, prop in enumerate(ITEM_CAT_PROPS):
+            columns[prop] = item_cat[:, j]
+        item_num = self.data_loader.item_num[candidate_ids]
+        for j, prop in enumerate(ITEM_NUM_PROPS):
+            columns[prop] = item_num[:, j]
+
+        X = pd.DataFrame(columns)
 
         # Добавление служебных колонок
-        X["visitorid"] = user_id
+        X["visitorid"] = -1 if user_idx is None else user_idx
         X["anchor_session_id"] = session_id or "default_session"
         X["itemid"] = candidate_ids
 
         # Конвертация категориальных признаков в строки
         X = self._convert_categorical_to_str(X)
-        X["group_id"] = (
-            X["visitorid"].astype(str) + "_" + X["anchor_session_id"].astype(str)
-        )
+        # Одна группа на запрос
+        X["group_id"] = 0
+
+        if timings is not None:
+            timings["features_ms"] = (time.perf_counter() - t1) * 1000
 
         return X, candidate_ids
 
@@ -0,0 +1,343 @@
+import json
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# Бинарные ALS-артефакты (als_pipeline.py): .npy с целочисленными id
+BIN_DIR = "bin"
+USER_IDS_FILE = "user_ids.npy"  # visitoridx -> visitorid
+ITEM_IDS_FILE = "item_ids.npy"  # itemidx -> itemid
+ALS_USERS_FILE = "als_users.npy"  # visitorid, по возрастанию
+ALS_ITEMS_FILE = "als_items.npy"  # [n_users, N] itemid
+ALS_SCORES_FILE = "als_scores.npy"  # [n_users, N] скор
+SIM_ITEMS_KEYS_FILE = "sim_keys.npy"  # itemid, по возрастанию
+SIM_ITEMS_FILE = "sim_items.npy"  # [n_items, N] похожие itemid
+SIM_SCORES_FILE = "sim_scores.npy"  # [n_items, N] скор
+ITEM_POP_KEYS_FILE = "item_pop_keys.npy"  # itemid, по возрастанию
+ITEM_POP_FILE = "item_pop_w.npy"  # популярность с весами событий по item_pop_keys
+
+EMPTY_IDX = np.empty(0, dtype=np.int32)
+EMPTY_SCORES = np.empty(0, dtype=np.float32)
+
+# Шард пользователя: старшие биты мультипликативного хэша visitorid
+SHARD_HASH = 0x9E3779B97F4A7C15
+UINT64_MASK = 2**64 - 1
+
+
+def user_shards(user_ids: np.ndarray, n_shards: int) -> np.ndarray:
+    """Шард каждого числового visitorid (векторно, как user_shard)"""
+    ids = np.asarray(user_ids, dtype=np.int64).astype(np.uint64)
+    if n_shards <= 1:
+        return np.zeros(len(ids), dtype=np.int64)
+    hashed = (ids * np.uint64(SHARD_HASH)) >> np.uint64(32)
+    return (hashed % np.uint64(n_shards)).astype(np.int64)
+
+
+def user_shard(user_id, n_shards: int) -> int:
+    """Шард пользователя по внешнему id; нечисловые id — по crc32 строки"""
+    if n_shards <= 1:
+        return 0
+    value = str(user_id)
+    if not value.isdigit():
+        return zlib.crc32(value.encode()) % n_shards
+    return (((int(value) * SHARD_HASH) & UINT64_MASK) >> 32) % n_shards
+
+
+class IdMap:
+    """
+    Внешние id <-> плотные внутренние индексы int32.
+    Индекс — позиция в отсортированном массиве внешних id; id, добавленные
+    после загрузки (новые пользователи), получают индексы за его концом
+    и могут быть удалены (remove), их индексы повторно не выдаются.
+    """
+
+    def __init__(self, external_ids: Iterable):
+        ids = np.unique(np.asarray(external_ids, dtype=np.int64))
+        self.ids = ids[ids >= 0]
+        # Добавленные id: {id: индекс} и {индекс: id}
+        self._extra: Dict[int, int] = {}
+        self._extra_ids: Dict[int, int] = {}
+        self._next_idx = len(self.ids)
+
+    def __len__(self) -> int:
+        """Размер пространства индексов (индексы удалённых id не переиспользуются)"""
+        return self._next_idx
+
+    def get(self, external_id) -> Optional[int]:
+        """Индекс по внешнему id (None — неизвестный id)"""
+        try:
+            value = int(external_id)
+        except (ValueError, TypeError):
+            return None
+        pos = int(np.searchsorted(self.ids, value))
+        if pos < len(self.ids) and self.ids[pos] == value:
+            return pos
+        return self._extra.get(value)
+
+    def add(self, external_id: int) -> int:
+        """Индекс для id, которого не было при загрузке"""
+        idx = self.get(external_id)
+        if idx is None:
+            idx = self._next_idx
+            self._next_idx += 1
+            self._extra[int(external_id)] = idx
+            self._extra_ids[idx] = int(external_id)
+        return idx
+
+    def remove(self, idx: int) -> bool:
+        """Удаление добавленного id по индексу (загруженные id не удаляются)"""
+        external_id = self._extra_ids.pop(idx, None)
+        if external_id is None:
+            return False
+        del self._extra[external_id]
+        return True
+
+    def to_idx(self, external_ids) -> np.ndarray:
+        """Векторное преобразование; неизвестные и нечисловые id -> -1"""
+        values = np.asarray(external_ids)
+        if values.dtype.kind not in "iuf":
+            # Строковые id с API: нечисловые -> NaN
+            values = pd.to_numeric(
+                pd.Series(values.ravel(), dtype=object), errors="coerce"
+            ).to_numpy(dtype=np.float64)
+        if values.dtype.kind == "f":
+            valid = ~np.isnan(values)
+            values = np.where(valid, values, -1).astype(np.int64)
+        else:
+            values = values.astype(np.int64)
+            valid = np.ones(len(values), dtype=bool)
+        out = np.full(len(values), -1, dtype=np.int32)
+        if len(self.ids):
+            pos = np.minimum(np.searchsorted(self.ids, values), len(self.ids) - 1)
+            found = valid & (self.ids[pos] == values)
+            out[found] = pos[found]
+        if self._extra:
+            for i in np.flatnonzero(valid & (out < 0)):
+                out[i] = self._extra.get(int(values[i]), -1)
+        return out
+
+    def to_external(self, idx) -> np.ndarray:
+        idx = np.asarray(idx, dtype=np.int64)
+        if self._next_idx == len(self.ids):
+            return self.ids[idx]
+        out = np.full(idx.shape, -1, dtype=np.int64)
+        loaded = idx < len(self.ids)
+        out[loaded] = self.ids[idx[loaded]]
+        out[~loaded] = [self._extra_ids.get(i, -1) for i in idx[~loaded].tolist()]
+        return out
+
+    @property
+    def nbytes(self) -> int:
+        return self.ids.nbytes
+
+
+class CSRLists:
+    """Списки (индекс товара, скор) по строкам в CSR-виде, внутри строки — по убыванию скора"""
+
+    def __init__(self, indptr: np.ndarray, items: np.ndarray, scores: np.ndarray):
+        self.indptr = indptr
+        self.items = items
+        self.scores = scores
+
+    @classmethod
+    def from_pairs(
+        cls, rows: np.ndarray, items: np.ndarray, scores: np.ndarray, n_rows: int
+    ) -> "CSRLists":
+        """Сборка из троек (строка, товар, скор); строки/товары < 0 отбрасываются"""
+        keep = (rows >= 0) & (items >= 0)
+        rows, items, scores = rows[keep], items[keep], scores[keep]
+        order = np.lexsort((-scores, rows))
+        counts = np.bincount(rows, minlength=n_rows)
+        indptr = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(
+            indptr,
+            items[order].astype(np.int32),
+            scores[order].astype(np.float32),
+        )
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def row(self, i: Optional[int]) -> Tuple[np.ndarray, np.ndarray]:
+        if i is None or i < 0 or i >= len(self):
+            return EMPTY_IDX, EMPTY_SCORES
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return self.items[start:end], self.scores[start:end]
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.items.nbytes + self.scores.nbytes
+
+
+class ItemBitset:
+    """Множество индексов товаров в виде битовой маски (1 бит на товар)"""
+
+    def __init__(self, n: int, idx: Optional[np.ndarray] = None):
+        self.n = n
+        flags = np.zeros(n, dtype=bool)
+        if idx is not None:
+            idx = np.asarray(idx)
+            flags[idx[(idx >= 0) & (idx < n)]] = True
+        self.bits = np.packbits(flags, bitorder="little")
+
+    def __len__(self) -> int:
+        return int(np.unpackbits(self.bits, bitorder="little")[: self.n].sum())
+
+    def contains(self, idx: np.ndarray) -> np.ndarray:
+        """Векторная проверка; индексы вне диапазона (неизвестные товары) -> False"""
+        idx = np.asarray(idx, dtype=np.int64)
+        inside = (idx >= 0) & (idx < self.n)
+        safe = np.where(inside, idx, 0)
+        return inside & ((self.bits[safe >> 3] >> (safe & 7)) & 1).astype(bool)
+
+    @property
+    def nbytes(self) -> int:
+        return self.bits.nbytes
+
+
+def lookup_scores(
+    keys: np.ndarray, scores: np.ndarray, query: np.ndarray
+) -> np.ndarray:
+    """Скор для каждого query из пар (keys, scores); нет пары -> 0, повтор -> максимум"""
+    out = np.zeros(len(query), dtype=np.float32)
+    if not len(keys) or not len(query):
+        return out
+    order = np.lexsort((-scores, keys))
+    k, s = keys[order], scores[order]
+    first = np.ones(len(k), dtype=bool)
+    first[1:] = k[1:] != k[:-1]
+    k, s = k[first], s[first]
+    pos = np.minimum(np.searchsorted(k, query), len(k) - 1)
+    found = k[pos] == query
+    out[found] = s[pos[found]]
+    return out
+
+
+def _id_array(mapping: dict) -> np.ndarray:
+    """{idx: id} -> массив id по индексу (пропуски = -1)"""
+    idx = np.fromiter((int(float(k)) for k in mapping), dtype=np.int64)
+    ids = np.fromiter((int(float(v)) for v in mapping.values()), dtype=np.int64)
+    out = np.full(int(idx.max()) + 1 if len(idx) else 0, -1, dtype=np.int64)
+    out[idx] = ids
+    return out
+
+
+def load_train_id_maps(als_dir: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """visitorid/itemid по индексам обучения ALS (bin/*.npy или hash_*idx_train.json)"""
+    als_dir = Path(als_dir)
+    if (als_dir / BIN_DIR / USER_IDS_FILE).exists():
+        return (
+            np.load(als_dir / BIN_DIR / USER_IDS_FILE).astype(np.int64),
+            np.load(als_dir / BIN_DIR / ITEM_IDS_FILE).astype(np.int64),
+        )
+    with open(als_dir / "hash_visitoridx_train.json") as f:
+        user_ids = _id_array(json.load(f))
+    with open(als_dir / "hash_itemidx_train.json") as f:
+        item_ids = _id_array(json.load(f))
+    return user_ids, item_ids
+
+
+def _take_ids(ids: np.ndarray, idx: np.ndarray) -> np.ndarray:
+    idx = np.asarray(idx, dtype=np.int64)
+    valid = (idx >= 0) & (idx < len(ids))
+    return np.where(valid, ids[np.clip(idx, 0, max(0, len(ids) - 1))], -1)
+
+
+def save_item_popularity(als_dir: Path, item_ids: np.ndarray, popularity: np.ndarray) -> None:
+    """Популярность всех товаров (itemid -> сумма весов событий) рядом с bin-артефактами"""
+    bin_dir = Path(als_dir) / BIN_DIR
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    item_ids = np.asarray(item_ids, dtype=np.int64)
+    order = np.argsort(item_ids, kind="stable")
+    np.save(bin_dir / ITEM_POP_KEYS_FILE, item_ids[order])
+    np.save(bin_dir / ITEM_POP_FILE, np.asarray(popularity, dtype=np.float32)[order])
+
+
+def load_item_popularity(als_dir: Path) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """itemid и популярность из save_item_popularity; None, если артефакта нет"""
+    bin_dir = Path(als_dir) / BIN_DIR
+    if not (bin_dir / ITEM_POP_FILE).exists():
+        return None
+    return np.load(bin_dir / ITEM_POP_KEYS_FILE), np.load(bin_dir / ITEM_POP_FILE)
+
+
+def load_als_pairs(
+    als_dir: Path, shard: Optional[Tuple[int, int]] = None
+) -> Dict[str, np.ndarray]:
+    """
+    ALS-рекомендации и похожие товары плоскими массивами во внешних id:
+    als_users/als_items/als_scores и sim_keys/sim_items/sim_scores.
+    Бинарные артефакты читаются через mmap, иначе — parquet + json.
+
+    Args:
+        shard: (номер шарда, число шардов) — ALS только пользователей шарда;
+            из mmap читаются только их строки
+    """
+    als_dir = Path(als_dir)
+    bin_dir = als_dir / BIN_DIR
+    if (bin_dir / ALS_USERS_FILE).exists():
+        als_users = np.load(bin_dir / ALS_USERS_FILE)
+        als_items = np.load(bin_dir / ALS_ITEMS_FILE, mmap_mode="r")
+        als_scores = np.load(bin_dir / ALS_SCORES_FILE, mmap_mode="r")
+        if shard is not None:
+            rows = np.flatnonzero(user_shards(als_users, shard[1]) == shard[0])
+            als_users, als_items, als_scores = als_users[rows], als_items[rows], als_scores[rows]
+        sim_items = np.load(bin_dir / SIM_ITEMS_FILE, mmap_mode="r")
+        return {
+            "als_users": np.repeat(als_users, als_items.shape[1]),
+            "als_items": np.asarray(als_items).ravel(),
+            "als_scores": np.asarray(als_scores).ravel(),
+            "sim_keys": np.repeat(np.load(bin_dir / SIM_ITEMS_KEYS_FILE), sim_items.shape[1]),
+            "sim_items": np.asarray(sim_items).ravel(),
+            "sim_scores": np.load(bin_dir / SIM_SCORES_FILE).ravel(),
+        }
+
+    user_ids, item_ids = load_train_id_maps(als_dir)
+    als = pd.read_parquet(als_dir / "als_recommendations.parquet")
+    sim = pd.read_parquet(als_dir / "similar_items_df.parquet")
+    pairs = {
+        "als_users": _take_ids(user_ids, als["visitoridx"].to_numpy()),
+        "als_items": _take_ids(item_ids, als["itemidx"].to_numpy()),
+        "als_scores": als["rating"].to_numpy(dtype=np.float32),
+        "sim_keys": _take_ids(item_ids, sim["items_idx"].to_numpy()),
+        "sim_items": _take_ids(item_ids, sim["sim_item_id_idx"].to_numpy()),
+        "sim_scores": sim["score"].to_numpy(dtype=np.float32),
+    }
+    if shard is not None:
+        own = user_shards(pairs["als_users"], shard[1]) == shard[0]
+        for key in ("als_users", "als_items", "als_scores"):
+            pairs[key] = pairs[key][own]
+    # Товар не должен быть похожим сам на себя
+    self_pair = pairs["sim_keys"] == pairs["sim_items"]
+    pairs["sim_items"] = np.where(self_pair, -1, pairs["sim_items"])
+    return pairs
+
+
+def build_als_index(
+    pairs: Dict[str, np.ndarray], extra_item_ids: Optional[Iterable] = None
+) -> Tuple[IdMap, IdMap, CSRLists, CSRLists]:
+    """Пространства id пользователей/товаров и CSR-индексы ALS и похожих товаров"""
+    users = IdMap(pairs["als_users"])
+    item_parts = [pairs["als_items"], pairs["sim_keys"], pairs["sim_items"]]
+    if extra_item_ids is not None:
+        item_parts.append(np.asarray(list(extra_item_ids), dtype=np.int64))
+    items = IdMap(np.concatenate([np.asarray(p, dtype=np.int64) for p in item_parts]))
+
+    als = CSRLists.from_pairs(
+        users.to_idx(pairs["als_users"]),
+        items.to_idx(pairs["als_items"]),
+        np.asarray(pairs["als_scores"], dtype=np.float32),
+        len(users),
+    )
+    sim = CSRLists.from_pairs(
+        items.to_idx(pairs["sim_keys"]),
+        items.to_idx(pairs["sim_items"]),
+        np.asarray(pairs["sim_scores"], dtype=np.float32),
+        len(items),
+    )
+    return users, items, als, sim
@@ -0,0 +1,193 @@
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+
+TIMELINE_ITEMS_FILE = "items.npy"  # itemid, по возрастанию
+TIMELINE_OFFSETS_FILE = "offsets.npy"  # [n_items + 1] границы версий товара
+TIMELINE_TS_FILE = "ts.npy"  # timestamp версии (мс), внутри товара по возрастанию
+TIMELINE_COLUMNS_FILE = "columns.npy"  # имена свойств col_<имя>.npy в исходном порядке
+SERVICE_COLUMNS = ("itemid", "timestamp", "ts_prop")
+
+
+def to_ms(values) -> np.ndarray:
+    """Время в миллисекундах int64 из мс-чисел или datetime"""
+    if isinstance(values, np.ndarray) and values.dtype.kind in "iu":
+        return values.astype(np.int64, copy=False)
+    values = pd.Series(values) if not isinstance(values, pd.Series) else values
+    if pd.api.types.is_datetime64_any_dtype(values):
+        if getattr(values.dt, "tz", None) is not None:
+            values = values.dt.tz_convert("UTC").dt.tz_localize(None)
+        return values.astype("datetime64[ms]").astype(np.int64).to_numpy()
+    return pd.to_numeric(values, errors="coerce").fillna(-1).astype(np.int64).to_numpy()
+
+
+class ItemPropertyTimeline:
+    """
+    История свойств товаров для point-in-time джойнов: версии отсортированы
+    по (товар, время), границы версий товара — в offsets (CSR). Значение на
+    момент t — последняя версия с timestamp <= t, поиск — векторный бинпоиск
+    внутри диапазона версий товара, без утечки свойств из будущего.
+    """
+
+    def __init__(
+        self,
+        items: np.ndarray,
+        offsets: np.ndarray,
+        ts: np.ndarray,
+        columns: Dict[str, np.ndarray],
+    ):
+        self.items = items
+        self.offsets = offsets
+        self.ts = ts
+        self.columns = columns
+
+    @classmethod
+    def from_frame(
+        cls,
+        props: pd.DataFrame,
+        columns: Optional[List[str]] = None,
+        ffill: bool = True,
+    ) -> "ItemPropertyTimeline":
+        """
+        Args:
+            props: строки (itemid, timestamp, свойства...)
+            columns: свойства для хранения (по умолчанию все, кроме служебных)
+            ffill: пропуск в версии заполняется прошлым значением свойства этого товара
+        """
+        columns = columns or [c for c in props.columns if c not in SERVICE_COLUMNS]
+        itemid = pd.to_numeric(props["itemid"], errors="coerce")
+        keep = itemid.notna().to_numpy()
+        itemid = itemid.to_numpy()[keep].astype(np.int64)
+        ts = to_ms(props["timestamp"])[keep]
+
+        order = np.lexsort((ts, itemid))
+        itemid, ts = itemid[order], ts[order]
+        items, starts = np.unique(itemid, return_index=True)
+        offsets = np.append(starts, len(itemid)).astype(np.int64)
+
+        values = {}
+        for col in columns:
+            column = props[col].iloc[np.flatnonzero(keep)[order]].reset_index(drop=True)
+            if column.dtype == object:
+                column = pd.to_numeric(column, errors="coerce")
+            if ffill and column.isna().any():
+                column = column.groupby(itemid).ffill()
+            values[col] = column.to_numpy()
+        return cls(items, offsets, ts, values)
+
+    @classmethod
+    def from_parquet(
+        cls, path: Path, columns: Optional[List[str]] = None, ffill: bool = True
+    ) -> "ItemPropertyTimeline":
+        """Сборка из parquet со всеми версиями (item_properties_cats_tree.parquet)"""
+        if columns is not None:
+            read = ["itemid", "timestamp"] + list(columns)
+        else:
+            read = [
+                c for c in pq.ParquetFile(path).schema_arrow.names if c != "ts_prop"
+            ]
+        props = pq.read_table(path, columns=read).to_pandas()
+        return cls.from_frame(props, columns, ffill)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    @property
+    def n_versions(self) -> int:
+        return len(self.ts)
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.items.nbytes
+            + self.offsets.nbytes
+            + self.ts.nbytes
+            + sum(v.nbytes for v in self.columns.values())
+        )
+
+    def asof_positions(self, itemids, ts) -> np.ndarray:
+        """
+        Позиция версии на момент ts для каждой пары (itemid, ts); -1 — товара нет
+        или у него ещё не было ни одной версии.
+        """
+        itemids = np.asarray(itemids, dtype=np.int64)
+        ts = to_ms(ts)
+        out = np.full(len(itemids), -1, dtype=np.int64)
+        if not len(self.items) or not len(itemids):
+            return out
+
+        row = np.minimum(np.searchsorted(self.items, itemids), len(self.items) - 1)
+        found = self.items[row] == itemids
+        lo = self.offsets[row]
+        hi = self.offsets[row + 1]
+
+        # Бинпоиск первой версии с timestamp > ts, одновременно для всех пар
+        lo, hi = lo[found], hi[found]
+        q = ts[found]
+        while True:
+            active = lo < hi
+            if not active.any():
+                break
+            mid = (lo + hi) // 2
+            go_right = active & (self.ts[np.minimum(mid, len(self.ts) - 1)] <= q)
+            lo = np.where(go_right, mid + 1, lo)
+            hi = np.where(active & ~go_right, mid, hi)
+
+        pos = lo - 1
+        first = self.offsets[row[found]]
+        out[found] = np.where(pos >= first, pos, -1)
+        return out
+
+    def asof(
+        self, itemids, ts, columns: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+        """Свойства товаров на момент ts (NaN, если версии на этот момент нет)"""
+        pos = self.asof_positions(itemids, ts)
+        valid = pos >= 0
+        safe = np.where(valid, pos, 0)
+        result = {}
+        for col in columns or list(self.columns):
+            values = self.columns[col][safe] if len(self.ts) else np.empty(len(pos))
+            if not valid.all():
+                values = values.astype(np.float64)
+                values[~valid] = np.nan
+            result[col] = values
+        return pd.DataFrame(result)
+
+    def latest(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Последняя версия каждого товара (аналог item_props_last)"""
+        last = self.offsets[1:] - 1
+        frame = pd.DataFrame({"itemid": self.items, "timestamp": self.ts[last]})
+        for col in columns or list(self.columns):
+            frame[col] = self.columns[col][last]
+        return frame
+
+    def save(self, out_dir: Path) -> None:
+        """Массивы в .npy (для загрузки через mmap в сервисе)"""
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        np.save(out_dir / TIMELINE_ITEMS_FILE, self.items)
+        np.save(out_dir / TIMELINE_OFFSETS_FILE, self.offsets)
+        np.save(out_dir / TIMELINE_TS_FILE, self.ts)
+        np.save(out_dir / TIMELINE_COLUMNS_FILE, np.array(list(self.columns), dtype=str))
+        for col, values in self.columns.items():
+            np.save(out_dir / f"col_{col}.npy", values)
+
+    @classmethod
+    def load(cls, in_dir: Path, mmap: bool = True) -> "ItemPropertyTimeline":
+        in_dir = Path(in_dir)
+        mode = "r" if mmap else None
+        columns = {
+            col: np.load(in_dir / f"col_{col}.npy", mmap_mode=mode)
+            for col in np.load(in_dir / TIMELINE_COLUMNS_FILE).tolist()
+        }
+        return cls(
+            np.load(in_dir / TIMELINE_ITEMS_FILE, mmap_mode=mode),
+            np.load(in_dir / TIMELINE_OFFSETS_FILE, mmap_mode=mode),
+            np.load(in_dir / TIMELINE_TS_FILE, mmap_mode=mode),
+            columns,
+        )
@@ -0,0 +1,100 @@
+import math
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+
+class LatencyBudgetController:
+    """Адаптивный размер пула кандидатов под бюджет задержки запроса"""
+
+    def __init__(
+        self,
+        n_als: int = 20,
+        n_sim: int = 10,
+        last_k: int = 5,
+        budget_ms: float = 0.0,
+        min_pool: int = 10,
+        max_pool: Optional[int] = None,
+        alpha: float = 0.2,
+    ):
+        """
+        Args:
+            n_als, n_sim, last_k: базовые параметры пула (из env)
+            budget_ms: бюджет по умолчанию (0 — адаптивный режим выключен)
+            min_pool, max_pool: границы размера пула
+            alpha: коэффициент экспоненциального сглаживания замеров
+        """
+        self.n_als = n_als
+        self.n_sim = n_sim
+        self.last_k = last_k
+        self.budget_ms = budget_ms
+        self.base_pool = max(1, n_als + n_sim)
+        self.min_pool = min_pool
+        self.max_pool = max_pool or 4 * self.base_pool
+        self.alpha = alpha
+
+        # Сглаженные замеры: фиксированная часть и стоимость одного кандидата
+        self.fixed_ms: Optional[float] = None
+        self.per_candidate_ms: Optional[float] = None
+
+        # Текущая очередь (запросы в обработке) и замеры — под одной блокировкой
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    @property
+    def in_flight(self) -> int:
+        with self._cond:
+            return self._in_flight
+
+    @contextmanager
+    def track(self):
+        """Учёт запроса в очереди на время его обработки"""
+        with self._cond:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                if not self._in_flight:
+                    self._cond.notify_all()
+
+    def wait_idle(self, timeout: float) -> bool:
+        """Ожидание, пока нет запросов в обработке (не дольше timeout с); True — дождались"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._in_flight, timeout)
+
+    def plan(self, budget_ms: Optional[float] = None) -> Tuple[int, int, int]:
+        """Возвращает (n_als, n_sim, last_k) для запроса с заданным бюджетом"""
+        budget = budget_ms if budget_ms is not None else self.budget_ms
+        with self._cond:
+            queue_depth = max(0, self._in_flight - 1)
+            fixed_ms, per_candidate_ms = self.fixed_ms, self.per_candidate_ms
+        if not budget or budget <= 0 or per_candidate_ms is None:
+            return self.n_als, self.n_sim, self.last_k
+
+        # Запросы в очереди делят бюджет текущего запроса
+        effective_budget = budget / (1 + queue_depth) - (fixed_ms or 0.0)
+        pool = int(effective_budget / max(per_candidate_ms, 1e-6))
+        pool = min(self.max_pool, max(self.min_pool, pool))
+
+        scale = pool / self.base_pool
+        n_als = max(1, round(self.n_als * scale)) if self.n_als else 0
+        n_sim = max(1, pool - n_als) if self.n_sim else 0
+        last_k = max(1, min(self.last_k, math.ceil(self.last_k * scale)))
+        return n_als, n_sim, last_k
+
+    def record(self, timings: Dict[str, float], pool_size: int) -> None:
+        """Обновляет оценки по замерам стадий одного запроса (мс)"""
+        fixed = timings.get("candidates_ms", 0.0)
+        variable = timings.get("features_ms", 0.0) + timings.get("ranking_ms", 0.0)
+
+        with self._cond:
+            self.fixed_ms = self._ewma(self.fixed_ms, fixed)
+            if pool_size > 0:
+                self.per_candidate_ms = self._ewma(
+                    self.per_candidate_ms, variable / pool_size
+                )
+
+    def _ewma(self, prev: Optional[float], value: float) -> float:
+        return value if prev is None else (1 - self.alpha) * prev + self.alpha * value
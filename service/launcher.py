@@ -0,0 +1,210 @@
+"""
+Запуск нескольких воркеров с общими ассетами (preload-and-fork).
+
+Родительский процесс один раз загружает RecommenderRepository, замораживает
+кучу (gc.freeze), чтобы сборщик мусора не трогал страницы загруженных объектов,
+и форкает воркеры: модель, id-маппинги и CSR-индексы разделяются между ними
+copy-on-write. Родитель следит за воркерами и печатает их уникальную память (USS).
+
+Состояние пользователя (события, спекулятивный пересчёт, живые счётчики ALS и
+холодного старта) у каждого воркера своё, поэтому при --workers > 1 воркеры
+работают шардами пользователей (USER_SHARDS = числу воркеров) на локальных
+портах base-port.., а на публичном порту слушает service.router: все запросы
+пользователя попадают в один и тот же воркер.
+
+    python -m service.launcher --workers 4 --port 8000 --base-port 8101
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, List
+
+import psutil
+import uvicorn
+
+
+def memory_report(pids: List[int]) -> Dict[int, Dict[str, float]]:
+    """RSS / PSS / USS процессов в MB (USS — память, не разделяемая ни с кем)"""
+    report = {}
+    for pid in pids:
+        try:
+            info = psutil.Process(pid).memory_full_info()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        report[pid] = {
+            "rss_mb": info.rss / 2**20,
+            "pss_mb": getattr(info, "pss", 0.0) / 2**20,
+            "uss_mb": info.uss / 2**20,
+        }
+    return report
+
+
+def print_memory_report(parent_pid: int, worker_pids: List[int]) -> None:
+    report = memory_report([parent_pid] + worker_pids)
+    for pid, mem in report.items():
+        role = "parent" if pid == parent_pid else "worker"
+        print(
+            f"  {role} {pid}: rss={mem['rss_mb']:.0f} MB "
+            f"pss={mem['pss_mb']:.0f} MB uss={mem['uss_mb']:.0f} MB"
+        )
+    workers = [report[pid] for pid in worker_pids if pid in report]
+    if workers:
+        total = sum(m["pss_mb"] for m in report.values())
+        print(
+            f"  workers={len(workers)} "
+            f"uss/worker={sum(m['uss_mb'] for m in workers) / len(workers):.0f} MB "
+            f"total pss={total:.0f} MB"
+        )
+
+
+def preload():
+    """Загрузка репозитория в родителе; воркеры получат его через fork"""
+    # Без сборок мусора во время загрузки: объекты не перемещаются по поколениям
+    gc.disable()
+    from . import main
+
+    t0 = time.perf_counter()
+    main.preloaded_repository = main.RecommenderRepository(
+        main.model_path,
+        main.props_path,
+        main.als_assets_path,
+        main.top_rated_path,
+        n_shards=main.user_shards,
+        shard_id=main.user_shard_id,
+        max_overlay_users=main.als_live_max_users,
+    )
+    print(f"Repository preloaded in {time.perf_counter() - t0:.1f}s")
+
+    # Всё загруженное — в постоянное поколение: сборщик в воркерах его не обходит
+    gc.collect()
+    gc.freeze()
+    return main
+
+
+# Номер «воркера» роутера в таблице процессов
+ROUTER_ID = -1
+
+
+def listen(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve_worker(main, sock: socket.socket, worker_id: int, n_workers: int) -> None:
+    gc.enable()
+    # Журнал событий у каждого воркера свой
+    if main.event_log_dir:
+        main.event_log_dir = os.path.join(main.event_log_dir, f"worker-{worker_id}")
+    if n_workers > 1:
+        # Воркер — шард пользователей: к нему роутер направляет только его пользователей
+        main.user_shards, main.user_shard_id = n_workers, worker_id
+    config = uvicorn.Config(main.app, log_level="info")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve_router(sock: socket.socket, shard_urls: List[str]) -> None:
+    gc.enable()
+    from . import router
+
+    router.shard_urls = shard_urls
+    config = uvicorn.Config(router.app, log_level="info")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn(target, *args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            target(*args)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def run(host: str, port: int, workers: int, report_sec: float, base_port: int) -> None:
+    main = preload()
+    if workers > 1 and main.user_shards > 1:
+        sys.exit("USER_SHARDS > 1 is set: run one worker per shard behind service.router")
+
+    sock = listen(host, port)
+    if workers > 1:
+        # Воркеры на локальных портах, публичный порт — у роутера
+        worker_socks = [listen("127.0.0.1", base_port + i) for i in range(workers)]
+        shard_urls = [f"http://127.0.0.1:{base_port + i}" for i in range(workers)]
+    else:
+        worker_socks, shard_urls = [sock], []
+
+    def start(worker_id: int) -> int:
+        if worker_id == ROUTER_ID:
+            return spawn(serve_router, sock, shard_urls)
+        return spawn(serve_worker, main, worker_socks[worker_id], worker_id, workers)
+
+    worker_ids = {start(i): i for i in range(workers)}
+    if shard_urls:
+        worker_ids[start(ROUTER_ID)] = ROUTER_ID
+    print(
+        f"Started {workers} workers on {host}:{port}"
+        + (f" behind router (shards {shard_urls})" if shard_urls else "")
+        + f": {list(worker_ids)}"
+    )
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in worker_ids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    last_report = time.monotonic()
+    while worker_ids:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            worker_id = worker_ids.pop(pid)
+            if not stopping:
+                # Упавший воркер перезапускается от того же предзагруженного образа
+                print(f"Worker {pid} exited with status {status}, restarting")
+                worker_ids[start(worker_id)] = worker_id
+            continue
+        if report_sec > 0 and time.monotonic() - last_report >= report_sec:
+            last_report = time.monotonic()
+            print("Memory report:")
+            print_memory_report(os.getpid(), list(worker_ids))
+        time.sleep(0.5)
+    sock.close()
+    for worker_sock in worker_socks:
+        worker_sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preload-and-fork запуск сервиса")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("MAIN_APP_PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--base-port", type=int, default=8101, help="порты воркеров-шардов при --workers > 1"
+    )
+    parser.add_argument(
+        "--report-sec", type=float, default=60.0, help="период отчёта о памяти воркеров"
+    )
+    args = parser.parse_args()
+    if not hasattr(os, "fork"):
+        sys.exit("preload-and-fork requires os.fork")
+    run(args.host, args.port, args.workers, args.report_sec, args.base_port)
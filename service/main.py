@@ -1,9 +1,20 @@
 import logging
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from .events_store import EventStore
 from .recommendations_service import RecommendationService
+from .recommender_repository import RecommenderRepository
+from .pre_ranker import parse_weights
+from .schemas import JSON_ENCODER, RankedItems, RecommendationsResponse, encode_recommendations
+from .event_batch import parse_events_payload, validate_events, group_by_user
+from .event_log import EventLog
+from .shadow import parse_model_paths
+from .category_index import parse_quotas
+from .precompute import SpeculativePrecomputer
+from .memory_report import memory_report
 from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
 import os
+import time
 
 
 logger = logging.getLogger("uvicorn.error")
@@ -16,6 +27,33 @@ last_k = int(os.getenv("LAST_K",5))
 n_als = int(os.getenv("N_ALS",20))
 n_sim = int(os.getenv("N_SIM",10))
 topn = int(os.getenv("TOPN",10))
+cold_start_refresh_sec = float(os.getenv("COLD_START_REFRESH_SEC",0))
+cold_start_live_share = float(os.getenv("COLD_START_LIVE_SHARE",0.5))
+latency_budget_ms = float(os.getenv("LATENCY_BUDGET_MS",0))
+cascade_top_m = int(os.getenv("CASCADE_TOP_M",0))
+cascade_weights = parse_weights(os.getenv("CASCADE_WEIGHTS",""))
+als_update_sec = float(os.getenv("ALS_UPDATE_SEC",0))
+als_delta_dir = os.getenv("ALS_DELTA_DIR","ALS_delta")
+als_delta_poll_sec = float(os.getenv("ALS_DELTA_POLL_SEC",0))
+als_delta_retention_sec = float(os.getenv("ALS_DELTA_RETENTION_SEC",3600))
+als_live_max_users = int(os.getenv("ALS_LIVE_MAX_USERS",100000))
+event_log_dir = os.getenv("EVENT_LOG_DIR","")
+event_log_fsync_sec = float(os.getenv("EVENT_LOG_FSYNC_SEC",1.0))
+event_log_segment_mb = float(os.getenv("EVENT_LOG_SEGMENT_MB",64))
+event_log_max_segments = int(os.getenv("EVENT_LOG_MAX_SEGMENTS",8))
+shadow_model_paths = parse_model_paths(os.getenv("SHADOW_MODEL_PATHS",""))
+shadow_sample_rate = float(os.getenv("SHADOW_SAMPLE_RATE",0.1))
+filter_unavailable = bool(int(os.getenv("FILTER_UNAVAILABLE",1)))
+exclude_events = [e for e in os.getenv("EXCLUDE_EVENTS","transaction").split(",") if e]
+category_quotas = parse_quotas(os.getenv("CATEGORY_QUOTAS",""))
+precompute_debounce_ms = float(os.getenv("PRECOMPUTE_DEBOUNCE_MS",0))
+precompute_ttl_sec = float(os.getenv("PRECOMPUTE_TTL_SEC",30))
+precompute_idle_wait_ms = float(os.getenv("PRECOMPUTE_IDLE_WAIT_MS",100))
+user_shards = int(os.getenv("USER_SHARDS",1))
+user_shard_id = int(os.getenv("USER_SHARD_ID",0))
+
+# Репозиторий, загруженный до fork (service.launcher); иначе каждый воркер грузит свой
+preloaded_repository: Optional[RecommenderRepository] = None
 
 
 @asynccontextmanager
@@ -31,16 +69,68 @@ async def lifespan(app: FastAPI):
         last_k = last_k,
         n_als = n_als,
         n_sim = n_sim,
-        topn = topn
+        topn = topn,
+        cold_start_refresh_sec = cold_start_refresh_sec,
+        cold_start_live_share = cold_start_live_share,
+        latency_budget_ms = latency_budget_ms,
+        cascade_top_m = cascade_top_m,
+        cascade_weights = cascade_weights,
+        als_update_sec = als_update_sec,
+        als_delta_dir = als_delta_dir,
+        als_delta_poll_sec = als_delta_poll_sec,
+        als_delta_retention_sec = als_delta_retention_sec,
+        als_live_max_users = als_live_max_users,
+        shadow_model_paths = shadow_model_paths,
+        shadow_sample_rate = shadow_sample_rate,
+        recommender_repository = preloaded_repository,
+        filter_unavailable = filter_unavailable,
+        exclude_events = exclude_events,
+        category_quotas = category_quotas,
+        user_shards = user_shards,
+        user_shard_id = user_shard_id,
     )
 
     # Сохраняем экземпляр в app.state для использования в endpoint'ах
     app.state.recommendation_service = recommendation_service
 
+    # Журнал событий: восстановление последних событий и фоновая запись
+    app.state.event_log = None
+    if event_log_dir:
+        event_log = EventLog(
+            event_log_dir,
+            fsync_sec = event_log_fsync_sec,
+            segment_max_bytes = int(event_log_segment_mb * 2**20),
+            max_segments = event_log_max_segments,
+            events_per_user = events_store.max_events_per_user + 1,
+        )
+        logger.info(f"Event log replayed: {event_log.replay(events_store)}")
+        event_log.start()
+        app.state.event_log = event_log
+
+    # Спекулятивный пересчёт выдачи после событий (0 — выключен)
+    app.state.precomputer = None
+    if precompute_debounce_ms > 0:
+        app.state.precomputer = SpeculativePrecomputer(
+            lambda userid: recommend(userid, background=True),
+            debounce_ms = precompute_debounce_ms,
+            ttl_sec = precompute_ttl_sec,
+            wait_idle = recommendation_service.latency_controller.wait_idle,
+            idle_wait_ms = precompute_idle_wait_ms,
+        )
+
+    logger.info(f"Response encoder: {JSON_ENCODER}")
     logger.info("Recommendation service is ready!")
     # код ниже выполнится только один раз при остановке сервиса
     yield
 
+    if app.state.precomputer is not None:
+        app.state.precomputer.stop()
+    if recommendation_service.als_updater is not None:
+        recommendation_service.als_updater.stop()
+    recommendation_service.cold_start.stop()
+    if app.state.event_log is not None:
+        app.state.event_log.stop()
+
 
 # Создаем FastAPI приложение
 app = FastAPI(lifespan=lifespan)
@@ -52,30 +142,114 @@ events_store = EventStore()
 @app.get("/health")
 async def health_check():
     """Проверка здоровья сервиса"""
-    return {"status": "healthy"}
+    # Шард пользователей: роутер сверяет его со своей конфигурацией
+    return {"status": "healthy", "shard": user_shard_id, "shards": user_shards}
 
 
-@app.post("/recommendations")
-async def get_online_recommendations(userid: str, k: int = 10):
+def recommend(
+    userid: str,
+    root_category: Optional[int] = None,
+    budget_ms: Optional[float] = None,
+    background: bool = False,
+) -> Tuple[RankedItems, Dict]:
+    """Выдача по последним событиям пользователя и статистика запроса"""
+    # Получаем последние события пользователя
+    events = events_store.get(userid, k=10)
+
+    # Получаем рекомендации на основе последнего трека
+    recommendation_service = app.state.recommendation_service
+    stats = {}
+    ranked = recommendation_service.get_recommedations(
+        userid=userid,
+        recent_items=events,
+        root_category=root_category,
+        budget_ms=budget_ms,
+        stats=stats,
+        exclude_items=events_store.get_items_by_event(
+            userid, recommendation_service.exclude_events
+        ),
+        background=background,
+    )
+    return ranked, stats
+
+
+@app.post("/recommendations", response_model=RecommendationsResponse)
+def get_online_recommendations(
+    userid: str,
+    k: int = 10,
+    root_category: Optional[int] = None,
+    budget_ms: Optional[float] = None,
+):
     """
-    Получает онлайн рекомендации на основе последних событий пользователя
+    Получает онлайн рекомендации на основе последних событий пользователя.
+    Синхронный обработчик выполняется в пуле потоков: запросы идут параллельно,
+    и контроллер задержки видит реальную очередь.
     """
     try:
-        # Получаем последние события пользователя
-        events = events_store.get(userid, k=10)
+        # Готовая выдача из спекулятивного пересчёта (только для запроса по умолчанию)
+        cached = None
+        precomputer = app.state.precomputer
+        if precomputer is not None and root_category is None and budget_ms is None:
+            cached = precomputer.get(userid)
 
-        # Получаем рекомендации на основе последнего трека
-        recommendation_service = app.state.recommendation_service
-        result = recommendation_service.get_recommedations(
-            userid=userid, recent_items=events, with_score=True
-        )
-        return result
+        if cached is not None:
+            ranked, stats = cached
+        else:
+            ranked, stats = recommend(userid, root_category, budget_ms)
+
+        # Готовые байты вместо jsonable_encoder
+        t0 = time.perf_counter()
+        body = encode_recommendations(userid, ranked)
+        # Замеры стадий — только если выдача считалась в этом запросе
+        timings = {} if cached is not None else dict(stats.get("timings", {}))
+        timings["serialize_ms"] = (time.perf_counter() - t0) * 1000
+
+        # Фактический размер пула кандидатов и разбивка задержки по стадиям
+        headers = {
+            "X-Candidate-Pool-Size": str(stats.get("pool_size", 0)),
+            "X-Precomputed": "1" if cached is not None else "0",
+            "Server-Timing": ", ".join(
+                f"{name.removesuffix('_ms')};dur={value:.3f}"
+                for name, value in timings.items()
+            ),
+        }
+        return Response(content=body, media_type="application/json", headers=headers)
 
     except Exception as e:
         logger.error(f"Error getting online recommendations: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/models/stats")
+async def get_models_stats():
+    """
+    Задержка предсказания основной и теневых моделей, согласие теневых выдач с основной
+    """
+    return app.state.recommendation_service.recommender.model_summary()
+
+
+@app.get("/precompute/stats")
+async def get_precompute_stats():
+    """
+    Счётчики спекулятивного пересчёта: попадания, схлопнутые и лишние пересчёты
+    """
+    if app.state.precomputer is None:
+        return {"enabled": False}
+    return {"enabled": True, **app.state.precomputer.summary()}
+
+
+@app.get("/debug/memory")
+async def get_memory_report(sample: int = 100):
+    """
+    Оценка памяти по загруженным данным и хранилищу событий (по выборке элементов)
+    """
+    try:
+        return memory_report(app.state.recommendation_service, events_store, sample)
+    except Exception as e:
+        logger.error(f"Error building memory report: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/events")
 async def add_event(userid: str, itemid: str, event: str):
     """
@@ -83,12 +257,57 @@ async def add_event(userid: str, itemid: str, event: str):
     """
     try:
         events_store.put(userid, itemid, event)
+        if app.state.event_log is not None:
+            app.state.event_log.append(userid, itemid, event)
+        app.state.recommendation_service.on_event(userid, itemid, event)
+        if app.state.precomputer is not None:
+            app.state.precomputer.schedule(userid)
         return {"status": "ok"}
     except Exception as e:
         logger.error(f"Error adding event: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/events/batch")
+async def add_events_batch(request: Request):
+    """
+    Добавляет пакет событий: JSON-массив или NDJSON с полями userid, itemid, event.
+    Невалидные строки пропускаются, в ответе — агрегированный статус.
+    """
+    try:
+        records = parse_events_payload(
+            await request.body(), request.headers.get("content-type", "")
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid payload: {e}")
+
+    try:
+        userids, itemids, events, valid, errors = validate_events(records)
+        by_user = group_by_user(userids[valid], itemids[valid], events[valid])
+
+        # Один проход по каждому пользователю
+        recommendation_service = app.state.recommendation_service
+        for userid, user_events in by_user.items():
+            events_store.put_many(userid, user_events)
+            if app.state.event_log is not None:
+                app.state.event_log.append_many(userid, user_events)
+            recommendation_service.on_events(userid, user_events)
+            if app.state.precomputer is not None:
+                app.state.precomputer.schedule(userid)
+
+        return {
+            "status": "ok",
+            "received": len(records),
+            "accepted": int(valid.sum()),
+            "rejected": int(len(records) - valid.sum()),
+            "users": len(by_user),
+            "errors": errors,
+        }
+    except Exception as e:
+        logger.error(f"Error adding events batch: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/events/{userid}")
 async def get_user_events(userid: str, k: int = 10):
     """
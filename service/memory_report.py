@@ -0,0 +1,155 @@
+import math
+import os
+import random
+import sys
+from collections import deque
+from itertools import islice
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+import psutil
+
+from .id_space import CSRLists, IdMap, ItemBitset
+
+
+def sample_iter(values: Iterable, k: int) -> List:
+    """
+    Равномерная выборка k элементов за один проход без копии контейнера
+    (reservoir sampling, алгоритм L: пропуски идут через islice)
+    """
+    it = iter(values)
+    picked = list(islice(it, k))
+    if len(picked) < k:
+        return picked
+    w = math.exp(math.log(random.random()) / k)
+    while True:
+        skip = int(math.log(random.random()) / math.log(1 - w))
+        rest = list(islice(it, skip, skip + 1))
+        if not rest:
+            return picked
+        picked[random.randrange(k)] = rest[0]
+        w *= math.exp(math.log(random.random()) / k)
+
+
+def _array_sizeof(arr: np.ndarray, _seen: Dict[int, object]) -> int:
+    """Заголовок массива и его данные; общий буфер видов считается один раз"""
+    if arr.base is None:
+        return sys.getsizeof(arr)
+    # Вид (срез, memmap): getsizeof даёт только заголовок, данные — у базового массива
+    root = arr
+    while isinstance(root.base, np.ndarray):
+        root = root.base
+    if root is arr:
+        return sys.getsizeof(arr) + arr.nbytes
+    if id(root) in _seen:
+        return sys.getsizeof(arr)
+    _seen[id(root)] = root
+    return sys.getsizeof(arr) + root.nbytes
+
+
+def deep_sizeof(obj, sample: int = 100, _seen: Optional[Dict[int, object]] = None) -> int:
+    """
+    Оценка полного размера объекта (байт). Для контейнеров больше sample
+    элементов считается выборка и экстраполируется на весь контейнер.
+    """
+    if _seen is None:
+        _seen = {}
+    if id(obj) in _seen:
+        return 0
+    # Ссылка держит объект живым: его id не достанется другому объекту
+    _seen[id(obj)] = obj
+
+    if isinstance(obj, np.ndarray):
+        return _array_sizeof(obj, _seen)
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, (IdMap, CSRLists, ItemBitset)):
+        return sys.getsizeof(obj) + deep_sizeof(vars(obj), sample, _seen)
+
+    size = sys.getsizeof(obj)
+    if not isinstance(obj, (dict, list, tuple, set, frozenset, deque)) or not len(obj):
+        return size
+
+    # Ключи и значения словаря — по отдельности, без временных пар (k, v)
+    picked = sample_iter(obj.keys() if isinstance(obj, dict) else obj, sample)
+    picked_size = sum(deep_sizeof(x, sample, _seen) for x in picked)
+    if isinstance(obj, dict):
+        picked_size += sum(deep_sizeof(obj.get(k), sample, _seen) for k in picked)
+    return size + int(picked_size * len(obj) / len(picked))
+
+
+def _entry(obj, count: int, nbytes: int, **extra) -> Dict:
+    return {
+        "type": type(obj).__name__,
+        "count": count,
+        "mb": nbytes / 2**20,
+        "bytes_per_entry": nbytes / count if count else 0.0,
+        **extra,
+    }
+
+
+def memory_report(service, events_store, sample: int = 100) -> Dict:
+    """Оценка памяти по атрибутам репозитория, хранилищу событий и процессу"""
+    repository = service.recommender_repository
+    report = {}
+
+    for name, value in vars(repository).items():
+        if name == "_model" or value is None or isinstance(value, (str, os.PathLike)):
+            continue
+        if isinstance(value, IdMap):
+            count = len(value)
+        elif isinstance(value, CSRLists):
+            count = len(value.items)
+        elif isinstance(value, ItemBitset):
+            count = value.n
+        elif hasattr(value, "__len__"):
+            count = len(value)
+        else:
+            count = 1
+        report[name] = _entry(value, count, deep_sizeof(value, sample))
+
+    # Модель CatBoost: размер файла как оценка размера в памяти
+    model_path = repository.model_path
+    model_bytes = os.path.getsize(model_path) if os.path.exists(model_path) else 0
+    report["model"] = _entry(
+        repository.model,
+        repository.model.tree_count_ or 0,
+        model_bytes,
+        estimate="file size",
+    )
+
+    category_index = service.feature_generator.category_index
+    if category_index is not None:
+        report["category_index"] = _entry(
+            category_index, len(category_index.lists), category_index.nbytes
+        )
+
+    # Хранилище событий: число событий оценивается по выборке пользователей
+    events = events_store.events
+    picked = sample_iter(events.values(), sample)
+    events_per_user = sum(len(v) for v in picked) / len(picked) if picked else 0.0
+    report["events_store"] = _entry(
+        events,
+        len(events),
+        deep_sizeof(events, sample),
+        events_est=int(events_per_user * len(events)),
+    )
+
+    process = psutil.Process()
+    try:
+        info = process.memory_full_info()
+    except psutil.AccessDenied:
+        info = process.memory_info()
+    accounted = sum(entry["mb"] for entry in report.values())
+    return {
+        "process": {
+            "rss_mb": info.rss / 2**20,
+            "uss_mb": getattr(info, "uss", 0) / 2**20,
+            "accounted_mb": accounted,
+        },
+        "sample": sample,
+        "objects": report,
+    }
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional
+
+
+DEFAULT_WEIGHTS = {"als_score": 1.0, "sim_max": 1.0, "item_pop_w": 0.2}
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """Разбор весов из строки вида "als_score:1.0,sim_max:1.0,item_pop_w:0.2" """
+    if not value:
+        return dict(DEFAULT_WEIGHTS)
+    weights = {}
+    for part in value.split(","):
+        name, _, weight = part.partition(":")
+        if name.strip():
+            weights[name.strip()] = float(weight or 1.0)
+    return weights
+
+
+class PreRanker:
+    """Дешёвый линейный пре-ранкер (score fusion) перед CatBoost"""
+
+    def __init__(
+        self,
+        weights: Optional[Dict[str, float]] = None,
+        item_popularity: Optional[pd.Series] = None,
+    ):
+        """
+        Args:
+            weights: веса признаков в линейной свёртке
+            item_popularity: популярность товаров (индекс — те же id, что в X["itemid"])
+        """
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        self.item_popularity = item_popularity
+
+    def score(self, X: pd.DataFrame) -> np.ndarray:
+        """Векторный скор: сумма признаков, нормированных на максимум в группе"""
+        scores = np.zeros(len(X), dtype=np.float64)
+        groups = X["group_id"] if "group_id" in X.columns else None
+
+        for name, weight in self.weights.items():
+            values = self._feature(X, name)
+            if values is None or not weight:
+                continue
+            if groups is not None:
+                norm = values.groupby(groups.values).transform("max").to_numpy()
+            else:
+                norm = np.full(len(values), values.max())
+            values = values.to_numpy(dtype=np.float64)
+            scores += weight * np.divide(
+                values, norm, out=np.zeros_like(values), where=norm > 0
+            )
+        return scores
+
+    def select(self, X: pd.DataFrame, top_m: int) -> pd.DataFrame:
+        """Оставляет top_m строк по скору пре-ранкера (для одной группы)"""
+        if top_m <= 0 or len(X) <= top_m:
+            return X
+        scores = self.score(X)
+        top = np.argpartition(-scores, top_m - 1)[:top_m]
+        return X.iloc[np.sort(top)].copy()
+
+    def _feature(self, X: pd.DataFrame, name: str) -> Optional[pd.Series]:
+        """Значения признака; популярность дополняется из внешнего словаря"""
+        values = None
+        if name in X.columns:
+            values = pd.to_numeric(X[name], errors="coerce").fillna(0.0)
+            values = values.reset_index(drop=True)
+
+        if name == "item_pop_w" and self.item_popularity is not None:
+            mapped = (
+                X["itemid"].map(self.item_popularity).fillna(0.0)
+            ).reset_index(drop=True)
+            values = mapped if values is None else np.maximum(values, mapped)
+
+        if values is None:
+            return None
+        # Популярность в логарифмической шкале
+        if name == "item_pop_w":
+            values = np.log1p(values.clip(lower=0))
+        return values
@@ -0,0 +1,183 @@
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+
+class SpeculativePrecomputer:
+    """
+    Спекулятивный пересчёт рекомендаций после событий пользователя.
+    /events откладывает пересчёт на debounce_ms (серия событий схлопывается
+    в один пересчёт), фоновый поток считает выдачу, пока нет запросов
+    в обработке, и следующий /recommendations отдаётся из готового результата,
+    если после пересчёта у пользователя не было новых событий.
+    """
+
+    def __init__(
+        self,
+        compute: Callable[[str], Tuple[object, Dict]],
+        debounce_ms: float = 50.0,
+        ttl_sec: float = 30.0,
+        max_pending: int = 10000,
+        wait_idle: Optional[Callable[[float], bool]] = None,
+        idle_wait_ms: float = 100.0,
+    ):
+        """
+        Args:
+            compute: userid -> (выдача, статистика запроса)
+            debounce_ms: задержка пересчёта после последнего события пользователя
+            ttl_sec: время жизни готового результата
+            max_pending: лимит ожидающих пересчёта пользователей (сверх — без пересчёта)
+            wait_idle: ожидание, пока нет запросов в обработке (timeout, с) -> дождались ли
+            idle_wait_ms: сколько пересчёт уступает запросам, прежде чем считать всё равно
+        """
+        self.compute = compute
+        self.debounce_sec = debounce_ms / 1000
+        self.ttl_sec = ttl_sec
+        self.max_pending = max_pending
+        self.wait_idle = wait_idle or (lambda timeout: True)
+        self.idle_wait_sec = idle_wait_ms / 1000
+
+        # Версия пользователя растёт с каждым событием
+        self._versions: Dict[str, int] = {}
+        # Ожидающие пересчёта: {userid: момент, после которого считать}
+        self._pending: Dict[str, float] = {}
+        # Готовые результаты: {userid: (версия, момент расчёта, выдача, статистика, отдан ли)}
+        self._results: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+
+        self.n_scheduled = 0
+        self.n_coalesced = 0
+        self.n_dropped = 0
+        self.n_computed = 0
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_stale = 0
+        self.n_cancelled = 0
+        self.n_wasted = 0
+        self.n_busy = 0
+        self.compute_ms = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="precompute", daemon=True)
+        self._thread.start()
+
+    def schedule(self, userid: str) -> None:
+        """Новое событие пользователя: текущий результат устаревает, пересчёт откладывается"""
+        with self._lock:
+            self._versions[userid] = self._versions.get(userid, 0) + 1
+            self.n_scheduled += 1
+            if userid in self._pending:
+                self.n_coalesced += 1
+            elif len(self._pending) >= self.max_pending:
+                self.n_dropped += 1
+                return
+            self._pending[userid] = time.monotonic() + self.debounce_sec
+        self._wakeup.set()
+
+    def get(self, userid: str) -> Optional[Tuple[object, Dict]]:
+        """Готовая выдача, если она посчитана по последним событиям пользователя"""
+        with self._lock:
+            entry = self._results.get(userid)
+            if entry is None:
+                self.n_misses += 1
+                self._cancel(userid)
+                return None
+            version, computed_at, ranked, stats, _ = entry
+            if (
+                version != self._versions.get(userid, 0)
+                or time.monotonic() - computed_at > self.ttl_sec
+            ):
+                self.n_stale += 1
+                self._cancel(userid)
+                return None
+            entry[4] = True
+            self.n_hits += 1
+            return ranked, stats
+
+    def _cancel(self, userid: str) -> None:
+        """Запрос считает выдачу сам: отложенный пересчёт по тем же событиям не нужен"""
+        if self._pending.pop(userid, None) is not None:
+            self.n_cancelled += 1
+
+    def _store(self, userid: str, version: int, ranked, stats: Dict) -> None:
+        with self._lock:
+            old = self._results.get(userid)
+            if old is not None and not old[4]:
+                self.n_wasted += 1
+            self._results[userid] = [version, time.monotonic(), ranked, stats, False]
+
+    def _next_due(self) -> Tuple[Optional[str], float]:
+        """Пользователь, чей пересчёт пора выполнить, или время ожидания"""
+        now = time.monotonic()
+        with self._lock:
+            if not self._pending:
+                return None, 1.0
+            userid, due = min(self._pending.items(), key=lambda kv: kv[1])
+            if due > now:
+                return None, due - now
+            del self._pending[userid]
+            return userid, 0.0
+
+    def _evict(self) -> None:
+        """Удаление просроченных результатов; неотданные считаются лишней работой"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                u for u, e in self._results.items() if now - e[1] > self.ttl_sec
+            ]
+            for userid in expired:
+                if not self._results.pop(userid)[4]:
+                    self.n_wasted += 1
+
+    def _run(self) -> None:
+        last_evict = time.monotonic()
+        while not self._stop.is_set():
+            userid, wait = self._next_due()
+            if userid is None:
+                self._wakeup.wait(wait)
+                self._wakeup.clear()
+                if time.monotonic() - last_evict > self.ttl_sec:
+                    self._evict()
+                    last_evict = time.monotonic()
+                continue
+            # Низкий приоритет: пересчёт ждёт окончания запросов в обработке,
+            # но не дольше idle_wait_sec, чтобы под постоянной нагрузкой не стоять
+            if not self.wait_idle(self.idle_wait_sec):
+                self.n_busy += 1
+            with self._lock:
+                version = self._versions.get(userid, 0)
+            try:
+                t0 = time.perf_counter()
+                ranked, stats = self.compute(userid)
+                self.compute_ms += (time.perf_counter() - t0) * 1000
+                self.n_computed += 1
+                self._store(userid, version, ranked, stats)
+            except Exception as e:
+                print(f"Precompute error for {userid}: {e}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join()
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            requests = self.n_hits + self.n_misses + self.n_stale
+            return {
+                "scheduled": self.n_scheduled,
+                "coalesced": self.n_coalesced,
+                "dropped": self.n_dropped,
+                "pending": len(self._pending),
+                "computed": self.n_computed,
+                "hits": self.n_hits,
+                "misses": self.n_misses,
+                "stale": self.n_stale,
+                "cancelled": self.n_cancelled,
+                "wasted": self.n_wasted,
+                "busy_timeouts": self.n_busy,
+                "hit_rate": self.n_hits / requests if requests else 0.0,
+                "wasted_share": self.n_wasted / self.n_computed if self.n_computed else 0.0,
+                "avg_compute_ms": self.compute_ms / self.n_computed if self.n_computed else 0.0,
+                "cached": len(self._results),
+            }
@@ -1,6 +1,17 @@
-from .recommender_repository import RecommenderRepository
+from .recommender_repository import RecommenderRepository, EVENT_WEIGHTS, ITEM_CAT_PROPS
 from .feature_generator import FeatureGenerator
 from .recommender import Recommender
+from .cold_start import ColdStartEngine, EVENT_ALIASES
+from .latency_controller import LatencyBudgetController
+from .pre_ranker import PreRanker
+from .shadow import ShadowScorer, load_models
+from .category_index import CategoryIndex
+from .als_updater import ALSDelta, ALSFoldInUpdater, list_new_deltas, load_als_delta
+from .schemas import RankedItems
+from contextlib import nullcontext
+from typing import Optional, Dict, List, Tuple
+import numpy as np
+import time
 
 
 class RecommendationService:
@@ -14,43 +25,269 @@ class RecommendationService:
         n_als: int = 20,
         n_sim: int = 10,
         topn: int = 10,
+        cold_start_refresh_sec: float = 0.0,
+        cold_start_live_share: float = 0.5,
+        latency_budget_ms: float = 0.0,
+        cascade_top_m: int = 0,
+        cascade_weights: Optional[Dict[str, float]] = None,
+        als_update_sec: float = 0.0,
+        als_delta_dir: Optional[str] = None,
+        als_delta_poll_sec: float = 0.0,
+        als_delta_retention_sec: float = 3600.0,
+        als_live_max_users: int = 100_000,
+        shadow_model_paths: Optional[Dict[str, str]] = None,
+        shadow_sample_rate: float = 0.1,
+        recommender_repository: Optional[RecommenderRepository] = None,
+        filter_unavailable: bool = False,
+        exclude_events: Optional[List[str]] = None,
+        category_quotas: Optional[Dict[str, int]] = None,
+        user_shards: int = 1,
+        user_shard_id: int = 0,
     ):
-        self.recommender_repository = RecommenderRepository(
-            model_path, props_path, als_assets_path, top_rated_path
+        """
+        Args:
+            recommender_repository: уже загруженный репозиторий (общий для
+                воркеров после fork); по умолчанию загружается по путям
+            filter_unavailable: отсеивать кандидатов с available=0
+            exclude_events: типы событий, товары из которых пользователю не рекомендуются
+            category_quotas: квоты кандидатов из категорий по уровням иерархии
+            user_shards: число шардов пользователей (service.router)
+            user_shard_id: номер шарда этого сервиса
+        """
+        self.recommender_repository = recommender_repository or RecommenderRepository(
+            model_path,
+            props_path,
+            als_assets_path,
+            top_rated_path,
+            n_shards=user_shards,
+            shard_id=user_shard_id,
+            max_overlay_users=als_live_max_users,
         )
 
+        category_index = (
+            self._build_category_index() if category_quotas else None
+        )
         self.feature_generator = FeatureGenerator(
-            self.recommender_repository, last_k, n_als, n_sim
+            self.recommender_repository,
+            last_k,
+            n_als,
+            n_sim,
+            filter_unavailable,
+            category_index,
+            category_quotas,
         )
+        exclude_events = set(exclude_events or ())
+        self.exclude_events = exclude_events | {
+            alias for alias, event in EVENT_ALIASES.items() if event in exclude_events
+        }
 
-        self.recommender = Recommender(self.recommender_repository.model)
+        pre_ranker = (
+            PreRanker(
+                cascade_weights, self.recommender_repository.get_item_popularity()
+            )
+            if cascade_top_m > 0
+            else None
+        )
+        # Теневые модели скорят тот же пул на доле трафика, вне пути запроса
+        shadow = (
+            ShadowScorer(
+                load_models(shadow_model_paths),
+                sample_rate=shadow_sample_rate,
+                topn=topn,
+            )
+            if shadow_model_paths
+            else None
+        )
+        self.recommender = Recommender(
+            self.recommender_repository.model,
+            pre_ranker,
+            cascade_top_m,
+            shadow=shadow,
+            model_name=model_path.rsplit("/", 1)[-1].removesuffix(".cbm"),
+        )
         self.topn = topn
 
-    def _cold_start(self) -> list:
-        return self.recommender_repository.top_ratings
+        item_ids, item_root_category = (
+            self.recommender_repository.get_item_root_categories()
+        )
+        self.cold_start = ColdStartEngine(
+            self.recommender_repository.top_by_event,
+            item_ids=item_ids,
+            item_root_category=item_root_category,
+            live_share=cold_start_live_share,
+            refresh_sec=cold_start_refresh_sec,
+        )
+        self.cold_start.start()
 
-    def _range_recommendations(
-        self, userid: str, recent_items: list[str], with_score: bool
-    ):
-        if with_score:
-            return self.recommender.recommend_with_scores(
-                features_data=self.feature_generator.build_features(
-                    userid, recent_items
-                ),
-                topn=self.topn,
+        self.latency_controller = LatencyBudgetController(
+            n_als=n_als, n_sim=n_sim, last_k=last_k, budget_ms=latency_budget_ms
+        )
+
+        # Инкрементальное обновление ALS по живым событиям
+        self.als_updater = (
+            ALSFoldInUpdater.from_assets(
+                als_assets_path,
+                EVENT_WEIGHTS,
+                shard=(user_shard_id, user_shards) if user_shards > 1 else None,
+                update_sec=als_update_sec,
+                delta_dir=als_delta_dir,
+                delta_retention_sec=als_delta_retention_sec,
+                max_live_users=als_live_max_users,
             )
-        else:
-            return self.recommender.recommend(
-                features_data=self.feature_generator.build_features(
-                    userid, recent_items
-                ),
-                topn=self.topn,
+            if als_update_sec > 0
+            else None
+        )
+        if self.als_updater is not None:
+            self.als_updater.start(self._apply_als_delta)
+        self.als_delta_dir = als_delta_dir
+        self.als_delta_poll_sec = als_delta_poll_sec
+        self._last_delta = ""
+        self._last_delta_poll = 0.0
+
+    def _build_category_index(self) -> Optional[CategoryIndex]:
+        """Индекс категория -> товары по популярности; без популярности — не строится"""
+        repository = self.recommender_repository
+        if repository.item_pop is None:
+            print(
+                "  WARNING: category index disabled: item popularity is missing, "
+                "CATEGORY_QUOTAS are ignored"
+            )
+            return None
+        category_index = CategoryIndex(
+            repository.item_cat, ITEM_CAT_PROPS, repository.item_pop
+        )
+        print(
+            f"  Category index: {len(category_index.lists)} levels, "
+            f"{category_index.nbytes / 2**20:.1f} MB"
+        )
+        return category_index
+
+    def on_event(self, userid: str, itemid: str, event: str) -> None:
+        """Обработка нового события пользователя"""
+        if self.cold_start.refresh_sec > 0:
+            self.cold_start.observe(itemid, event)
+        if self.als_updater is not None:
+            self.als_updater.observe(userid, itemid, event)
+
+    def on_events(self, userid: str, events: List[Tuple[str, str]]) -> None:
+        """Пакет событий одного пользователя (itemid, event) в хронологическом порядке"""
+        for itemid, event in events:
+            self.on_event(userid, itemid, event)
+
+    def _apply_als_delta(self, delta: ALSDelta) -> None:
+        """Применение дельты фонового fold-in в этом процессе"""
+        self.recommender_repository.merge_als_delta(*delta)
+
+    def _poll_als_deltas(self) -> None:
+        """Подхват дельт, опубликованных другими процессами, без полной перезагрузки"""
+        now = time.monotonic()
+        if now - self._last_delta_poll < self.als_delta_poll_sec:
+            return
+        self._last_delta_poll = now
+        for path in list_new_deltas(self.als_delta_dir, self._last_delta):
+            self.recommender_repository.merge_als_delta(*load_als_delta(path))
+            self._last_delta = path.name
+
+    def _cold_start(self, root_category: Optional[int] = None) -> RankedItems:
+        items, scores = self.cold_start.recommend_with_scores(self.topn, root_category)
+        return RankedItems(items, scores, "cold_start")
+
+    def to_internal(
+        self, userid: str, recent_items: List[str]
+    ) -> Tuple[Optional[int], np.ndarray]:
+        """
+        Внешние id запроса -> индексы int32. Неизвестным товарам выдаются
+        отрицательные коды (свои на каждый различный id), чтобы сессионные
+        признаки считались как по исходным id.
+        """
+        user_idx = self.recommender_repository.get_user_idx(userid)
+        recent_idx = self.recommender_repository.items.to_idx(recent_items)
+        unknown = np.flatnonzero(recent_idx < 0)
+        if len(unknown):
+            _, codes = np.unique(
+                np.asarray(recent_items, dtype=object)[unknown].astype(str),
+                return_inverse=True,
             )
+            recent_idx[unknown] = -1 - codes
+        return user_idx, recent_idx
+
+    def _range_recommendations(
+        self,
+        user_idx: Optional[int],
+        recent_items: np.ndarray,
+        budget_ms: Optional[float] = None,
+        stats: Optional[Dict] = None,
+        exclude_items: Optional[np.ndarray] = None,
+        background: bool = False,
+    ) -> RankedItems:
+        controller = self.latency_controller
+        n_als, n_sim, last_k = (
+            (controller.n_als, controller.n_sim, controller.last_k)
+            if background
+            else controller.plan(budget_ms)
+        )
+        timings = {}
+        features_data = self.feature_generator.build_features(
+            user_idx,
+            recent_items,
+            n_als=n_als,
+            n_sim=n_sim,
+            last_k=last_k,
+            timings=timings,
+            exclude_items=exclude_items,
+        )
+
+        t0 = time.perf_counter()
+        items, scores = self.recommender.recommend_with_scores(
+            features_data=features_data,
+            topn=self.topn,
+        )
+        timings["ranking_ms"] = (time.perf_counter() - t0) * 1000
+
+        pool_size = len(features_data[1])
+        if not background:
+            controller.record(timings, pool_size)
+        if stats is not None:
+            stats["pool_size"] = pool_size
+            stats["timings"] = timings
+
+        # Обратно во внешние itemid — только на выходе из сервиса
+        return RankedItems(
+            self.recommender_repository.items.to_external(items), scores, "ranker"
+        )
 
     def get_recommedations(
-        self, userid: str, recent_items: list[str], with_score: bool
-    ):
-        if not self.recommender_repository.get_user_idx(userid) and not recent_items:
-            return self._cold_start()
-        else:
-            return self._range_recommendations(userid, recent_items, with_score)
+        self,
+        userid: str,
+        recent_items: list[str],
+        root_category: Optional[int] = None,
+        budget_ms: Optional[float] = None,
+        stats: Optional[Dict] = None,
+        exclude_items: Optional[List[str]] = None,
+        background: bool = False,
+    ) -> RankedItems:
+        """
+        Args:
+            budget_ms: бюджет задержки запроса (адаптивный размер пула)
+            stats: словарь для статистики запроса (размер пула, замеры стадий)
+            exclude_items: внешние itemid, исключаемые из выдачи (например, купленные)
+            background: фоновый расчёт (спекулятивный пересчёт): базовый пул,
+                без учёта в очереди и замерах контроллера задержки
+        """
+        if self.als_delta_dir and self.als_delta_poll_sec > 0:
+            self._poll_als_deltas()
+
+        with nullcontext() if background else self.latency_controller.track():
+            user_idx, recent_idx = self.to_internal(userid, recent_items)
+            if user_idx is None and not len(recent_idx):
+                if stats is not None:
+                    stats["pool_size"] = 0
+                return self._cold_start(root_category)
+            else:
+                exclude_idx = None
+                if exclude_items:
+                    exclude_idx = self.recommender_repository.items.to_idx(exclude_items)
+                    exclude_idx = exclude_idx[exclude_idx >= 0]
+                return self._range_recommendations(
+                    user_idx, recent_idx, budget_ms, stats, exclude_idx, background
+                )
@@ -1,37 +1,48 @@
 from catboost import CatBoostRanker, Pool
+import numpy as np
 import pandas as pd
-from typing import List, Tuple
+from typing import Tuple, Optional
+import time
+from .pre_ranker import PreRanker
+from .recommender_repository import ITEM_CAT_PROPS
+from .shadow import ModelStats, ShadowScorer
 
 
 class Recommender:
     """Класс для генерации ранжированных рекомендаций"""
 
-    def __init__(self, model: CatBoostRanker):
+    def __init__(
+        self,
+        model: CatBoostRanker,
+        pre_ranker: Optional[PreRanker] = None,
+        cascade_top_m: int = 0,
+        shadow: Optional[ShadowScorer] = None,
+        model_name: str = "primary",
+    ):
+        """
+        Args:
+            model: модель CatBoost для финального ранжирования
+            pre_ranker: дешёвый пре-ранкер для каскада
+            cascade_top_m: сколько кандидатов пропускать в CatBoost (0 — без каскада)
+            shadow: теневой скоринг другими моделями на том же пуле
+            model_name: имя основной модели в статистике
+        """
         self.model = model
+        self.pre_ranker = pre_ranker
+        self.cascade_top_m = cascade_top_m
+        self.shadow = shadow
+        self.model_name = model_name
+        self.model_stats = ModelStats()
         self.features = model.feature_names_
-        self.cat_features = [
-            c
-            for c in [
-                "available",
-                "categoryid",
-                "root_category",
-                "level_0",
-                "level_1",
-                "level_2",
-                "level_3",
-                "level_4",
-                "level_5",
-            ]
-            if c in self.features
-        ]
+        self.cat_features = [c for c in ITEM_CAT_PROPS if c in self.features]
 
     def _predict(
-        self, features_data: Tuple[pd.DataFrame, List[str]], topn: int = 10
+        self, features_data: Tuple[pd.DataFrame, np.ndarray], topn: int = 10
     ) -> pd.DataFrame:
         """Returns DataFrame with top N predictions"""
         X, candidate_ids = features_data
 
-        if X.empty or not candidate_ids:
+        if X.empty or not len(candidate_ids):
             print("No candidates to rank")
             return pd.DataFrame()
 
@@ -40,30 +51,54 @@ class Recommender:
             print("No valid features found")
             return X.head(topn)
 
+        # Каскад: пре-ранкер отсекает пул до top M перед CatBoost
+        if self.pre_ranker is not None and self.cascade_top_m > 0:
+            X = self.pre_ranker.select(X, self.cascade_top_m)
+
         try:
             test_pool = Pool(
                 X[used_features],
                 group_id=X["group_id"],
                 cat_features=[c for c in used_features if c in self.cat_features],
             )
+            t0 = time.perf_counter()
             predictions = self.model.predict(test_pool)
+            self.model_stats.record((time.perf_counter() - t0) * 1000, len(X))
             X["prediction"] = predictions
+
+            # Теневые модели получают тот же пул уже после ответа основной
+            if self.shadow is not None and self.shadow.sample():
+                self.shadow.submit(X.drop(columns="prediction"), predictions)
             return X.nlargest(topn, "prediction")
 
         except Exception as e:
             print(f"Prediction error: {e}")
             return X.head(topn)
 
+    def model_summary(self) -> dict:
+        """Задержка основной модели и статистика теневых моделей"""
+        summary = {"serving": {self.model_name: self.model_stats.summary()}}
+        if self.shadow is not None:
+            summary["shadow"] = self.shadow.summary()
+        return summary
+
     def recommend(
-        self, features_data: Tuple[pd.DataFrame, List[str]], topn: int = 10
-    ) -> List[str]:
+        self, features_data: Tuple[pd.DataFrame, np.ndarray], topn: int = 10
+    ) -> np.ndarray:
+        """Индексы товаров top N"""
         data = self._predict(features_data, topn)
-        return data["itemid"].tolist() if not data.empty else []
+        if data.empty:
+            return np.empty(0, dtype=np.int32)
+        return data["itemid"].to_numpy(dtype=np.int32)
 
     def recommend_with_scores(
-        self, features_data: Tuple[pd.DataFrame, List[str]], topn: int = 10
-    ) -> List[Tuple[str, float]]:
+        self, features_data: Tuple[pd.DataFrame, np.ndarray], topn: int = 10
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Индексы товаров top N и их скоры"""
         data = self._predict(features_data, topn)
         if data.empty or "prediction" not in data.columns:
-            return []
-        return list(zip(data["itemid"], data["prediction"]))
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+        return (
+            data["itemid"].to_numpy(dtype=np.int32),
+            data["prediction"].to_numpy(dtype=np.float64),
+        )
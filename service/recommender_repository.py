@@ -1,9 +1,38 @@
 from catboost import CatBoostRanker
-import json
+import numpy as np
 import pandas as pd
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple
+from collections import OrderedDict
 from pathlib import Path
-from random import choices
+from .id_space import (
+    IdMap,
+    CSRLists,
+    ItemBitset,
+    EMPTY_IDX,
+    EMPTY_SCORES,
+    load_als_pairs,
+    build_als_index,
+    load_item_popularity,
+    user_shard,
+    user_shards,
+)
+
+
+EVENT_WEIGHTS = {"transaction": 5.0, "addtocart": 3.0, "view": 1.0}
+
+# Свойства товаров, которые идут в признаки ранжирования
+ITEM_CAT_PROPS = [
+    "available",
+    "categoryid",
+    "root_category",
+    "level_0",
+    "level_1",
+    "level_2",
+    "level_3",
+    "level_4",
+    "level_5",
+]
+ITEM_NUM_PROPS = ["value_count", "value_mean", "value_std", "value_min", "value_max"]
 
 
 class RecommenderRepository:
@@ -15,33 +44,52 @@ class RecommenderRepository:
         props_path: str = "range_features/item_props_last.parquet",
         als_assets_path: str = "ALS_assets",
         top_rated_path: str = "features_assets",
+        n_shards: int = 1,
+        shard_id: int = 0,
+        max_overlay_users: int = 100_000,
     ):
         """
         Args:
             model_path: Путь к модели CatBoost
             props_path: Путь к файлу с характеристиками товаров
             als_assets_path: Путь к директории с ALS-артефактами
+            n_shards: число шардов пользователей (1 — все пользователи)
+            shard_id: номер шарда: загружаются ALS только его пользователей
+            max_overlay_users: лимит пользователей с ALS из дельт (давно не
+                обновлённые вытесняются вместе с добавленными для них id)
         """
+        if not 0 <= shard_id < n_shards:
+            raise ValueError(f"shard_id={shard_id} out of range for n_shards={n_shards}")
         self.model_path = model_path
         self.props_path = props_path
         self.als_assets_path = Path(als_assets_path)
         self.top_rated_path = Path(top_rated_path)
+        self.n_shards = n_shards
+        self.shard_id = shard_id
+        self.max_overlay_users = max_overlay_users
 
         # Модель
         self._model = None
 
-        # Свойства товаров
-        self.props: pd.DataFrame = None
+        # Пространства id: внешние visitorid/itemid <-> плотные индексы int32
+        self.users: IdMap = IdMap([])
+        self.items: IdMap = IdMap([])
 
-        # Маппинги
-        self.idx2user: Dict = {}
-        self.idx2item: Dict = {}
+        # Свойства товаров по индексу товара
+        self.item_cat: np.ndarray = np.empty((0, len(ITEM_CAT_PROPS)), dtype=np.int32)
+        self.item_num: np.ndarray = np.empty((0, len(ITEM_NUM_PROPS)), dtype=np.float32)
 
-        # ALS и похожие товары
-        self.als_user_lookup: Dict = {}
-        self.sim_index: Dict = {}
-        # Загрузка высоко оцененых товаров
-        self.top_ratings: list[int] = []
+        # ALS по индексу пользователя и похожие товары по индексу товара
+        self.als: CSRLists = None
+        self.sim: CSRLists = None
+        # Товары, недоступные по последнему значению available
+        self.unavailable: ItemBitset = ItemBitset(0)
+        # Обновления ALS из дельт: {индекс пользователя: (товары, скоры)}, порядок — LRU
+        self.als_overlay: "OrderedDict[int, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        # Топы товаров по типам событий: {событие: (itemid, счётчики)}
+        self.top_by_event: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        # Популярность товаров по индексу товара (None — нет артефакта)
+        self.item_pop: Optional[np.ndarray] = None
 
         # Загрузка всех данных
         self._load_all()
@@ -51,21 +99,21 @@ class RecommenderRepository:
         print("Loading model...")
         self._load_model()
 
+        print("Loading top_ratings...")
+        self._load_top_ratings()
+
         print("Loading item properties...")
-        self._load_props()
+        props = pd.read_parquet(self.props_path)
 
-        print("Loading mappings...")
-        self._load_mappings()
+        print("Loading ALS recommendations and similar items...")
+        self._load_als_index(props)
 
-        print("Loading ALS recommendations...")
-        self._load_als_recommendations()
+        self._load_props(props)
+        del props
 
-        print("Loading top_ratings...")
-        self._load_top_ratings()
-        print("Loading similar items...")
-        self._load_similar_items()
+        self._load_item_popularity()
 
-        print("Data loading completed!")
+        print(f"Data loading completed! Resident index size: {self.nbytes / 2**20:.1f} MB")
 
     def _load_model(self):
         """Загрузка модели"""
@@ -73,79 +121,154 @@ class RecommenderRepository:
         self._model.load_model(self.model_path)
         print(f"  Model loaded with {len(self._model.feature_names_)} features")
 
-    def _load_props(self):
-        """Загрузка свойств товаров"""
-        self.props = pd.read_parquet(self.props_path)
-        print(f"  Loaded properties for {len(self.props)} items")
-
-    def _load_mappings(self):
-        """Загрузка маппингов пользователей и товаров"""
-        with open(self.als_assets_path / "hash_visitoridx_train.json") as f:
-            self.idx2user = {
-                int(float(k)): int(float(v)) for k, v in json.load(f).items()
-            }
-
-        with open(self.als_assets_path / "hash_itemidx_train.json") as f:
-            self.idx2item = {
-                int(float(k)): int(float(v)) for k, v in json.load(f).items()
-            }
-
-        print(f"  Loaded {len(self.idx2user)} users and {len(self.idx2item)} items")
-
     def _load_top_ratings(self):
-        top_add = pd.read_parquet(self.top_rated_path / "top_100_addtocart.parquet")
-        top_view = pd.read_parquet(self.top_rated_path / "top_100_view.parquet")
-        top_transaction = pd.read_parquet(
-            self.top_rated_path / "top_100_transaction.parquet"
-        )
+        """Загрузка топов товаров по типам событий в виде ранжированных массивов"""
+        for event in ("addtocart", "transaction", "view"):
+            top = pd.read_parquet(self.top_rated_path / f"top_100_{event}.parquet")
+            count_col = [c for c in top.columns if c != "itemid"][0]
+            top = top.sort_values(count_col, ascending=False)
+            self.top_by_event[event] = (
+                top["itemid"].to_numpy(dtype=np.int64),
+                top[count_col].to_numpy(dtype=np.float64),
+            )
 
-        self.top_ratings = (
-            choices(top_add["itemid"].tolist(), k=6)
-            + choices(top_transaction["itemid"].tolist(), k=2)
-            + choices(top_view["itemid"].tolist(), k=2)
+        print(
+            "  Loaded TOP ratings: "
+            + ", ".join(f"{e}={len(v[0])}" for e, v in self.top_by_event.items())
         )
 
-        print(f"  Loaded TOP ratings with length {len(self.top_ratings)}")
+    def _load_als_index(self, props: pd.DataFrame):
+        """ALS-рекомендации и похожие товары в CSR-виде на индексах int32"""
+        shard = (self.shard_id, self.n_shards) if self.n_shards > 1 else None
+        pairs = load_als_pairs(self.als_assets_path, shard)
+        extra_items = [pd.to_numeric(props["itemid"], errors="coerce").dropna()]
+        extra_items += [items for items, _ in self.top_by_event.values()]
+        self.users, self.items, self.als, self.sim = build_als_index(
+            pairs, np.concatenate([np.asarray(x, dtype=np.int64) for x in extra_items])
+        )
+        del pairs
 
-    def _load_als_recommendations(self):
-        """Загрузка ALS рекомендаций"""
-        als_recs = pd.read_parquet(self.als_assets_path / "als_recommendations.parquet")
-        als_recs["visitorid"] = als_recs["visitoridx"].map(self.idx2user)
-        als_recs["itemid"] = als_recs["itemidx"].map(self.idx2item)
-        als_recs = als_recs.dropna(subset=["visitorid", "itemid"])
-        als_recs.rename(columns={"rating": "als_score"}, inplace=True)
+        print(
+            f"  Loaded ALS recommendations for {len(self.users)} users"
+            + (f" (shard {self.shard_id}/{self.n_shards})" if shard else "")
+            + f", similar items for {int((np.diff(self.sim.indptr) > 0).sum())} items, "
+            f"{len(self.items)} items in index"
+        )
 
-        self.als_user_lookup = {
-            uid: dict(zip(df_u["itemid"].astype(str), df_u["als_score"]))
-            for uid, df_u in als_recs.groupby("visitorid")
-        }
+    def _load_props(self, props: pd.DataFrame):
+        """Свойства товаров в виде массивов, выровненных по индексу товара"""
+        idx = self.items.to_idx(props["itemid"].to_numpy())
+        found = idx >= 0
+        self.item_cat = np.full((len(self.items), len(ITEM_CAT_PROPS)), -1, dtype=np.int32)
+        self.item_num = np.zeros((len(self.items), len(ITEM_NUM_PROPS)), dtype=np.float32)
 
-        print(f"  Loaded ALS recommendations for {len(self.als_user_lookup)} users")
+        for j, prop in enumerate(ITEM_CAT_PROPS):
+            if prop in props.columns:
+                values = pd.to_numeric(props[prop], errors="coerce")
+                self.item_cat[idx[found], j] = values.fillna(-1).to_numpy()[found]
+        for j, prop in enumerate(ITEM_NUM_PROPS):
+            if prop in props.columns:
+                values = pd.to_numeric(props[prop], errors="coerce")
+                self.item_num[idx[found], j] = values.fillna(0.0).to_numpy()[found]
 
-    def _load_similar_items(self):
-        """Загрузка индекса похожих товаров"""
-        sim_df = pd.read_parquet(self.als_assets_path / "similar_items_df.parquet")
-        sim_df["itemid"] = sim_df["items_idx"].map(self.idx2item)
-        sim_df["sim_itemid"] = sim_df["sim_item_id_idx"].map(self.idx2item)
-        sim_df = sim_df.dropna(subset=["itemid", "sim_itemid"])
-        sim_df = sim_df[sim_df["itemid"] != sim_df["sim_itemid"]]
+        if "available" in props.columns:
+            available = pd.to_numeric(props["available"], errors="coerce").to_numpy()
+            self.unavailable = ItemBitset(len(self.items), idx[found & (available == 0)])
+        else:
+            self.unavailable = ItemBitset(len(self.items))
 
-        self.sim_index = {
-            iid: dict(zip(g["sim_itemid"], g["score"]))
-            for iid, g in sim_df.groupby("itemid")
-        }
+        print(
+            f"  Loaded properties for {int(found.sum())} items, "
+            f"{len(self.unavailable)} unavailable"
+        )
 
-        print(f"  Loaded similar items for {len(self.sim_index)} items")
+    def _load_item_popularity(self):
+        """Популярность всех товаров с весами событий (range_dataset.py)"""
+        loaded = load_item_popularity(self.als_assets_path)
+        if loaded is None:
+            print(
+                f"  WARNING: item popularity not found in {self.als_assets_path}, "
+                "run range_dataset.py --export-popularity on train events"
+            )
+            return
+        item_ids, popularity = loaded
+        idx = self.items.to_idx(item_ids)
+        found = idx >= 0
+        self.item_pop = np.zeros(len(self.items), dtype=np.float32)
+        self.item_pop[idx[found]] = popularity[found]
+        print(f"  Loaded popularity for {int(found.sum())} items")
 
     @property
     def model(self) -> CatBoostRanker:
         """Property для доступа к модели"""
         return self._model
 
-    def get_user_idx(self, user_id: str) -> Optional[int]:
-        """Получение индекса пользователя по ID"""
-        return next((k for k, v in self.idx2user.items() if v == int(user_id)), None)
+    @property
+    def nbytes(self) -> int:
+        """Объём индексов в памяти (байт)"""
+        return (
+            self.users.nbytes
+            + self.items.nbytes
+            + self.item_cat.nbytes
+            + self.item_num.nbytes
+            + (self.als.nbytes if self.als is not None else 0)
+            + (self.sim.nbytes if self.sim is not None else 0)
+            + self.unavailable.nbytes
+            + (self.item_pop.nbytes if self.item_pop is not None else 0)
+        )
+
+    def get_item_root_categories(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Отсортированные itemid и их root_category из свойств товаров"""
+        cats = self.item_cat[:, ITEM_CAT_PROPS.index("root_category")]
+        known = np.flatnonzero(cats >= 0)
+        return self.items.to_external(known), cats[known].astype(np.int64)
+
+    def get_item_popularity(self) -> Optional[pd.Series]:
+        """Популярность товаров с весами событий (индекс — индекс товара); None — нет артефакта"""
+        if self.item_pop is None:
+            return None
+        nonzero = np.flatnonzero(self.item_pop)
+        return pd.Series(self.item_pop[nonzero], index=nonzero)
+
+    def merge_als_delta(
+        self, users: np.ndarray, items: np.ndarray, scores: np.ndarray
+    ) -> int:
+        """Подмена ALS-рекомендаций пользователей из дельты инкрементального обновления"""
+        if self.n_shards > 1:
+            # Пользователи других шардов сюда не маршрутизируются
+            own = user_shards(users, self.n_shards) == self.shard_id
+            users = np.asarray(users)[own]
+            items = [row for row, keep in zip(items, own) if keep]
+            scores = [row for row, keep in zip(scores, own) if keep]
+        for uid, row_items, row_scores in zip(users.tolist(), items, scores):
+            idx = self.items.to_idx(row_items)
+            valid = idx >= 0
+            user_idx = self.users.add(uid)
+            self.als_overlay[user_idx] = (
+                idx[valid],
+                np.asarray(row_scores, dtype=np.float32)[valid],
+            )
+            self.als_overlay.move_to_end(user_idx)
+        while len(self.als_overlay) > self.max_overlay_users:
+            # Вытесненный пользователь возвращается к ALS из артефактов,
+            # добавленный для него id удаляется
+            user_idx, _ = self.als_overlay.popitem(last=False)
+            self.users.remove(user_idx)
+        return len(users)
+
+    def owns_user(self, user_id) -> bool:
+        """Пользователь относится к загруженному шарду"""
+        return user_shard(user_id, self.n_shards) == self.shard_id
+
+    def get_user_idx(self, user_id) -> Optional[int]:
+        """Получение индекса пользователя по внешнему ID"""
+        return self.users.get(user_id)
 
-    def get_als_for_user(self, user_idx: Optional[int]) -> Optional[Dict]:
-        """Получение ALS рекомендаций для пользователя"""
-        return self.als_user_lookup.get(user_idx) if user_idx else None
+    def get_als_for_user(self, user_idx: Optional[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """ALS рекомендации пользователя: (индексы товаров, скоры) по убыванию скора"""
+        if user_idx is None:
+            return EMPTY_IDX, EMPTY_SCORES
+        overlay = self.als_overlay.get(user_idx)
+        if overlay is not None:
+            return overlay
+        return self.als.row(user_idx)
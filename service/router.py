@@ -0,0 +1,277 @@
+"""
+Роутер для шардов пользователей: /recommendations и /events пересылаются
+в шард, которому принадлежит пользователь (user_shard, как в репозитории),
+пакет /events/batch делится по шардам. Каждый шард загружает ALS только
+своих пользователей (USER_SHARDS / USER_SHARD_ID).
+
+    python -m service.router --port 8000 --shard-urls http://127.0.0.1:8001,http://127.0.0.1:8002
+    python -m service.router --port 8000 --spawn 2 --base-port 8001
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List
+
+import httpx
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request, Response
+
+from .event_batch import MAX_ERRORS, parse_events_payload, validate_events
+from .id_space import user_shard
+
+
+logger = logging.getLogger("uvicorn.error")
+
+shard_urls = [u.rstrip("/") for u in os.getenv("SHARD_URLS","").split(",") if u]
+router_timeout_sec = float(os.getenv("ROUTER_TIMEOUT_SEC",5))
+router_max_connections = int(os.getenv("ROUTER_MAX_CONNECTIONS",256))
+
+# Заголовки ответа шарда, которые отдаются клиенту
+FORWARD_HEADERS = ("X-Candidate-Pool-Size", "X-Precomputed", "Server-Timing")
+
+
+async def check_shards(client: httpx.AsyncClient) -> List[Dict]:
+    """Состояние шардов и совпадение их номера с позицией в SHARD_URLS"""
+
+    async def check(i: int, url: str) -> Dict:
+        try:
+            health = (await client.get(f"{url}/health")).json()
+        except (httpx.HTTPError, ValueError) as e:
+            return {"url": url, "status": "unavailable", "error": str(e)}
+        matches = health.get("shard") == i and health.get("shards") == len(shard_urls)
+        return {
+            "url": url,
+            "status": health.get("status", "unknown") if matches else "misconfigured",
+            "shard": health.get("shard"),
+            "shards": health.get("shards"),
+        }
+
+    return list(await asyncio.gather(*(check(i, u) for i, u in enumerate(shard_urls))))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not shard_urls:
+        raise RuntimeError("SHARD_URLS is empty")
+    app.state.client = httpx.AsyncClient(
+        timeout=router_timeout_sec,
+        limits=httpx.Limits(
+            max_connections=router_max_connections,
+            max_keepalive_connections=router_max_connections,
+        ),
+    )
+    for shard in await check_shards(app.state.client):
+        logger.info(f"Shard {shard}")
+    logger.info(f"Router is ready: {len(shard_urls)} shards")
+    yield
+
+    await app.state.client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def shard_url(userid: str) -> str:
+    return shard_urls[user_shard(userid, len(shard_urls))]
+
+
+async def forward(method: str, url: str, **kwargs) -> Response:
+    """Запрос в шард; ответ шарда (тело, статус, заголовки выдачи) — клиенту"""
+    try:
+        r = await app.state.client.request(method, url, **kwargs)
+    except httpx.HTTPError as e:
+        logger.error(f"Shard request failed {url}: {e}")
+        raise HTTPException(status_code=502, detail=f"Shard unavailable: {e}")
+    headers = {h: r.headers[h] for h in FORWARD_HEADERS if h in r.headers}
+    return Response(
+        content=r.content,
+        status_code=r.status_code,
+        media_type=r.headers.get("content-type"),
+        headers=headers,
+    )
+
+
+@app.get("/health")
+async def health_check():
+    """Проверка здоровья роутера и всех шардов"""
+    shards = await check_shards(app.state.client)
+    healthy = all(s["status"] == "healthy" for s in shards)
+    return {"status": "healthy" if healthy else "degraded", "shards": shards}
+
+
+@app.post("/recommendations")
+async def get_online_recommendations(request: Request, userid: str):
+    """Рекомендации из шарда пользователя (параметры запроса — без изменений)"""
+    return await forward(
+        "POST", f"{shard_url(userid)}/recommendations", params=request.query_params
+    )
+
+
+@app.post("/events")
+async def add_event(request: Request, userid: str):
+    """Событие пользователя — в его шард"""
+    return await forward("POST", f"{shard_url(userid)}/events", params=request.query_params)
+
+
+@app.get("/events/{userid}")
+async def get_user_events(request: Request, userid: str):
+    return await forward(
+        "GET", f"{shard_url(userid)}/events/{userid}", params=request.query_params
+    )
+
+
+@app.post("/events/batch")
+async def add_events_batch(request: Request):
+    """
+    Пакет событий делится по шардам пользователей; невалидные строки
+    отсеиваются здесь (индексы ошибок — по исходному пакету), ответ —
+    сумма ответов шардов. Если шард недоступен или ответил ошибкой, его
+    строки не приняты, статус — "partial", состояние шардов — в "shards".
+    """
+    try:
+        records = parse_events_payload(
+            await request.body(), request.headers.get("content-type", "")
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid payload: {e}")
+
+    userids, itemids, events, valid, errors = validate_events(records)
+    rows = np.flatnonzero(valid)
+    shards = np.fromiter(
+        (user_shard(u, len(shard_urls)) for u in userids[rows].tolist()),
+        dtype=np.int64,
+        count=len(rows),
+    )
+
+    async def send(shard: int, shard_rows: np.ndarray) -> Dict:
+        """Часть пакета в шард; сбой шарда не отменяет приём остальных частей"""
+        payload = [
+            {"userid": u, "itemid": i, "event": e}
+            for u, i, e in zip(
+                userids[shard_rows].tolist(),
+                itemids[shard_rows].tolist(),
+                events[shard_rows].tolist(),
+            )
+        ]
+        result = {"shard": shard, "rows": len(shard_rows), "accepted": 0, "users": 0}
+        try:
+            response = await forward(
+                "POST",
+                f"{shard_urls[shard]}/events/batch",
+                content=json.dumps(payload),
+                headers={"content-type": "application/json"},
+            )
+        except HTTPException as e:
+            return {**result, "status": "unavailable", "detail": e.detail, "errors": []}
+        body = response.body.decode(errors="replace")
+        if response.status_code != 200:
+            logger.error(f"Shard {shard} rejected {len(shard_rows)} events: {body}")
+            return {
+                **result,
+                "status": "error",
+                "status_code": response.status_code,
+                "detail": body,
+                "errors": [],
+            }
+        accepted = json.loads(body)
+        # Индексы строк, отклонённых шардом, — обратно в индексы исходного пакета
+        shard_errors = [
+            {**e, "index": int(shard_rows[e["index"]]), "shard": shard}
+            for e in accepted["errors"]
+        ]
+        return {
+            **result,
+            "status": "ok",
+            "accepted": accepted["accepted"],
+            "users": accepted["users"],
+            "errors": shard_errors,
+        }
+
+    results = await asyncio.gather(
+        *(send(s, rows[shards == s]) for s in np.unique(shards).tolist())
+    )
+
+    accepted = sum(r["accepted"] for r in results)
+    for r in results:
+        errors += r.pop("errors")
+    return {
+        "status": "ok" if all(r["status"] == "ok" for r in results) else "partial",
+        "received": len(records),
+        "accepted": accepted,
+        "rejected": len(records) - accepted,
+        "users": sum(r["users"] for r in results),
+        "shards": results,
+        "errors": sorted(errors, key=lambda e: e["index"])[:MAX_ERRORS],
+    }
+
+
+def spawn_shards(n: int, host: str, base_port: int) -> List[subprocess.Popen]:
+    """Локальный запуск n шардов service.main на портах base_port.."""
+    processes = []
+    for i in range(n):
+        env = {**os.environ, "USER_SHARDS": str(n), "USER_SHARD_ID": str(i)}
+        if env.get("EVENT_LOG_DIR"):
+            # Журнал событий у каждого шарда свой
+            env["EVENT_LOG_DIR"] = os.path.join(env["EVENT_LOG_DIR"], f"shard-{i}")
+        processes.append(
+            subprocess.Popen(
+                [
+                    sys.executable, "-m", "uvicorn", "service.main:app",
+                    "--host", host, "--port", str(base_port + i),
+                ],
+                env=env,
+            )
+        )
+    return processes
+
+
+def wait_for_shards(urls: List[str], timeout_sec: float) -> None:
+    """Ожидание, пока шарды загрузят данные и начнут отвечать на /health"""
+    deadline = time.monotonic() + timeout_sec
+    pending = list(urls)
+    while pending and time.monotonic() < deadline:
+        for url in list(pending):
+            try:
+                if httpx.get(f"{url}/health", timeout=1.0).status_code == 200:
+                    pending.remove(url)
+            except httpx.HTTPError:
+                pass
+        time.sleep(0.5)
+    if pending:
+        raise RuntimeError(f"Shards not ready after {timeout_sec:.0f}s: {pending}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Роутер запросов по шардам пользователей")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("MAIN_APP_PORT", 8000)))
+    parser.add_argument(
+        "--shard-urls", default=",".join(shard_urls), help="адреса шардов по номеру шарда"
+    )
+    parser.add_argument("--spawn", type=int, default=0, help="запустить N локальных шардов")
+    parser.add_argument("--base-port", type=int, default=8001)
+    parser.add_argument("--wait-sec", type=float, default=600.0)
+    args = parser.parse_args()
+
+    processes = []
+    if args.spawn:
+        processes = spawn_shards(args.spawn, "127.0.0.1", args.base_port)
+        shard_urls = [f"http://127.0.0.1:{args.base_port + i}" for i in range(args.spawn)]
+    else:
+        shard_urls = [u.rstrip("/") for u in args.shard_urls.split(",") if u]
+    try:
+        if processes:
+            wait_for_shards(shard_urls, args.wait_sec)
+        uvicorn.run(app, host=args.host, port=args.port)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
@@ -0,0 +1,55 @@
+import json
+from typing import List, Literal, NamedTuple
+
+import numpy as np
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # есть в requirements; без неё — медленный стандартный json
+    orjson = None
+
+# Активный сериализатор ответов (пишется в лог при старте сервиса)
+JSON_ENCODER = "orjson" if orjson is not None else "json (orjson is not installed)"
+
+
+class RecommendationItem(BaseModel):
+    itemid: int
+    score: float
+
+
+class RecommendationsResponse(BaseModel):
+    """Единый ответ /recommendations для холодных и тёплых пользователей"""
+
+    userid: str
+    source: Literal["ranker", "cold_start"]
+    items: List[RecommendationItem]
+
+
+class RankedItems(NamedTuple):
+    """Результат сервиса: внешние itemid и скоры в порядке выдачи, источник выдачи"""
+
+    items: np.ndarray
+    scores: np.ndarray
+    source: str
+
+
+def encode_recommendations(userid: str, ranked: RankedItems) -> bytes:
+    """
+    Сериализация ответа сразу в байты, минуя jsonable_encoder:
+    массивы переводятся в нативные типы одним tolist().
+    """
+    payload = {
+        "userid": userid,
+        "source": ranked.source,
+        "items": [
+            {"itemid": iid, "score": score}
+            for iid, score in zip(
+                np.asarray(ranked.items, dtype=np.int64).tolist(),
+                np.asarray(ranked.scores, dtype=np.float64).tolist(),
+            )
+        ],
+    }
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":")).encode()
@@ -0,0 +1,171 @@
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+from catboost import CatBoostRanker, Pool
+
+from .recommender_repository import ITEM_CAT_PROPS
+
+
+def parse_model_paths(value: str) -> Dict[str, str]:
+    """Разбор списка моделей из строки вида "deep:models/catboost_ranker_8.cbm,..." """
+    paths = {}
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, path = part.partition(":")
+        if not sep:
+            # Без имени — имя по файлу модели
+            name, path = part.rsplit("/", 1)[-1].removesuffix(".cbm"), part
+        paths[name.strip()] = path.strip()
+    return paths
+
+
+def load_models(paths: Dict[str, str]) -> Dict[str, CatBoostRanker]:
+    models = {}
+    for name, path in paths.items():
+        model = CatBoostRanker()
+        model.load_model(path)
+        print(f"  Shadow model {name} loaded with {len(model.feature_names_)} features")
+        models[name] = model
+    return models
+
+
+def make_pool(model: CatBoostRanker, X: pd.DataFrame) -> Pool:
+    """Pool под набор признаков конкретной модели поверх общей матрицы признаков"""
+    used_features = [f for f in model.feature_names_ if f in X.columns]
+    return Pool(
+        X[used_features],
+        group_id=X["group_id"],
+        cat_features=[c for c in used_features if c in ITEM_CAT_PROPS],
+    )
+
+
+def rank_agreement(primary: np.ndarray, shadow: np.ndarray, topn: int) -> Dict[str, float]:
+    """
+    Согласованность двух скорингов одного пула кандидатов:
+    overlap@topn, совпадение top-1 и ранговая корреляция Спирмена по всему пулу.
+    """
+    n = len(primary)
+    k = min(topn, n)
+    top_p = np.argsort(-primary, kind="stable")[:k]
+    top_s = np.argsort(-shadow, kind="stable")[:k]
+    overlap = len(np.intersect1d(top_p, top_s)) / k if k else 1.0
+    if n > 1:
+        rank_p = np.argsort(np.argsort(-primary, kind="stable"))
+        rank_s = np.argsort(np.argsort(-shadow, kind="stable"))
+        spearman = float(np.corrcoef(rank_p, rank_s)[0, 1])
+    else:
+        spearman = 1.0
+    return {
+        "overlap_at_k": overlap,
+        "top1_match": float(k > 0 and top_p[0] == top_s[0]),
+        "spearman": spearman,
+    }
+
+
+class ModelStats:
+    """Накопленная статистика модели: задержка предсказания и согласие с основной"""
+
+    def __init__(self, window: int = 1000):
+        self.n = 0
+        self.latency_ms = deque(maxlen=window)
+        self.agreement: Dict[str, deque] = {}
+        self.window = window
+
+    def record(self, latency_ms: float, n_candidates: int, agreement: Optional[Dict] = None):
+        self.n += 1
+        self.latency_ms.append((latency_ms, n_candidates))
+        for name, value in (agreement or {}).items():
+            self.agreement.setdefault(name, deque(maxlen=self.window)).append(value)
+
+    def summary(self) -> Dict[str, float]:
+        result = {"requests": self.n}
+        if self.latency_ms:
+            latency, pool = np.array(list(self.latency_ms)).T
+            p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+            result.update(
+                latency_p50_ms=float(p50),
+                latency_p95_ms=float(p95),
+                latency_p99_ms=float(p99),
+                us_per_candidate=float(latency.sum() / max(pool.sum(), 1) * 1000),
+            )
+        for name, values in self.agreement.items():
+            result[name] = float(np.nanmean(list(values)))
+        return result
+
+
+class ShadowScorer:
+    """
+    Теневой скоринг: дополнительные модели оценивают тот же пул кандидатов
+    на доле трафика в фоновом потоке, вне пути запроса. Ответ пользователю
+    всегда формирует основная модель.
+    """
+
+    def __init__(
+        self,
+        models: Dict[str, CatBoostRanker],
+        sample_rate: float = 0.1,
+        topn: int = 10,
+        max_queue: int = 100,
+        window: int = 1000,
+    ):
+        """
+        Args:
+            models: теневые модели по именам
+            sample_rate: доля запросов, отправляемых в теневой скоринг
+            topn: глубина сравнения выдач (overlap@topn)
+            max_queue: лимит очереди; при переполнении запрос не оценивается
+            window: окно статистики (последние запросы)
+        """
+        self.models = models
+        self.sample_rate = sample_rate
+        self.topn = topn
+        self.window = window
+        self.stats: Dict[str, ModelStats] = {name: ModelStats(window) for name in models}
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="shadow-scorer", daemon=True)
+        self._thread.start()
+
+    def sample(self) -> bool:
+        return bool(self.models) and random.random() < self.sample_rate
+
+    def submit(self, X: pd.DataFrame, primary_scores: np.ndarray) -> None:
+        """Неблокирующая постановка пула в очередь теневого скоринга"""
+        try:
+            self._queue.put_nowait((X, primary_scores))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            X, primary_scores = self._queue.get()
+            for name, model in self.models.items():
+                try:
+                    pool = make_pool(model, X)
+                    t0 = time.perf_counter()
+                    scores = model.predict(pool)
+                    latency_ms = (time.perf_counter() - t0) * 1000
+                    agreement = rank_agreement(primary_scores, scores, self.topn)
+                    with self._lock:
+                        self.stats[name].record(latency_ms, len(X), agreement)
+                except Exception as e:
+                    print(f"Shadow model {name} error: {e}")
+
+    def summary(self) -> Dict:
+        with self._lock:
+            models = {name: stats.summary() for name, stats in self.stats.items()}
+        return {
+            "sample_rate": self.sample_rate,
+            "pending": self._queue.qsize(),
+            "dropped": self.dropped,
+            "models": models,
+        }
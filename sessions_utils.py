@@ -0,0 +1,364 @@
+import argparse
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+EVENT_NAMES = ["view", "addtocart", "transaction"]
+EVENT_CODES = {name: code for code, name in enumerate(EVENT_NAMES)}
+EVENT_WEIGHTS = {"transaction": 5, "addtocart": 3, "view": 1}
+# Вес по коду события; последний элемент — для неизвестных событий (код -1)
+EVENT_WEIGHT_BY_CODE = np.array(
+    [EVENT_WEIGHTS[name] for name in EVENT_NAMES] + [0], dtype=np.float32
+)
+
+MINUTE_MS = 60_000
+DAY_MS = 86_400_000
+
+
+def encode_events(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """
+    Перевод событий в отсортированные по (visitor, ts) массивы без дубликатов.
+    Замена preprocess_events: одна сортировка, без копий DataFrame.
+    """
+    if "timestamp" in df.columns:
+        ts = df["timestamp"].to_numpy(dtype=np.int64)
+    else:
+        ts = df["ts_event"].to_numpy(dtype="datetime64[ms]").astype(np.int64)
+    visitor = df["visitorid"].to_numpy(dtype=np.int64)
+    item = df["itemid"].to_numpy(dtype=np.int64)
+    event = df["event"].map(EVENT_CODES).fillna(-1).to_numpy(dtype=np.int8)
+
+    order = np.lexsort((event, item, ts, visitor))
+    visitor, ts, item, event = visitor[order], ts[order], item[order], event[order]
+
+    # Полные дубликаты (visitor, ts, item, event) соседствуют после сортировки
+    keep = np.ones(len(visitor), dtype=bool)
+    keep[1:] = (
+        (visitor[1:] != visitor[:-1])
+        | (ts[1:] != ts[:-1])
+        | (item[1:] != item[:-1])
+        | (event[1:] != event[:-1])
+    )
+    return {
+        "visitor": visitor[keep],
+        "ts": ts[keep],
+        "item": item[keep],
+        "event": event[keep],
+    }
+
+
+def sessionize(
+    visitor: np.ndarray,
+    ts: np.ndarray,
+    inactivity_minutes: int = 30,
+    reset_on_day_change: bool = False,
+    split_ts: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Сессии за один проход по отсортированным массивам.
+    split_ts дополнительно разрывает сессии, пересекающие дату сплита (_L/_R).
+
+    Returns:
+        session — глобальный номер сессии (0..n-1, возрастает вдоль массива)
+        order — порядковый номер сессии внутри пользователя (с 1)
+    """
+    n = len(visitor)
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32)
+
+    new_visitor = np.ones(n, dtype=bool)
+    new_visitor[1:] = visitor[1:] != visitor[:-1]
+
+    new = new_visitor.copy()
+    new[1:] |= (ts[1:] - ts[:-1]) > inactivity_minutes * MINUTE_MS
+    if reset_on_day_change:
+        day = ts // DAY_MS
+        new[1:] |= day[1:] != day[:-1]
+    if split_ts is not None:
+        new[1:] |= (ts[1:] >= split_ts) & (ts[:-1] < split_ts)
+
+    session = np.cumsum(new, dtype=np.int64) - 1
+    visitor_seg = np.cumsum(new_visitor) - 1
+    order = session - session[new_visitor][visitor_seg] + 1
+    return session, order.astype(np.int32)
+
+
+def _session_bounds(session: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Начала сессий и локальный (0..m-1) номер сессии для каждой строки"""
+    change = np.ones(len(session), dtype=bool)
+    change[1:] = session[1:] != session[:-1]
+    return np.flatnonzero(change), np.cumsum(change) - 1
+
+
+def session_ids(visitor: np.ndarray, order: np.ndarray) -> np.ndarray:
+    """Строковые session_id вида "<visitorid>_<order>" (как в ноутбуке)"""
+    return (
+        pd.Series(visitor).astype(str) + "_" + pd.Series(order).astype(str)
+    ).to_numpy(dtype=object)
+
+
+def sessions_agg_arrays(
+    visitor: np.ndarray,
+    ts: np.ndarray,
+    item: np.ndarray,
+    event: np.ndarray,
+    session: np.ndarray,
+    order: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    """Агрегаты по сессиям сегментными редукциями (массивы отсортированы по сессии)"""
+    n = len(session)
+    starts, local = _session_bounds(session)
+    m = len(starts)
+    ends = np.append(starts[1:], n)[:m] - 1
+
+    # Уникальные товары в сессии
+    o = np.lexsort((item, local))
+    s_sorted, i_sorted = local[o], item[o]
+    first = np.ones(n, dtype=bool)
+    first[1:] = (s_sorted[1:] != s_sorted[:-1]) | (i_sorted[1:] != i_sorted[:-1])
+    n_items = np.bincount(s_sorted[first], minlength=m)
+
+    # Счётчики типов событий
+    valid = event >= 0
+    n_codes = len(EVENT_NAMES)
+    counts = np.bincount(
+        local[valid] * n_codes + event[valid], minlength=m * n_codes
+    ).reshape(m, n_codes)
+
+    result = {
+        "visitorid": visitor[starts],
+        "session_order": order[starts],
+        "session_start": ts[starts],
+        "session_end": ts[ends],
+        "n_events": np.diff(np.append(starts, n)) if m else starts,
+        "n_items": n_items,
+    }
+    for code, name in enumerate(EVENT_NAMES):
+        result[f"cnt_event_{name}"] = counts[:, code]
+    result["duration_sec"] = (ts[ends] - ts[starts]) / 1000.0
+    return result
+
+
+def next_session_targets_arrays(
+    visitor: np.ndarray,
+    item: np.ndarray,
+    event: np.ndarray,
+    session: np.ndarray,
+    order: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    """
+    Таргеты следующей сессии: для якорной сессии s и товара i —
+    максимальный вес события с i в следующей сессии того же пользователя.
+    """
+    starts, local = _session_bounds(session)
+    session_visitor = visitor[starts]
+    has_prev = np.zeros(len(starts), dtype=bool)
+    has_prev[1:] = session_visitor[1:] == session_visitor[:-1]
+
+    mask = has_prev[local]
+    anchor = local[mask] - 1
+    it = item[mask]
+    weight = EVENT_WEIGHT_BY_CODE[event[mask]]
+
+    if len(anchor) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return {
+            "visitorid": empty,
+            "anchor_order": empty,
+            "itemid": empty,
+            "gain": np.empty(0, dtype=np.float32),
+        }
+
+    o = np.lexsort((it, anchor))
+    anchor, it, weight = anchor[o], it[o], weight[o]
+    bstart = np.ones(len(anchor), dtype=bool)
+    bstart[1:] = (anchor[1:] != anchor[:-1]) | (it[1:] != it[:-1])
+    idx = np.flatnonzero(bstart)
+
+    anchors = anchor[idx]
+    return {
+        "visitorid": session_visitor[anchors],
+        "anchor_order": order[starts][anchors],
+        "itemid": it[idx],
+        "gain": np.maximum.reduceat(weight, idx).astype(np.float32),
+    }
+
+
+def sessions_frame(agg: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """Агрегаты сессий в формате sessions_agg из ноутбука"""
+    df = pd.DataFrame(agg)
+    df.insert(2, "session_id", session_ids(agg["visitorid"], agg["session_order"]))
+    for col in ["session_start", "session_end"]:
+        df[col] = pd.to_datetime(df[col], unit="ms", utc=True)
+    return df
+
+
+def targets_frame(targets: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """Таргеты в формате build_next_session_targets из ноутбука"""
+    return pd.DataFrame(
+        {
+            "visitorid": targets["visitorid"],
+            "anchor_session_id": session_ids(
+                targets["visitorid"], targets["anchor_order"]
+            ),
+            "itemid": targets["itemid"],
+            "gain": targets["gain"],
+        }
+    )
+
+
+def events_frame(
+    arrays: Dict[str, np.ndarray], session: np.ndarray, order: np.ndarray
+) -> pd.DataFrame:
+    """События с session_id в формате events_with_sessions из ноутбука"""
+    starts, local = _session_bounds(session)
+    sid = session_ids(arrays["visitor"][starts], order[starts])
+    event = arrays["event"]
+    names = np.array(EVENT_NAMES + [None], dtype=object)
+    return pd.DataFrame(
+        {
+            "timestamp": arrays["ts"],
+            "visitorid": arrays["visitor"],
+            "event": names[event],
+            "itemid": arrays["item"],
+            "ts_event": pd.to_datetime(arrays["ts"], unit="ms", utc=True),
+            "session_order_adj": order,
+            "session_id": sid[local],
+            "event_weight": EVENT_WEIGHT_BY_CODE[event],
+        }
+    )
+
+
+def _take(arrays: Dict[str, np.ndarray], mask: np.ndarray) -> Dict[str, np.ndarray]:
+    return {k: v[mask] for k, v in arrays.items()}
+
+
+def build_sessions(
+    df: pd.DataFrame,
+    inactivity_minutes: int = 30,
+    reset_on_day_change: bool = False,
+    split_date_str: Optional[str] = None,
+    with_events: bool = True,
+) -> Dict[str, pd.DataFrame]:
+    """
+    Полный пайплайн: сессии, агрегаты и таргеты следующей сессии.
+    При split_date_str результаты делятся на train/test, сессии на границе разрываются.
+    """
+    arrays = encode_events(df)
+    split_ts = None
+    if split_date_str is not None:
+        split_ts = int(pd.Timestamp(split_date_str, tz="UTC").value // 1_000_000)
+
+    session, order = sessionize(
+        arrays["visitor"],
+        arrays["ts"],
+        inactivity_minutes,
+        reset_on_day_change,
+        split_ts,
+    )
+    arrays["session"] = session
+    arrays["order"] = order
+
+    parts = {"all": np.ones(len(session), dtype=bool)}
+    if split_ts is not None:
+        left = arrays["ts"] < split_ts
+        parts = {"train": left, "test": ~left}
+
+    result = {}
+    for name, mask in parts.items():
+        a = _take(arrays, mask) if name != "all" else arrays
+        result[f"sessions_{name}"] = sessions_frame(
+            sessions_agg_arrays(
+                a["visitor"], a["ts"], a["item"], a["event"], a["session"], a["order"]
+            )
+        )
+        result[f"targets_{name}"] = targets_frame(
+            next_session_targets_arrays(
+                a["visitor"], a["item"], a["event"], a["session"], a["order"]
+            )
+        )
+        if with_events:
+            result[f"events_{name}"] = events_frame(a, a["session"], a["order"])
+    return result
+
+
+def iter_visitor_chunks(
+    path: Path, batch_rows: int = 1_000_000, columns: Optional[List[str]] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Чтение parquet, отсортированного по visitorid, батчами с целыми пользователями:
+    хвост последнего пользователя переносится в следующий батч.
+    """
+    carry = None
+    pf = pq.ParquetFile(path)
+    for batch in pf.iter_batches(batch_size=batch_rows, columns=columns):
+        table = pa.Table.from_batches([batch])
+        if carry is not None:
+            table = pa.concat_tables([carry, table])
+        visitor = table.column("visitorid").to_numpy()
+        last_start = int(np.searchsorted(visitor, visitor[-1], side="left"))
+        if last_start > 0:
+            yield table.slice(0, last_start).to_pandas()
+        carry = table.slice(last_start)
+    if carry is not None and carry.num_rows:
+        yield carry.to_pandas()
+
+
+def sessionize_parquet(
+    events_path: Path,
+    out_dir: Path,
+    inactivity_minutes: int = 30,
+    reset_on_day_change: bool = False,
+    split_date_str: Optional[str] = None,
+    batch_rows: int = 1_000_000,
+) -> None:
+    """
+    Потоковая сессионизация parquet с событиями, отсортированными по visitorid.
+    Каждый батч пишется отдельными файлами в out_dir/<таблица>/part-NNNNN.parquet.
+    """
+    out_dir = Path(out_dir)
+    columns = ["timestamp", "visitorid", "event", "itemid"]
+    for part_no, chunk in enumerate(iter_visitor_chunks(events_path, batch_rows, columns)):
+        result = build_sessions(
+            chunk, inactivity_minutes, reset_on_day_change, split_date_str
+        )
+        for name, df in result.items():
+            (out_dir / name).mkdir(parents=True, exist_ok=True)
+            df.to_parquet(out_dir / name / f"part-{part_no:05d}.parquet", index=False)
+        print(f"  part {part_no}: {len(chunk):,} событий")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сессионизация событий и таргеты")
+    parser.add_argument("--events", required=True, type=Path)
+    parser.add_argument("--out-dir", default=Path("range_features"), type=Path)
+    parser.add_argument("--split-date", default="2015-08-29")
+    parser.add_argument("--inactivity-minutes", default=30, type=int)
+    parser.add_argument("--reset-on-day-change", action="store_true")
+    parser.add_argument("--batch-rows", default=1_000_000, type=int)
+    args = parser.parse_args()
+
+    if args.events.suffix == ".csv":
+        result = build_sessions(
+            pd.read_csv(args.events),
+            args.inactivity_minutes,
+            args.reset_on_day_change,
+            args.split_date,
+        )
+        args.out_dir.mkdir(parents=True, exist_ok=True)
+        for name, df in result.items():
+            df.to_parquet(args.out_dir / f"{name}.parquet", index=False)
+    else:
+        sessionize_parquet(
+            args.events,
+            args.out_dir,
+            args.inactivity_minutes,
+            args.reset_on_day_change,
+            args.split_date,
+            args.batch_rows,
+        )
@@ -0,0 +1,103 @@
+import numpy as np
+
+from service.feature_generator import filter_candidates, generate_candidate_ids
+from service.id_space import CSRLists, ItemBitset
+
+
+def dict_candidates(recent_items, als_map_user, sim_index, n_als, n_sim, last_k):
+    """Прежняя реализация на словарях строковых id (эталон)"""
+    pool = []
+    if als_map_user and n_als > 0:
+        als_sorted = sorted(als_map_user.items(), key=lambda x: -x[1])[:n_als]
+        pool.extend([iid for iid, _ in als_sorted])
+    if recent_items and n_sim > 0:
+        per_item = max(1, n_sim // max(1, len(recent_items)))
+        for it in recent_items[:last_k]:
+            sim_items_dict = sim_index.get(str(it), {})
+            sorted_items = sorted(sim_items_dict.items(), key=lambda x: -x[1])[:per_item]
+            pool.extend([sid for sid, _ in sorted_items])
+    seen = set()
+    uniq = []
+    for x in pool:
+        if x not in seen:
+            uniq.append(x)
+            seen.add(x)
+    return uniq
+
+
+def random_case(rng, n_items=60):
+    # Различные скоры, чтобы порядок при равенстве не зависел от реализации
+    als_items = rng.choice(n_items, size=rng.integers(0, 30), replace=False)
+    als_scores = rng.permutation(len(als_items)) + rng.random()
+    n_pairs = 400
+    rows = rng.integers(0, n_items, n_pairs)
+    items = rng.integers(0, n_items, n_pairs)
+    scores = rng.permutation(n_pairs).astype(np.float64)
+    _, first = np.unique(rows * n_items + items, return_index=True)
+    rows, items, scores = rows[first], items[first], scores[first]
+    recent = rng.integers(0, n_items + 5, rng.integers(0, 8))
+    return als_items, als_scores, rows, items, scores, recent
+
+
+def test_generate_candidates_matches_dict_logic():
+    rng = np.random.default_rng(0)
+    n_items = 60
+    for _ in range(50):
+        als_items, als_scores, rows, items, scores, recent = random_case(rng, n_items)
+        n_als, n_sim, last_k = (int(x) for x in rng.integers(0, 25, 3))
+
+        sim_index = {}
+        for r, i, s in zip(rows.tolist(), items.tolist(), scores.tolist()):
+            sim_index.setdefault(str(r), {})[str(i)] = s
+        als_map = {str(i): float(s) for i, s in zip(als_items.tolist(), als_scores.tolist())}
+        expected = dict_candidates(
+            [str(x) for x in recent.tolist()], als_map, sim_index, n_als, n_sim, last_k
+        )
+
+        order = np.argsort(-als_scores, kind="stable")
+        sim = CSRLists.from_pairs(rows, items, scores, n_items)
+        got = generate_candidate_ids(
+            recent.astype(np.int32),
+            als_items[order].astype(np.int32),
+            sim,
+            n_als,
+            n_sim,
+            last_k,
+        )
+        assert [str(x) for x in got.tolist()] == expected
+
+
+def test_extra_parts_appended_and_deduplicated():
+    sim = CSRLists.from_pairs(
+        np.array([0, 0]), np.array([5, 6]), np.array([0.9, 0.1]), n_rows=10
+    )
+    got = generate_candidate_ids(
+        np.array([0], dtype=np.int32),
+        np.array([3, 5], dtype=np.int32),
+        sim,
+        n_als=2,
+        n_sim=2,
+        last_k=1,
+        extra_parts=[np.array([6, 8, 3], dtype=np.int32)],
+    )
+    assert got.tolist() == [3, 5, 6, 8]
+    empty = generate_candidate_ids(np.array([]), np.array([]), sim, 5, 5, 5)
+    assert len(empty) == 0
+
+
+def test_filter_candidates_matches_set_logic():
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        candidates = rng.permutation(50)[:30].astype(np.int32)
+        unavailable = rng.integers(-3, 55, 10)
+        exclude = rng.integers(0, 50, 5).astype(np.int32)
+
+        blocked = {int(x) for x in unavailable if 0 <= x < 50} | set(exclude.tolist())
+        expected = [c for c in candidates.tolist() if c not in blocked]
+
+        got = filter_candidates(candidates, ItemBitset(50, unavailable), exclude)
+        assert got.tolist() == expected
+
+    candidates = np.array([1, 2, 3], dtype=np.int32)
+    assert filter_candidates(candidates) is candidates
+    assert filter_candidates(candidates, None, np.array([], dtype=np.int32)) is candidates
@@ -0,0 +1,68 @@
+import pytest
+
+from service.event_batch import (
+    MAX_ERRORS,
+    group_by_user,
+    parse_events_payload,
+    validate_events,
+)
+
+
+def test_parse_json_array_and_ndjson():
+    records = parse_events_payload(b'[{"userid": "1", "itemid": "2", "event": "view"}]')
+    assert records == [{"userid": "1", "itemid": "2", "event": "view"}]
+
+    body = b'{"userid": "1", "itemid": "2", "event": "view"}\n\nnot json\n'
+    records = parse_events_payload(body, "application/x-ndjson")
+    assert records == [{"userid": "1", "itemid": "2", "event": "view"}, None]
+    assert parse_events_payload(b"  ") == []
+
+    with pytest.raises(ValueError):
+        parse_events_payload(b'[{"userid": "1"}', "application/json")
+
+
+def test_validate_events():
+    records = [
+        {"userid": "u1", "itemid": "10", "event": "view"},
+        {"userid": "u1", "itemid": "abc", "event": "view"},
+        {"userid": "u2", "itemid": "11", "event": "like"},
+        {"userid": "", "itemid": "12", "event": "view"},
+        {"itemid": "12", "event": "view"},
+        None,
+        "string",
+        {"userid": 7, "itemid": 13, "event": "transaction"},
+    ]
+    userids, itemids, events, valid, errors = validate_events(records)
+
+    assert valid.tolist() == [True, False, False, False, False, False, False, True]
+    assert userids[7] == "7" and itemids[7] == "13" and events[7] == "transaction"
+    assert errors == [
+        {"index": 1, "error": "non-integer itemid"},
+        {"index": 2, "error": "unknown event"},
+        {"index": 3, "error": "missing field or not an object"},
+        {"index": 4, "error": "missing field or not an object"},
+        {"index": 5, "error": "missing field or not an object"},
+        {"index": 6, "error": "missing field or not an object"},
+    ]
+
+
+def test_validate_events_caps_errors():
+    records = [None] * (MAX_ERRORS + 5)
+    _, _, _, valid, errors = validate_events(records)
+    assert not valid.any()
+    assert len(errors) == MAX_ERRORS
+
+
+def test_group_by_user_keeps_order():
+    records = [
+        {"userid": "b", "itemid": "1", "event": "view"},
+        {"userid": "a", "itemid": "2", "event": "view"},
+        {"userid": "b", "itemid": "3", "event": "addtocart"},
+    ]
+    userids, itemids, events, valid, _ = validate_events(records)
+    grouped = group_by_user(userids[valid], itemids[valid], events[valid])
+    assert grouped == {
+        "a": [("2", "view")],
+        "b": [("1", "view"), ("3", "addtocart")],
+    }
+    assert group_by_user(userids[:0], itemids[:0], events[:0]) == {}
@@ -0,0 +1,90 @@
+import numpy as np
+
+from service.id_space import (
+    CSRLists,
+    IdMap,
+    ItemBitset,
+    lookup_scores,
+    user_shard,
+    user_shards,
+)
+
+
+def test_id_map_round_trip():
+    ids = np.array([42, 7, 1000, 7, 3, -1], dtype=np.int64)
+    id_map = IdMap(ids)
+    assert len(id_map) == 4
+
+    idx = id_map.to_idx(np.array([3, 7, 42, 1000]))
+    assert idx.dtype == np.int32
+    assert idx.tolist() == [0, 1, 2, 3]
+    assert id_map.to_external(idx).tolist() == [3, 7, 42, 1000]
+    assert id_map.get("42") == 2
+    assert id_map.get(5) is None
+    assert id_map.get("abc") is None
+
+
+def test_id_map_strings_and_unknown():
+    id_map = IdMap([10, 20])
+    idx = id_map.to_idx(np.array(["20", "abc", "", "30", "10"], dtype=object))
+    assert idx.tolist() == [1, -1, -1, -1, 0]
+
+
+def test_id_map_add_remove():
+    id_map = IdMap([10, 20])
+    new = id_map.add(15)
+    assert new == 2 and len(id_map) == 3
+    assert id_map.add(15) == new
+    assert id_map.add(10) == 0
+    assert id_map.to_idx(np.array([15, 20])).tolist() == [2, 1]
+    assert id_map.to_external(np.array([0, 2])).tolist() == [10, 15]
+
+    assert id_map.remove(new)
+    assert not id_map.remove(new)
+    assert not id_map.remove(0)
+    assert id_map.get(15) is None
+    assert id_map.to_external(np.array([2])).tolist() == [-1]
+    # Индексы удалённых id повторно не выдаются
+    assert id_map.add(15) == 3
+
+
+def test_csr_from_pairs():
+    rows = np.array([1, 0, 1, 1, -1, 0])
+    items = np.array([5, 6, 7, -1, 8, 9])
+    scores = np.array([0.1, 0.5, 0.9, 1.0, 1.0, 0.7])
+    csr = CSRLists.from_pairs(rows, items, scores, n_rows=3)
+
+    assert len(csr) == 3
+    assert csr.row(0)[0].tolist() == [9, 6]
+    assert csr.row(1)[0].tolist() == [7, 5]
+    np.testing.assert_allclose(csr.row(1)[1], [0.9, 0.1], rtol=1e-6)
+    assert len(csr.row(2)[0]) == 0
+    assert len(csr.row(None)[0]) == 0
+    assert len(csr.row(-1)[0]) == 0
+    assert len(csr.row(3)[0]) == 0
+
+
+def test_item_bitset():
+    bitset = ItemBitset(20, np.array([0, 3, 19, 25, -2, 3]))
+    assert len(bitset) == 3
+    assert bitset.contains(np.array([0, 1, 3, 19, 20, -1])).tolist() == [
+        True, False, True, True, False, False,
+    ]
+    assert len(ItemBitset(5)) == 0
+
+
+def test_lookup_scores():
+    keys = np.array([4, 2, 4, 9], dtype=np.int32)
+    scores = np.array([0.2, 0.5, 0.8, 0.1], dtype=np.float32)
+    out = lookup_scores(keys, scores, np.array([4, 1, 2, 9, 10], dtype=np.int32))
+    np.testing.assert_allclose(out, [0.8, 0.0, 0.5, 0.1, 0.0], rtol=1e-6)
+    assert lookup_scores(keys[:0], scores[:0], np.array([1])).tolist() == [0.0]
+
+
+def test_user_shards_match_scalar():
+    ids = np.array([0, 1, 2, 12345, 987654321, 2**40 + 7], dtype=np.int64)
+    for n_shards in (1, 2, 3, 8):
+        expected = [user_shard(str(u), n_shards) for u in ids.tolist()]
+        assert user_shards(ids, n_shards).tolist() == expected
+    assert 0 <= user_shard("guest-abc", 4) < 4
+    assert user_shard("guest-abc", 4) == user_shard("guest-abc", 4)
@@ -0,0 +1,74 @@
+import asyncio
+import threading
+
+import httpx
+import numpy as np
+
+import service.main as main
+from service.latency_controller import LatencyBudgetController
+from service.schemas import RankedItems
+
+
+def make_controller(budget_ms: float = 50.0) -> LatencyBudgetController:
+    controller = LatencyBudgetController(n_als=20, n_sim=10, last_k=5, budget_ms=budget_ms)
+    # 1 мс фиксированной части и 1 мс на кандидата
+    controller.record({"candidates_ms": 1.0, "features_ms": 15.0, "ranking_ms": 15.0}, 30)
+    return controller
+
+
+class BarrierService:
+    """Сервис-заглушка: все запросы планируют пул, находясь в обработке одновременно"""
+
+    exclude_events: set = set()
+
+    def __init__(self, n_requests: int):
+        self.latency_controller = make_controller()
+        self.barrier = threading.Barrier(n_requests, timeout=5)
+        self.plans = []
+
+    def get_recommedations(self, userid, recent_items, root_category, budget_ms, stats, **kwargs):
+        with self.latency_controller.track():
+            self.barrier.wait()
+            self.plans.append(self.latency_controller.plan(budget_ms))
+            self.barrier.wait()
+        stats["pool_size"] = 0
+        return RankedItems(np.array([1], dtype=np.int64), np.array([1.0]), "ranker")
+
+
+def test_plan_shrinks_with_queue_depth():
+    controller = make_controller()
+    n_als, n_sim, _ = controller.plan()
+    with controller.track(), controller.track(), controller.track(), controller.track():
+        busy_als, busy_sim, _ = controller.plan()
+    assert busy_als < n_als and busy_sim < n_sim
+
+
+def test_wait_idle():
+    controller = make_controller()
+    assert controller.wait_idle(0.01)
+    with controller.track():
+        assert controller.in_flight == 1
+        assert not controller.wait_idle(0.01)
+
+
+def test_concurrent_requests_reduce_pool():
+    """Запросы в одном event loop обрабатываются параллельно и делят бюджет"""
+    n = 4
+    service = BarrierService(n)
+    main.app.state.recommendation_service = service
+    main.app.state.precomputer = None
+
+    async def send_all():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(
+                *(client.post("/recommendations", params={"userid": u}) for u in "abcd")
+            )
+
+    single = make_controller().plan()
+    responses = asyncio.run(send_all())
+
+    assert all(r.status_code == 200 for r in responses)
+    assert len(service.plans) == n
+    for n_als, n_sim, _ in service.plans:
+        assert n_als < single[0] and n_sim < single[1]
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from metrics_utils import ndcg_grouped
+
+sklearn_metrics = pytest.importorskip("sklearn.metrics")
+
+
+def sklearn_ndcg(group, labels, scores, k):
+    values = []
+    for g in np.unique(group):
+        mask = group == g
+        if mask.sum() < 2:
+            continue
+        values.append(
+            sklearn_metrics.ndcg_score([labels[mask]], [scores[mask]], k=k)
+        )
+    return float(np.mean(values))
+
+
+@pytest.mark.parametrize("ties", [False, True])
+def test_ndcg_grouped_matches_sklearn(ties):
+    rng = np.random.default_rng(0)
+    n = 3000
+    group = rng.integers(0, 200, n)
+    labels = rng.integers(0, 4, n).astype(float)
+    scores = rng.random(n)
+    if ties:
+        scores = np.round(scores * 5)
+
+    metrics = ndcg_grouped(group, labels, scores, ks=(1, 5, 10, 20))
+    for k in (1, 5, 10, 20):
+        assert metrics[f"ndcg_{k}"] == pytest.approx(
+            sklearn_ndcg(group, labels, scores, k), abs=1e-9
+        )
+
+
+def test_ndcg_grouped_skips_small_groups_and_empty_input():
+    group = np.array([0, 1, 1])
+    labels = np.array([1.0, 0.0, 1.0])
+    scores = np.array([0.5, 0.9, 0.1])
+    metrics = ndcg_grouped(group, labels, scores, ks=(5,))
+    assert metrics["ndcg_5"] == pytest.approx(
+        sklearn_metrics.ndcg_score([labels[1:]], [scores[1:]], k=5)
+    )
+    assert np.isnan(ndcg_grouped(np.array([]), [], [], ks=(5,))["ndcg_5"])
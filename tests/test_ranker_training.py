@@ -0,0 +1,40 @@
+import numpy as np
+
+from ranker_training import sample_negatives
+
+
+def test_sample_negatives_quotas():
+    rng = np.random.default_rng(0)
+    group = rng.integers(0, 40, 2000)
+    gain = np.where(rng.random(2000) < 0.1, rng.integers(1, 4, 2000), 0).astype(float)
+    neg_ratio = 3
+
+    keep = sample_negatives(group, gain, neg_ratio, seed=1)
+    pos = gain > 0
+    # Все позитивные остаются
+    assert keep[pos].all()
+
+    for g in np.unique(group):
+        in_group = group == g
+        n_pos = int((in_group & pos).sum())
+        n_neg = int((in_group & ~pos).sum())
+        kept_neg = int((in_group & ~pos & keep).sum())
+        assert kept_neg == min(n_neg, n_pos * neg_ratio)
+
+
+def test_sample_negatives_drops_groups_without_positives():
+    group = np.array([0, 0, 0, 1, 1, 2, 2, 2])
+    gain = np.array([0, 0, 0, 1, 0, 0, 2, 0], dtype=float)
+    keep = sample_negatives(group, gain, neg_ratio=1)
+    assert not keep[group == 0].any()
+    assert keep.tolist()[3:5] == [True, True]
+    assert keep[group == 2].sum() == 2
+
+
+def test_sample_negatives_is_deterministic():
+    group = np.repeat(np.arange(10), 20)
+    gain = np.zeros(len(group))
+    gain[::20] = 1
+    a = sample_negatives(group, gain, neg_ratio=2, seed=7)
+    assert (a == sample_negatives(group, gain, neg_ratio=2, seed=7)).all()
+    assert not (a == sample_negatives(group, gain, neg_ratio=2, seed=8)).all()
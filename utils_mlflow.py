@@ -1,4 +1,5 @@
 import os
+from pathlib import Path
 from dotenv import load_dotenv
 import mlflow
 from mlflow import MlflowClient
@@ -17,6 +18,16 @@ def setup_mlflow_client():
     return client
 
 
+def setup_local_mlflow_client(store_dir="mlruns"):
+    """Файловое хранилище MLflow без tracking-сервера (локальные свипы)"""
+    uri = Path(store_dir).resolve().as_uri()
+
+    mlflow.set_tracking_uri(uri)
+    client = MlflowClient(tracking_uri=uri)
+
+    return client
+
+
 def setup_env():
     load_dotenv()
     # REGION: Это не обязательная часть, которую при вызове `load_dotenv()` можно не делать